@@ -6,12 +6,35 @@ Export package API for the python script
 from __future__ import print_function, unicode_literals
 from .__main__ import (
     DLvidu,                 # class
+    run_many,               # method (asyncio)
+    iter_many,
+    expand_urls,            # method
+)
+from .extract import (
+    StreamInfo,             # class
+    parse_format,           # method
+    select_streams,
+    format_itags,
+)
+from .tracing import (
+    set_trace,
 )
 from .utils import (
     logger,                 # data
     logging_console_handler,
     set_logging,            # method
     get_logginglevel,
+    set_log_rsp,
+    pattern_stats,
+    set_rate_limit,
+    parse_rate,
+    stream_stats,
+    progress,
+    ProgressMonitor,
+    set_replay,
+    set_archive,
+    download_archive,
+    DownloadArchive,
 )
 
 
@@ -23,8 +46,15 @@ __all__ = [
     # __init__
     'prog_version',
     # __main__
-    'DLvidu',
+    'DLvidu', 'run_many', 'iter_many', 'expand_urls',
+    # extract
+    'StreamInfo', 'parse_format', 'select_streams', 'format_itags',
     # utils
-    'logger', 'logging_console_handler', 'set_logging', 'get_logginglevel',
+    'logger', 'logging_console_handler', 'set_logging', 'get_logginglevel', 'set_log_rsp',
+    'pattern_stats', 'set_rate_limit', 'parse_rate',
+    'stream_stats', 'progress', 'ProgressMonitor',
+    'set_replay', 'set_archive', 'download_archive', 'DownloadArchive',
+    # tracing
+    'set_trace',
 ]
 
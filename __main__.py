@@ -5,6 +5,9 @@ A python script/package for saving videos from supported(*) sites
 """
 
 import re, sys
+import time
+import asyncio
+import concurrent.futures
 
 # add script path into pythonpath for pkg search (before main())
 if __package__ is None and not hasattr(sys, 'frozen'):
@@ -15,25 +18,104 @@ if __package__ is None and not hasattr(sys, 'frozen'):
 
 from ytb_ext.extract import (    # via extract/__init__.py
     YoutubeER,
+    select_streams,
+    format_itags,
+)
+from ytb_ext.utils import (
+    logger,
+    async_executor,
+    run_blocking,
+    download_archive,
 )
 
 
 class DLvidu(object):
     """Core API for this program"""
 
-    def __init__(self, req_url=None):
-        """Initialize and set the program"""
+    def __init__(self, req_url=None, fetch=True, info_ttl=None, itags=None):
+        """Initialize and set the program. Fetch and extract info now unless fetch=False
+           (ex. to do it later with _fetch_async). Video info cached within info_ttl secs
+           is served without fetching (0 to always fetch). itags, if known before (ex. idx
+           given, see format_itags), are the streams to download: the video is skipped with
+           no request if they are all in the download archive. If not, it's told once the
+           streams are chosen (see _download)
+        """
         self.orig_url = req_url
+        self.itags = [str(i) for i in itags] if itags else None
+        self.timings = {}                           # secs of phases: fetch, download, captions
+        self.results = []                           # result per stream of the last download
+        self.archived = False                       # streams asked in download archive: no download
 
         # find best-match extractor and video info
         # to be implemented...
         best_extract = YoutubeER
-        self.ex_obj = best_extract()                # instance obj for each video
+        self.ex_obj = best_extract(info_ttl=info_ttl)   # instance obj for each video
+        if not fetch or self._in_archive(self.itags): return
 
+        _begin = time.time()
         self.ex_obj.fetch_info(self.orig_url)       # fetch url info
 
 
         self.ex_obj.extract_info()                  # extract video/stream info
+        self.timings['fetch'] = round(time.time() - _begin, 3)
+
+
+    def _in_archive(self, itags=None):
+        """Return True (and mark it archived) if itags of the video of orig_url are all in the
+           download archive (set_archive), the video told from the url with no request.
+           False if no itags (not known yet)
+        """
+        _archive = download_archive()
+        if not _archive or not itags: return self.archived
+        _vidu_id = self.ex_obj.video_id(self.orig_url) or self.ex_obj.params.get('vidu_id')
+        if _vidu_id and _archive.has(self.ex_obj.er_id, _vidu_id, itags):
+            logger.info("%s: in download archive. skipped", _vidu_id)
+            self.ex_obj.params['vidu_id'] = _vidu_id
+            self.archived = True
+        return self.archived
+
+
+    def _archive_add(self):
+        """Record the video in the download archive if all of its streams are downloaded"""
+        _archive = download_archive()
+        if not _archive or not self.results: return
+        if all(i['status'] in ("done", "exists") for i in self.results):
+            _archive.add(self.ex_obj.er_id, self.ex_obj.params['vidu_id'],
+                         [i['itag'] for i in self.results])
+
+
+    async def _fetch_async(self):
+        """Fetch and extract info (asyncio)"""
+        if self._in_archive(self.itags): return self
+        _begin = time.time()
+        await self.ex_obj.fetch_info_async(self.orig_url)
+        await self.ex_obj.extract_info_async()
+        self.timings['fetch'] = round(time.time() - _begin, 3)
+        return self
+
+
+    async def _download_async(self, idx=None, dl_bar=None, connections=None, rate_limit=None,
+                              streams=None):
+        """Download the best or 'idx' list if any (asyncio). Return result per stream"""
+        self.dl_bar = dl_bar
+        if self.archived: return []
+        if not idx: self._get_streams()            # rank them (order "1") for the best ones
+        if self._in_archive(self._chosen(idx)): return []
+        _begin = time.time()
+        _ret = await self.ex_obj.download_streams_async(idx=idx, dl_bar=dl_bar,
+                                                        connections=connections, rate_limit=rate_limit,
+                                                        streams=streams)
+        self.timings['download'] = round(time.time() - _begin, 3)
+        self.results = _ret
+        self._archive_add()
+        return _ret
+
+
+    async def _captions_async(self, fmt="srt"):
+        """Download captions/subtitles as fmt ("srt" or "vtt") files (asyncio)"""
+        _begin = time.time()
+        await self.ex_obj.download_captions_async(fmt=fmt)
+        self.timings['captions'] = round(time.time() - _begin, 3)
 
 
     def _get_streams(self):
@@ -42,10 +124,38 @@ class DLvidu(object):
         return _ret
 
 
-    def _download(self, idx=None, dl_bar=None):
-        """Download the best or 'idx' list if any. Call back dl_bar if any during progress"""
+    def _download(self, idx=None, dl_bar=None, connections=None, rate_limit=None, streams=None):
+        """Download the best or 'idx' list if any. Call back dl_bar if any during progress
+           (every progress.interval secs, see ProgressMonitor).
+           Upto 'streams' at once (ex. video and audio together), sharing upto 'connections'
+           at once and rate_limit (bytes/sec) if given of the video.
+           Return result per stream (itag, fn, bytes, secs, status, error)
+        """
         self.dl_bar = dl_bar
-        self.ex_obj.download_streams(idx=idx, dl_bar=dl_bar)
+        if self.archived: return []
+        if not idx: self._get_streams()            # rank them (order "1") for the best ones
+        if self._in_archive(self._chosen(idx)): return []
+        _begin = time.time()
+        _ret = self.ex_obj.download_streams(idx=idx, dl_bar=dl_bar, connections=connections,
+                                            rate_limit=rate_limit, streams=streams)
+        self.timings['download'] = round(time.time() - _begin, 3)
+        self.results = _ret
+        self._archive_add()
+        return _ret
+
+
+    def _chosen(self, idx=None):
+        """Return itags (str) to download: idx, or else the best ones (ranked)"""
+        if idx: return [str(i) for i in idx]
+        return [str(i.itag) for i in self.ex_obj.params['streams'] if i.order == "1"]
+
+
+    def _select(self, fmt=None):
+        """Return itags (str) of the streams chosen by format expression fmt (see
+           parse_format), [] if none matches
+        """
+        self._get_streams()                         # ranks them for 'best' etc
+        return [str(i.itag) for i in select_streams(self.ex_obj.params['streams'], fmt)]
 
 
     def _list_captions(self):
@@ -54,9 +164,143 @@ class DLvidu(object):
         return _ret
 
 
-    def _captions(self):
-        """Download captions/subtitles"""
-        self.ex_obj.download_captions()
+    def _captions(self, fmt="srt"):
+        """Download captions/subtitles as fmt ("srt" or "vtt") files"""
+        _begin = time.time()
+        self.ex_obj.download_captions(fmt=fmt)
+        self.timings['captions'] = round(time.time() - _begin, 3)
+
+
+def expand_urls(urls=None):
+    """Yield the video urls of urls: playlist/channel ones are expanded lazily, a page at a
+       time while the videos are consumed (the next page being fetched meanwhile)
+    """
+    for url in urls or []:
+        yield from YoutubeER(info_ttl=0).expand_url(url)
+
+
+def _expand_each(urls=None):
+    """Yield (video url, None) as expand_urls, or (url, the exception raised) for a url
+       failing to expand, and go on with the next urls
+    """
+    for url in urls or []:
+        try:
+            for i in YoutubeER(info_ttl=0).expand_url(url): yield i, None
+        except Exception as e:
+            logger.error("%s: failed to expand (%s)", url, e)
+            yield url, e
+
+
+_THREADS = 16                   # default threads for the blocking work of iter_many/run_many
+
+
+async def _many(urls=None, concurrency=8, list_only=False, idx=None, dl_bar=None,
+                connections=None, captions=True, info_ttl=None, rate_limit=None, fmt=None,
+                streams=None, threads=None):
+    """Async generator of (n, url, DLvidu or the exception raised) of iter_many, n being
+       the position of url in the expanded urls
+    """
+    _urls = enumerate(_expand_each(urls))
+    _pull = asyncio.Lock()                  # one puller at a time of the (blocking) generator
+    _done = asyncio.Queue(maxsize=concurrency)
+    _inflight = {}                          # vidu_id -> [asyncio.Lock, users] of videos in progress
+
+    async def _one(url):
+        dlv = DLvidu(url, fetch=False, info_ttl=info_ttl, itags=idx or format_itags(fmt))
+        _vid = dlv.ex_obj.video_id(url) or url
+        _busy = _inflight.setdefault(_vid, [asyncio.Lock(), 0])
+        _busy[1] += 1
+        try:
+            async with _busy[0]:    # same video once at a time: a repeat sees it archived/done
+                return await _one_video(dlv, url)
+        finally:
+            _busy[1] -= 1
+            if not _busy[1]: del _inflight[_vid]
+
+    async def _one_video(dlv, url):
+        await dlv._fetch_async()
+        if list_only or dlv.archived: return dlv
+        _idx = idx
+        if fmt:
+            _idx = dlv._select(fmt)
+            if not _idx and dlv.ex_obj.params['streams']:
+                raise LookupError("no stream of %s matches format '%s'" % (url, fmt))
+        await dlv._download_async(idx=_idx, dl_bar=dl_bar, connections=connections,
+                                  rate_limit=rate_limit, streams=streams)
+        if dlv.archived: return dlv             # the streams chosen were downloaded before
+        if captions and dlv._list_captions():
+            await dlv._captions_async(fmt=captions if isinstance(captions, str) else "srt")
+        return dlv
+
+    async def _worker():
+        while True:
+            async with _pull:
+                n, (url, _res) = await run_blocking(next, _urls, (None, (None, None)))
+            if url is None: return
+            try:
+                if _res is None: _res = await _one(url)     # else it failed to expand
+            except Exception as e:
+                _res = e
+            await _done.put((n, url, _res))
+
+    # blocking parts (extractors and transport are blocking) run in a pool of 'threads', set
+    # for the workers' context. more videos in flight than threads wait for one
+    _threads = max(1, min(threads or _THREADS, concurrency))
+    _pool = concurrent.futures.ThreadPoolExecutor(max_workers=_threads)
+    _token = async_executor.set(_pool)
+    try:
+        _workers = [asyncio.ensure_future(_worker()) for _ in range(concurrency)]
+    finally:
+        async_executor.reset(_token)
+    _all = asyncio.ensure_future(asyncio.gather(*_workers))
+    try:
+        while not (_all.done() and _done.empty()):
+            _get = asyncio.ensure_future(_done.get())
+            await asyncio.wait([_get, _all], return_when=asyncio.FIRST_COMPLETED)
+            if _get.done(): yield _get.result()
+            else: _get.cancel()
+        _all.result()                       # raise if a worker failed (ex. in the generator)
+    finally:
+        _all.cancel()                       # and the workers (no-op if all done)
+        _all.add_done_callback(lambda f: f.cancelled() or f.exception())   # retrieved
+        # not waiting for blocking work still in flight (stopped early or failed): it'd block
+        # the event loop until all of it is done. queued work is dropped (py3.9+)
+        if sys.version_info >= (3, 9): _pool.shutdown(wait=False, cancel_futures=True)
+        else: _pool.shutdown(wait=False)
+
+
+async def iter_many(urls=None, concurrency=8, list_only=False, idx=None, dl_bar=None,
+                    connections=None, captions=True, info_ttl=None, rate_limit=None, fmt=None,
+                    streams=None, threads=None):
+    """Async generator of (url, DLvidu or the exception raised) as each video of urls is
+       done, extracted (and downloaded unless list_only) upto 'concurrency' at once on one
+       event loop. Extractors and transport are blocking: each phase of a video runs in a
+       pool of 'threads' (default _THREADS, at most concurrency, see run_blocking), so no more
+       videos than threads make progress at once, the others waiting for a free thread.
+       urls may be any iterable; they and playlists/channels in them are pulled only as
+       workers get free, so the first videos are downloaded while later pages are still
+       being fetched, and nothing is kept once yielded. rate_limit (bytes/sec) applies to
+       each video, shared by upto 'streams' of it downloaded at once; use set_rate_limit()
+       for a budget shared by all of them. fmt, if given, is the format expression (see
+       parse_format) choosing the streams per video instead of idx. The results of the
+       downloads per stream are in DLvidu.results. captions may be given the format of
+       them: "srt" (as True) or "vtt"
+    """
+    async for _, url, i in _many(urls, concurrency, list_only, idx, dl_bar, connections,
+                                 captions, info_ttl, rate_limit, fmt, streams, threads):
+        yield url, i
+
+
+async def run_many(urls=None, concurrency=8, list_only=False, idx=None, dl_bar=None,
+                   connections=None, captions=True, info_ttl=None, rate_limit=None, fmt=None,
+                   streams=None, threads=None):
+    """Extract (and download unless list_only) each video of urls on one event loop, upto
+       'concurrency' videos at once (see iter_many). Return list of DLvidu, or the exception
+       raised, in the order of urls (playlists/channels expanded in place)
+    """
+    _res = [i async for i in _many(urls, concurrency, list_only, idx, dl_bar, connections,
+                                   captions, info_ttl, rate_limit, fmt, streams, threads)]
+    return [i for _, _, i in sorted(_res, key=lambda o: o[0])]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3.7
+# -*- coding: utf-8 -*-
+"""
+Benchmark extraction and download against a local fake Youtube (loopback http server),
+or extraction phases over captured responses (--replay). Results are printed (or saved)
+as json, to compare the hot paths from a commit to another.
+"""
+
+from __future__ import print_function, unicode_literals
+import sys
+import os
+import re
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import contextlib
+import http.server
+import urllib.parse as parse
+from xml.sax.saxutils import escape
+
+# add script path into pythonpath for pkg search (before main())
+if __package__ is None and not hasattr(sys, 'frozen'):
+    # direct call of bench.py
+    path = os.path.realpath(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.dirname(os.path.dirname(path)))
+
+from ytb_ext import (     # absolute import in main module
+    DLvidu,
+    prog_version,
+    set_logging,
+)
+from ytb_ext.utils import (
+    http_get,
+    http_stream,
+    http_pool,
+    TokenBucket,
+    set_replay,
+    read_log,
+    _ReplayResponse,
+)
+from ytb_ext.extract import YoutubeER
+from ytb_ext.extract import youtube
+from ytb_ext.jsinterp import (
+    parse_js,
+    compile_decipher,
+)
+
+
+_VIDU_ID = "bEnChVidu01"
+_JS_PATH = "/s/player/benchp01/player_ias.vflset/en_US/base.js"
+# decipher of the fake base.js, in jsinterp opcodes. the server signs urls with it
+_JS_OPS = [["split", None], ["swap0", 3], ["reverse", 50], ["splice0rm", 2],
+           ["swap0", 41], ["reverse", 7], ["join", None]]
+_JS_CODE = """var Bz={ab:function(a,b){var c=a[0];a[0]=a[b%a.length];a[b%a.length]=c},
+cd:function(a){a.reverse()},
+ef:function(a,b){a.splice(0,b)}};
+Xy=function(a){a=a.split("");Bz.ab(a,3);Bz.cd(a,50);Bz.ef(a,2);Bz.ab(a,41);Bz.cd(a,7);return a.join("")};
+var g={};g.Cw=function(a,b,c){c&&a.set(b,encodeURIComponent(Xy(decodeURIComponent(c))))};
+"""
+# streams: (itag, mimeType, size ratio of the media size, contentLength given, ciphered)
+_FORMATS = [
+    (18,  'video/mp4; codecs="avc1.42001E, mp4a.40.2"', 0.5, True, False),
+    (137, 'video/mp4; codecs="avc1.640028"', 1.0, False, True),     # size by HEAD
+    (248, 'video/webm; codecs="vp9"', 0.9, True, True),
+    (140, 'audio/mp4; codecs="mp4a.40.2"', 0.1, True, True),
+    (251, 'audio/webm; codecs="opus"', 0.1, False, True),          # size by HEAD
+]
+_HEIGHT = {18: 360, 137: 1080, 248: 1080}
+_QUALITY = {360: "medium", 1080: "hd1080"}
+_BLOCK = bytes(range(256)) * 1024 * 2      # media byte at offset p is p%256 (2 x 256K)
+
+
+class FakeYoutube(object):
+    """Loopback http server playing Youtube for one video: watch (ytplayer.config) and
+       embed (yt.setConfig) pages, get_video_info, base.js with a known cipher, captions
+       xml, and range-capable media whose urls are signed with that cipher. Each reply can
+       be delayed by 'latency' secs, and media sent at upto 'throttle' bytes/sec per request.
+    """
+    def __init__(self, media_size=8*1048576, latency=0.0, throttle=0, caption_lines=2000,
+                 age_gate=False):
+        self.media_size = media_size
+        self.latency = latency
+        self.throttle = throttle
+        self.caption_lines = caption_lines
+        self.age_gate = age_gate
+        self.counts = {}            # requests by method and path
+        self.lock = threading.Lock()
+        self.decipher = compile_decipher(_JS_OPS)
+        self.sigs = {}              # itag -> signature expected in media url
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:%d" % self.server.server_port
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-youtube", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, key):
+        with self.lock: self.counts[key] = self.counts.get(key, 0) + 1
+
+    def size_of(self, itag):
+        for _itag, _, _ratio, _, _ in _FORMATS:
+            if _itag == itag: return max(int(self.media_size * _ratio), 1)
+        return 0
+
+    def player_response(self):
+        _expire = int(time.time()) + 6*3600
+        _rnd = random.Random(1)
+        _fmts = [] ; _adapt = []
+        for _itag, _mimetype, _, _has_len, _ciphered in _FORMATS:
+            _size = self.size_of(_itag)
+            _url = "%s/videoplayback?itag=%d&expire=%d&mime=%s" % (
+                   self.url, _itag, _expire, parse.quote(_mimetype.split(";")[0], safe=""))
+            _fmt = {"itag": _itag, "mimeType": _mimetype, "averageBitrate": _size*8000//60000,
+                    "approxDurationMs": "60000", "lastModified": "1600000000000000",
+                    "quality": _QUALITY.get(_HEIGHT.get(_itag), "tiny")}
+            if _itag in _HEIGHT:
+                _fmt.update({"width": _HEIGHT[_itag]*16//9, "height": _HEIGHT[_itag],
+                             "qualityLabel": "%dp" % _HEIGHT[_itag]})
+            else:
+                _fmt.update({"audioQuality": "AUDIO_QUALITY_MEDIUM", "audioSampleRate": "48000"})
+            if _has_len: _fmt['contentLength'] = str(_size)
+            if _ciphered:
+                _s = "".join(_rnd.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789")
+                             for _ in range(104))
+                self.sigs[_itag] = self.decipher(_s)
+                _fmt['signatureCipher'] = parse.urlencode([("s", _s), ("sp", "sig"), ("url", _url)])
+            else:
+                _fmt['url'] = _url
+            (_fmts if "avc1.42001E" in _mimetype else _adapt).append(_fmt)
+        _desc = "".join("%02d:%02d - Part %d\n" % (i, i*7 % 60, i+1) for i in range(4))
+        return {
+            "videoDetails": {"videoId": _VIDU_ID, "title": "Bench video",
+                             "shortDescription": "Synthetic video.\n" + _desc},
+            "playabilityStatus": {"status": "OK"},
+            "streamingData": {"formats": _fmts, "adaptiveFormats": _adapt},
+            "captions": {"playerCaptionsTracklistRenderer": {"captionTracks": [
+                {"baseUrl": "%s/api/timedtext?v=%s&lang=%s" % (self.url, _VIDU_ID, _lang),
+                 "languageCode": _lang, "name": {"simpleText": _lang}}
+                for _lang in ("en", "fr")]}},
+        }
+
+    def watch_html(self):
+        _cfg = {"assets": {"js": _JS_PATH},
+                "args": {"player_response": json.dumps(self.player_response())}}
+        _meta = '<meta property="og:restrictions:age" content="18+">' if self.age_gate else ""
+        return ('<!DOCTYPE html><html><head><title>Bench video - YouTube</title>%s</head><body>'
+                '<div id="player"></div><script>var ytplayer = ytplayer || {};'
+                'ytplayer.config = %s;ytplayer.web_player_context_config = {"rootElementId":"movie_player"};'
+                'ytplayer.load = function() {};</script></body></html>' % (_meta, json.dumps(_cfg)))
+
+    def embed_html(self):
+        _cfg = {"assets": {"js": _JS_PATH}, "args": {}, "sts": 18500}
+        return ('<!DOCTYPE html><html><body><script>var x=1;yt.setConfig({\'PLAYER_CONFIG\': %s});'
+                'yt.setConfig({"sts": 18500});</script></body></html>' % json.dumps(_cfg))
+
+    def video_info(self):
+        return parse.urlencode([("status", "ok"), ("player_response", json.dumps(self.player_response()))])
+
+    def caption_xml(self):
+        _lines = ['<?xml version="1.0" encoding="utf-8" ?><transcript>']
+        for i in range(self.caption_lines):
+            _lines.append('<text start="%.2f" dur="%.2f">%s</text>' %
+                          (i*2.5, 3.1, escape("line %d: we&#39;re at &quot;%d&quot;" % (i+1, i))))
+        _lines.append('</transcript>')
+        return "\n".join(_lines)
+
+    def _handler(self):
+        fake = self
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args): pass
+
+            def _reply(self, code=200, body=b"", ctype="text/html; charset=utf-8", length=None,
+                       extra=None, send=True):
+                self.send_response(code)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body) if length is None else length))
+                for k, v in (extra or {}).items(): self.send_header(k, v)
+                self.end_headers()
+                if send and body: self.wfile.write(body)
+
+            def _media(self, send=True):
+                _qs = parse.parse_qs(parse.urlparse(self.path).query)
+                _itag = int(_qs.get('itag', ['0'])[0])
+                _size = fake.size_of(_itag)
+                if not _size: return self._reply(404, b"no such itag", send=send)
+                if _itag in fake.sigs and _qs.get('sig', [''])[0] != fake.sigs[_itag]:
+                    return self._reply(403, b"bad signature", send=send)
+                _lp, _rp, _code, _extra = 0, _size-1, 200, {"Accept-Ranges": "bytes"}
+                _mobj = re.match(r'bytes=(\d+)-(\d+)?', self.headers.get("Range") or "")
+                if _mobj:
+                    _lp = int(_mobj.group(1))
+                    _rp = min(int(_mobj.group(2) or _size-1), _size-1)
+                    if _lp > _rp: return self._reply(416, send=send)
+                    _code = 206
+                    _extra['Content-Range'] = "bytes %d-%d/%d" % (_lp, _rp, _size)
+                self._reply(_code, ctype="video/mp4", length=_rp-_lp+1, extra=_extra, send=False)
+                if not send: return
+                _view = memoryview(_BLOCK)
+                _pos, _start = _lp, time.time()
+                while _pos <= _rp:
+                    _off = _pos % 262144
+                    _n = min(262144, _rp-_pos+1)
+                    self.wfile.write(_view[_off:_off+_n])
+                    _pos += _n
+                    if fake.throttle:           # keep under throttle bytes/sec
+                        _ahead = (_pos-_lp) / fake.throttle - (time.time()-_start)
+                        if _ahead > 0: time.sleep(_ahead)
+
+            def _route(self, send=True):
+                _path = parse.urlparse(self.path).path
+                fake.count("%s %s" % (self.command, _path))
+                if fake.latency: time.sleep(fake.latency)
+                if _path == "/videoplayback": return self._media(send)
+                if _path == "/watch":          _body = fake.watch_html()
+                elif _path.startswith("/embed/"): _body = fake.embed_html()
+                elif _path == "/get_video_info": _body = fake.video_info()
+                elif _path == _JS_PATH:        _body = _JS_CODE
+                elif _path == "/api/timedtext": _body = fake.caption_xml()
+                else: return self._reply(404, b"not found", send=send)
+                self._reply(200, _body.encode('utf-8'), send=send)
+
+            def do_GET(self):  self._route()
+            def do_HEAD(self): self._route(send=False)
+
+        return _Handler
+
+
+def _stats(samples=None):
+    """Summary of timing samples in secs"""
+    _s = sorted(samples or [])
+    if not _s: return {}
+    return {"n": len(_s), "min": round(_s[0], 6), "median": round(_s[len(_s)//2], 6),
+            "mean": round(sum(_s)/len(_s), 6), "max": round(_s[-1], 6)}
+
+
+def _timeit(func, repeat=1):
+    """Return list of secs taken by each of 'repeat' calls of func()"""
+    _ret = []
+    for _ in range(repeat):
+        _begin = time.perf_counter()
+        func()
+        _ret.append(time.perf_counter() - _begin)
+    return _ret
+
+
+def _reset_js_cache():
+    """Forget the js decipher cached (in process and on disk) so that js is fetched again"""
+    youtube._JS_DECIPHER.clear()
+    _fn = YoutubeER().js_cache_fn
+    if os.path.isfile(_fn): os.remove(_fn)
+
+
+def bench_extract(fake=None, repeat=5):
+    """DLvidu fetch+extract latency, with js decipher not cached (cold) or cached (warm)"""
+    _url = "%s/watch?v=%s" % (fake.url, _VIDU_ID)
+    _ret = {}
+    for _mode in ("cold", "warm"):
+        _samples = []
+        for _ in range(repeat):
+            if _mode == "cold": _reset_js_cache()
+            _begin = time.perf_counter()
+            dlv = DLvidu(_url, info_ttl=0)
+            _samples.append(time.perf_counter() - _begin)
+            if len(dlv.ex_obj.params['streams']) != len(_FORMATS):
+                raise RuntimeError("extracted %d of %d streams" % (len(dlv.ex_obj.params['streams']),
+                                                                     len(_FORMATS)))
+        _ret[_mode] = _stats(_samples)
+    return _ret
+
+
+def bench_stream(fake=None, repeat=3, connections=4, chunk_size=1048576):
+    """http_stream throughput (MB/s) of the largest stream, in one request and in chunks, and
+       in chunks under a rate limit (4 chunks/sec, 64K burst: each chunk waits for it)
+    """
+    _url = "%s/videoplayback?itag=137&sig=%s" % (fake.url, fake.sigs[137])
+    _size = fake.size_of(137)
+    _ret = {"bytes": _size}
+    for _name, _chunk, _conns, _limit in (("whole", None, 1, None), ("chunked", chunk_size, 1, None),
+                                          ("parallel", chunk_size, connections, None),
+                                          ("limited", chunk_size, 1, 4*chunk_size)):
+        _samples = []
+        for _ in range(repeat):
+            _fn = "bench_%s.bin" % _name
+            _begin = time.perf_counter()
+            _res = http_stream(_url, fn=_fn, tot_bytes=_size, http_chunk_size=_chunk,
+                               connections=_conns,
+                               rate_limit=TokenBucket(_limit, 65536) if _limit else None)
+            _samples.append(time.perf_counter() - _begin)
+            if _res or os.path.getsize(_fn) != _size:
+                raise RuntimeError("http_stream %s failed: %s" % (_name, _res))
+            with open(_fn, "rb") as fp:         # spot check content
+                fp.seek(_size//3)
+                if fp.read(1)[0] != (_size//3) % 256:
+                    raise RuntimeError("http_stream %s: wrong content" % _name)
+            os.remove(_fn)
+        _ret[_name] = {"connections": _conns, "chunk_size": _chunk, "rate_limit": _limit,
+                       "secs": _stats(_samples),
+                       "mb_per_sec": round(_size/1048576/sorted(_samples)[len(_samples)//2], 3)}
+    return _ret
+
+
+def bench_head(fake=None, repeat=20):
+    """HEAD round trip, and _resolve_sizes() of streams missing contentLength"""
+    _url = "%s/videoplayback?itag=18" % fake.url
+    _heads = _timeit(lambda: http_get(_url, method="HEAD"), repeat)
+    dlv = DLvidu("%s/watch?v=%s" % (fake.url, _VIDU_ID), info_ttl=0)
+    _streams = dlv.ex_obj.params['streams']
+    _todo = [i for i in _streams if i.file_sz <= 0]
+
+    def _resolve():
+        for i in _todo: i.file_sz = -1
+        dlv.ex_obj._resolve_sizes(_todo)
+    _resolves = _timeit(_resolve, repeat)
+    return {"head": _stats(_heads), "resolve_sizes": _stats(_resolves), "streams_headed": len(_todo)}
+
+
+def bench_captions(fake=None, repeat=5):
+    """Caption xml to srt conversion, and download of all captions of the video"""
+    data, _, _ = http_get("%s/api/timedtext?v=%s&lang=en" % (fake.url, _VIDU_ID))
+    dlv = DLvidu("%s/watch?v=%s" % (fake.url, _VIDU_ID), info_ttl=0)
+    _convert = _timeit(lambda: dlv.ex_obj._vtt_to_srt(data), repeat)
+    _download = _timeit(dlv._captions, repeat)
+    return {"lines": fake.caption_lines, "convert": _stats(_convert),
+            "lines_per_sec": int(fake.caption_lines / sorted(_convert)[len(_convert)//2]),
+            "download_all": _stats(_download), "tracks": len(dlv.ex_obj.params['captions'])}
+
+
+_BENCHES = {"extract": bench_extract, "stream": bench_stream, "head": bench_head,
+            "captions": bench_captions}
+
+
+def _git_commit():
+    """Commit id of the source tree if it's a git repo (None if not)"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))
+                                      ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextlib.contextmanager
+def _sandbox(base_url=None):
+    """Run in a temp dir (files written and caches), with YoutubeER on base_url if given"""
+    _cwd = os.getcwd()
+    _cache_env = os.environ.get("YTB_EXT_CACHE_DIR")
+    _base_url = YoutubeER.base_url
+    _tmpdir = tempfile.mkdtemp(prefix="ytb_ext_bench")
+    try:
+        os.chdir(_tmpdir)
+        os.environ["YTB_EXT_CACHE_DIR"] = os.path.join(_tmpdir, "cache")
+        if base_url: YoutubeER.base_url = base_url
+        youtube._JS_DECIPHER.clear()
+        yield _tmpdir
+    finally:
+        YoutubeER.base_url = _base_url
+        if _cache_env is None: os.environ.pop("YTB_EXT_CACHE_DIR", None)
+        else: os.environ["YTB_EXT_CACHE_DIR"] = _cache_env
+        os.chdir(_cwd)
+        shutil.rmtree(_tmpdir, ignore_errors=True)
+        http_pool.close()
+
+
+def _report(params=None, results=None):
+    return {"bench": "ytb_ext", "version": prog_version, "commit": _git_commit(),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "params": params, "results": results}
+
+
+def run_bench(names=None, media_size=8*1048576, latency=0.0, throttle=0, caption_lines=2000,
+              age_gate=False, repeat=3, connections=4, chunk_size=1048576):
+    """Run the benchmarks 'names' (default all) against a new FakeYoutube in a temp dir (files
+       and caches). Return dict of results, json-able
+    """
+    fake = FakeYoutube(media_size=media_size, latency=latency, throttle=throttle,
+                       caption_lines=caption_lines, age_gate=age_gate).start()
+    fake.player_response()                  # sign the media urls
+    _params = {"media_size": media_size, "latency": latency, "throttle": throttle,
+               "caption_lines": caption_lines, "age_gate": age_gate, "repeat": repeat,
+               "connections": connections, "chunk_size": chunk_size}
+    _results = {}
+    try:
+        with _sandbox(fake.url):
+            for _name in names or list(_BENCHES):
+                _kwargs = {"repeat": repeat}
+                if _name == "stream": _kwargs.update(connections=connections, chunk_size=chunk_size)
+                if _name == "head":   _kwargs['repeat'] = max(repeat, 10)
+                _before = dict(fake.counts)
+                _results[_name] = _BENCHES[_name](fake, **_kwargs)
+                _results[_name]['requests'] = {k: v - _before.get(k, 0) for k,v in fake.counts.items()
+                                               if v - _before.get(k, 0)}
+    finally:
+        fake.stop()
+    return _report(_params, _results)
+
+
+def _replay_video(vidu_id=None, dirname=None, repeat=3):
+    """Per-phase secs of one video replayed from its captures: _fetch_info, _extract_info
+       (js decipher cached after the first run), parse_js of its js and _sort_streams
+    """
+    _url = "https://www.youtube.com/watch?v=%s" % vidu_id
+    _phases = {"fetch_info": [], "extract_info": [], "parse_js": [], "sort_streams": []}
+    _ret = {}
+    for _ in range(repeat):
+        ex = YoutubeER(info_ttl=0)
+        _phases['fetch_info'] += _timeit(lambda: ex._fetch_info(_url))
+        _phases['extract_info'] += _timeit(ex._extract_info)
+        _phases['sort_streams'] += _timeit(ex._sort_streams)
+        _ret['streams'] = len(ex.params['streams'])
+        _ret['captions'] = len(ex.params['captions'])
+    _js_fn = os.path.join(dirname, "%s__js.gz" % vidu_id)
+    if os.path.isfile(_js_fn):
+        _jscode = _ReplayResponse(read_log(_js_fn)).body
+        _phases['parse_js'] = _timeit(lambda: parse_js(youtube._PTRNS_DECIPHER, key="sig",
+                                                       jscode=_jscode), repeat)
+    _ret.update({k: _stats(v) for k,v in _phases.items() if v})
+    return _ret, _phases
+
+
+def run_replay(dirname=None, repeat=3):
+    """Run extraction phases over the corpus of captures in dirname (<vidu_id>__html.gz and
+       the others of the same video), served by the replay transport, no network. Return
+       dict of results per video and of all, json-able
+    """
+    dirname = os.path.abspath(dirname)
+    _ids = sorted(i[:-len("__html.gz")] for i in os.listdir(dirname) if i.endswith("__html.gz"))
+    if not _ids: raise ValueError("no <vidu_id>__html.gz captures in %s" % dirname)
+    _videos = {}
+    _all = {}
+    set_replay(dirname)
+    try:
+        with _sandbox():
+            for _id in _ids:
+                _videos[_id], _phases = _replay_video(_id, dirname, repeat)
+                for k,v in _phases.items(): _all.setdefault(k, []).extend(v)
+    finally:
+        set_replay(None)
+    return _report({"replay": dirname, "videos": len(_ids), "repeat": repeat},
+                   {"replay": {"videos": _videos, "all": {k: _stats(v) for k,v in _all.items()}}})
+
+
+def bench_main():
+    """CLI of the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("names", nargs="*", metavar="NAME",
+        help="Benchmarks to run: %s (default all)" % ", ".join(_BENCHES))
+    parser.add_argument("-s", "--size", type=float, dest="size", default=8, metavar="MB",
+        help="Size of the largest media stream in MB (default 8)")
+    parser.add_argument("-n", "--repeat", type=int, dest="repeat", default=3, metavar="NUM",
+        help="Runs of each measure (default 3)")
+    parser.add_argument("-N", type=int, dest="connections", default=4, metavar="NUM",
+        help="Connections of the parallel stream download (default 4)")
+    parser.add_argument("--chunk", type=float, dest="chunk", default=1, metavar="MB",
+        help="Initial chunk size of the chunked stream downloads in MB (default 1)")
+    parser.add_argument("--latency", type=float, dest="latency", default=0, metavar="MS",
+        help="Delay of each reply of the server in ms")
+    parser.add_argument("--throttle", type=float, dest="throttle", default=0, metavar="KB/S",
+        help="Rate of media per request in KB/s (default no limit)")
+    parser.add_argument("--captions", type=int, dest="caption_lines", default=2000, metavar="NUM",
+        help="Lines of each caption (default 2000)")
+    parser.add_argument("--age-gate", action="store_true", dest="age_gate", default=False,
+        help="Serve the video as age restricted (embed page and get_video_info)")
+    parser.add_argument("--replay", dest="replay", default=None, metavar="DIR",
+        help="Instead, time extraction phases over the captures (saved with -vvvv) in DIR")
+    parser.add_argument("-o", dest="output", default=None, metavar="FILE",
+        help="Save the json results into FILE (default stdout)")
+    args = parser.parse_args()
+    for _name in args.names:
+        if _name not in _BENCHES: parser.error("unknown benchmark '%s'" % _name)
+
+    set_logging()
+    if args.replay:
+        try:
+            _res = run_replay(args.replay, repeat=max(args.repeat, 1))
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    else:
+        _res = run_bench(names=args.names, media_size=int(args.size*1048576),
+                         latency=args.latency/1000.0, throttle=int(args.throttle*1024),
+                         caption_lines=args.caption_lines, age_gate=args.age_gate,
+                         repeat=max(args.repeat, 1), connections=args.connections,
+                         chunk_size=int(args.chunk*1048576))
+    _out = json.dumps(_res, indent=2)
+    if args.output:
+        with open(args.output, "w") as fp: fp.write(_out + "\n")
+    else:
+        print(_out)
+
+
+if __name__ == '__main__':
+    bench_main()
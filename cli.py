@@ -4,7 +4,9 @@ The CLI (Command Line Interface) entry to the python program
 """
 
 from __future__ import unicode_literals
-import sys
+import re, sys
+import json
+import asyncio
 import shutil
 import logging
 import argparse
@@ -26,9 +28,8 @@ from ytb_ext import *    # absolute import in main module
 w_size = {'w_col': 80, 'w_row': 24} # CLI terminal size
 
 
-def progress_bar(curr_size, tot_size, start_epoch=None, ch="█", scale=0.68):
-    """Show progress bar of downloading. Example:
-    PSY - GANGNAM STYLE(강남스타일) MV.mp4
+def _bar_text(curr_size, tot_size, elapsed=0, secleft=None, rate=None, ch="█", scale=0.68):
+    """Format a progress bar line of curr_size of tot_size bytes. Example:
     ↳ |███████████████████████████████████████| 100.0%
     """
     w_width = int(w_size['w_col'] * scale)
@@ -36,22 +37,130 @@ def progress_bar(curr_size, tot_size, start_epoch=None, ch="█", scale=0.68):
     remaining = w_width - filled
     bar = ch * filled + " " * remaining
     percent = round(100.0 * curr_size / float(tot_size), 1)
-    elapsed = time.time() - start_epoch
-    if start_epoch and percent >= 0.1 and (curr_size < int(tot_size)):
-        secleft=int(elapsed * (100-percent)/percent)
+    if secleft is not None and (curr_size < int(tot_size)):
         timeleft = "ETA %s" % time.strftime("%H:%M:%S", time.gmtime(secleft))
     elif curr_size == int(tot_size):
         timeleft = "dur %s" % time.strftime("%H:%M:%S", time.gmtime(elapsed))
     else: timeleft = ""         # when %=0
-    text = " ↳ |{bar}| {percent}% ({cur:>0.1f}/{tot:<0.1f}MB){sep}{timeleft}\r".format(
+    if rate: timeleft = "{:0.1f}MB/s{}{}".format(rate/1048576, ", " if timeleft else "", timeleft)
+    return " ↳ |{bar}| {percent}% ({cur:>0.1f}/{tot:<0.1f}MB){sep}{timeleft}".format(
             bar=bar, percent=percent, cur=curr_size/1048576, tot=tot_size/1048576,
             sep=", " if timeleft else "", timeleft=timeleft)
+
+
+def progress_bar(curr_size, tot_size, start_epoch=None, ch="█", scale=0.68):
+    """Show progress bar of downloading. Example:
+    PSY - GANGNAM STYLE(강남스타일) MV.mp4
+    ↳ |███████████████████████████████████████| 100.0%
+    """
+    percent = 100.0 * curr_size / float(tot_size)
+    elapsed = time.time() - start_epoch
+    secleft = int(elapsed * (100-percent)/percent) if start_epoch and percent >= 0.1 else None
+    text = _bar_text(curr_size, tot_size, elapsed, secleft, ch=ch, scale=scale) + "\r"
     # use write() to avoid newline and flush() to force buffer onto stdout
     sys.stdout.write(text)
     if (curr_size == tot_size): sys.stdout.write("\n")
     sys.stdout.flush()
 
 
+_display = {'lines': 0}     # lines of active transfers drawn by progress_lines last time
+
+
+def progress_lines(snapshot):
+    """Show file name and progress bar per transfer of a progress sample, redrawn in place
+       (ProgressMonitor callback). Finished ones are left above the active ones. Example:
+    PSY - GANGNAM STYLE(강남스타일) MV__video-137.mp4
+     ↳ |██████████████                         | 36.2% (54.1/149.5MB), 2.4MB/s, ETA 00:00:39
+    """
+    _done = [i for i in snapshot if i['done']]
+    _active = [i for i in snapshot if not i['done']]
+    _tty = sys.stdout.isatty()
+    if not _tty: _active = []   # no redraw if redirected. just the finished ones
+    out = []
+    if _tty and _display['lines']:
+        out.append("\x1b[%dF" % _display['lines'])     # cursor up to the 1st line drawn
+    for i in _done + _active:
+        if i['error']: _bar = " ↳ failed: %s" % i['error']
+        else: _bar = _bar_text(i['cur_bytes'], i['tot_bytes'] or 1, i['elapsed'],
+                               i['eta'], None if i['done'] else i['rate'])
+        _fn = i['fn'] if len(i['fn']) < w_size['w_col'] else "…" + i['fn'][-w_size['w_col']+2:]
+        out.append("\x1b[K%s\n\x1b[K%s\n" % (_fn, _bar) if _tty else "%s\n%s\n" % (_fn, _bar))
+    if _tty and _display['lines'] > 2*len(_active):   # clear lines no longer used
+        out.append("\x1b[J")
+    _display['lines'] = 2*len(_active)
+    sys.stdout.write("".join(out))
+    sys.stdout.flush()
+
+
+def _batch_urls(fp):
+    """Yield urls of the lines of fp as they're read: whitespace separated, a bare video ID
+       made its watch url. Empty lines and #-comment lines skipped
+    """
+    for _line in fp:
+        _line = _line.strip()
+        if not _line or _line.startswith("#"): continue
+        for _url in _line.split():
+            if re.match(r'^[0-9A-Za-z_-]{11}$', _url):
+                _url = "https://www.youtube.com/watch?v=%s" % _url
+            yield _url
+
+
+def _batch_record(url, dlv, fmt=None):
+    """Return NDJSON record (dict) of a video done in batch mode, of DLvidu or the exception
+       raised: its streams, chosen itags, downloads (bytes, secs, status), timings and error
+    """
+    if isinstance(dlv, BaseException):
+        return {"url": url, "error": "%s: %s" % (type(dlv).__name__, dlv)}
+    _params = dlv.ex_obj.params
+    if dlv.archived:
+        return {"url": url, "vidu_id": _params['vidu_id'], "archived": True, "error": None}
+    _streams = _params['streams']
+    _sel = [i['itag'] for i in dlv.results] if dlv.results else \
+           [int(i) for i in dlv._select(fmt)] if _streams else []
+    _errors = ["itag %d: %s" % (i['itag'], i['error']) for i in dlv.results if i['error']]
+    if not _streams: _errors.append("no streams extracted")
+    return {"url": url, "vidu_id": _params['vidu_id'], "title": _params['title'],
+            "from_cache": _params['from_cache'],
+            "streams": [{"itag": i.itag, "type": i.type, "ext": i.ext, "height": i.height,
+                         "size": i.size, "size_exact": i.file_sz > 0} for i in _streams],
+            "selected": _sel, "downloads": dlv.results,
+            "bytes": sum(i['bytes'] for i in dlv.results if i['status'] == "done"),
+            "timings": dlv.timings, "error": "; ".join(_errors) or None}
+
+
+def batch_main(fp, fmt=None, jobs=4, list_only=False, connections=None, info_ttl=None,
+               rate_limit=None, out=None, sub_format="srt", streams=None):
+    """Batch mode: extract (and download unless list_only) the videos of urls/IDs read from
+       fp as a stream, 'jobs' at once, choosing streams by format expression fmt with no
+       prompt. Write one NDJSON record per video to out (default stdout) as each is done.
+       Return number of videos failed
+    """
+    out = out or sys.stdout
+    async def _run():
+        _failed = 0
+        async for url, dlv in iter_many(_batch_urls(fp), concurrency=jobs, list_only=list_only,
+                                        connections=connections, info_ttl=info_ttl,
+                                        rate_limit=rate_limit, fmt=fmt, captions=sub_format,
+                                        streams=streams):
+            _rec = _batch_record(url, dlv, fmt)
+            if _rec['error']: _failed += 1
+            out.write(json.dumps(_rec, ensure_ascii=False) + "\n")
+            out.flush()
+        return _failed
+    return asyncio.run(_run())
+
+
+def _log_stats():
+    """Log stats of pattern sets and streams (debug)"""
+    for _name, _stats in pattern_stats().items():
+        logger.debug("pattern set '%s' (try order, hits/scans, secs): %s", _name,
+                     ["%d/%d,%.4f" % (i['hits'], i['scans'], i['secs']) for i in _stats])
+    for _fn, _stats in stream_stats().items():
+        logger.debug("stream '%s' (chunks, rate B/s, ttfb, throttles/cuts): %d, %d, %.3f, %d/%d. %s",
+                     _fn, _stats['chunks'], _stats['rate'], _stats['ttfb'], _stats['throttles'],
+                     _stats['cuts'], _stats['decisions'])
+
+
 def cli_main():
     """CLI application to download video."""
     # get terminal size. default return COLUMNSxLINES=80x24 (py3.3+)
@@ -62,8 +171,40 @@ def cli_main():
     parser.add_argument("--version", action="version", version="%(prog)s "+prog_version)
     parser.add_argument("-v", action="count", dest="verbose_lvl", default=0,
         help="Upto four levels (-vvvv): warning, info, debug, details. If not given, default error level")
+    parser.add_argument("--log-compress", type=int, dest="log_compress", default=None, metavar="0-9",
+        help="gzip level of responses saved with -vvvv (default 6)")
+    parser.add_argument("--log-drop", action="store_true", dest="log_drop", default=False,
+        help="Drop response captures of -vvvv instead of waiting when the writer is behind")
     parser.add_argument("-l", action="store_true", dest="list_only", default=False, help="Just list video info")
-    parser.add_argument("req_url", metavar="URL(s)", nargs="?", help="Video URL")
+    parser.add_argument("-b", "--batch", dest="batch", default=None, metavar="FILE",
+        help="Batch mode: read video URLs/IDs from FILE (- for stdin) as a stream, no prompt, "
+             "and write a json line of results per video")
+    parser.add_argument("-f", "--format", dest="format", default=None, metavar="EXPR",
+        help="Streams to download, no prompt. Alternatives by /, streams joined by +, each an itag, "
+             "best, or best|worst+video|audio|mux with [field op value] filters "
+             "(ex. bestvideo[height<=720]+bestaudio/best)")
+    parser.add_argument("-j", "--jobs", type=int, dest="jobs", default=4, metavar="NUM",
+        help="Videos processed at once in batch mode. Default 4")
+    parser.add_argument("--replay", dest="replay", default=None, metavar="DIR",
+        help="Get pages from the responses saved with -vvvv in DIR instead of the network (implies -l)")
+    parser.add_argument("-N", type=int, dest="connections", default=None, metavar="NUM",
+        help="Connections per video to fetch chunks at once (dash streams), shared by its streams. Default 4")
+    parser.add_argument("-S", "--streams", type=int, dest="streams", default=None, metavar="NUM",
+        help="Streams of a video downloaded at once (ex. video and audio). Default 2")
+    parser.add_argument("-r", "--rate-limit", dest="rate_limit", default=None, metavar="RATE",
+        help="Max download rate shared by all transfers, in bytes/sec (ex. 500K, 4M)")
+    parser.add_argument("--rate-limit-each", dest="rate_limit_each", default=None, metavar="RATE",
+        help="Max download rate of each video, shared by its streams, in bytes/sec (ex. 500K, 4M)")
+    parser.add_argument("--trace", dest="trace", default=None, metavar="FILE",
+        help="Save timing spans of all phases into FILE (Chrome trace json, or json lines if *.jsonl)")
+    parser.add_argument("--sub-format", dest="sub_format", default="srt", choices=["srt", "vtt"],
+        help="File format of captions/subtitles. Default srt")
+    parser.add_argument("--archive", dest="archive", default=None, metavar="FILE",
+        help="Skip videos recorded in the download archive FILE (no request), and record the ones downloaded")
+    parser.add_argument("--info-ttl", type=int, dest="info_ttl", default=None, metavar="SECS",
+        help="Reuse video info cached within SECS (default 14400, until stream urls expire). 0=off")
+    parser.add_argument("req_url", metavar="URL(s)", nargs="?",
+        help="Video URL(s), or playlist/channel URL(s) for all of their videos")
 
     args = parser.parse_args()
     #TEST: ax68rWI4Tuk (funktytown) tyDvp3wjqpw (ww2 18+) tUCVN2GLYuA (asus)
@@ -71,7 +212,7 @@ def cli_main():
     #      7takIh1nK0s (not playable, 6hAHZRbijt8 PwrySjp4J9Q)  E0nTlSMGYyI (4k)
     #EX: args = parser.parse_args(["-vvvv", "https://www.youtube.com/watch?v=..."])
 
-    if not args.req_url:     # video url not set or empty
+    if not args.req_url and not args.batch:     # video url not set or empty
         parser.print_help(); sys.exit(1);
 
     if args.verbose_lvl < 4:    _log_html = False;
@@ -82,23 +223,53 @@ def cli_main():
         fmt="%(asctime)s,%(msecs)03d [%(module)s #%(lineno)d] %(levelname)s - %(message)s",
         datefmt="%H:%M:%S")     # asctime without datefmt gives Y-M-D H:M:S.s
     set_logging(_nlvl, _logging_fmt, _log_html)
+    set_log_rsp(compresslevel=args.log_compress, policy="drop" if args.log_drop else None)
+    if args.trace: set_trace(args.trace)
+    if args.archive: set_archive(args.archive)
+    if args.replay:
+        set_replay(args.replay)
+        args.list_only = True       # no media in captures
+    try:
+        set_rate_limit(parse_rate(args.rate_limit))
+        _rate_each = parse_rate(args.rate_limit_each)
+        if args.format: parse_format(args.format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.batch:          # stdout is for the json lines only, so no progress bars
+        _fp = sys.stdin if args.batch == "-" else open(args.batch, encoding="utf-8")
+        with _fp:
+            _failed = batch_main(_fp, fmt=args.format, jobs=max(args.jobs, 1),
+                                 list_only=args.list_only, connections=args.connections,
+                                 info_ttl=args.info_ttl, rate_limit=_rate_each,
+                                 sub_format=args.sub_format, streams=args.streams)
+        _log_stats()
+        sys.exit(1 if _failed else 0)
+
+    progress.add_callback(progress_lines)
 
     def interrupt(signum, frame):   # given with 2 args. used for timeout userinput below
         print()
         raise ValueError("userinput timedout")  # an except with any msg
-    _urls = args.req_url.split()
-    for _url in _urls:
-        dlv = DLvidu(_url)
+    # playlist/channel urls are expanded a page at a time, while the videos are processed
+    for _url in expand_urls(args.req_url.split()):
+        dlv = DLvidu(_url, info_ttl=args.info_ttl,
+                     itags=format_itags(args.format) if args.format else None)
         _streams = dlv._get_streams()
         if _streams == "": continue
         print(_streams)
         if args.list_only: continue
 
-        # auto or user select
+        # auto or user select (no prompt if format given)
         TIMEOUT = 18  # sec
         _osname = platform.system()
         _sel = ""
-        if (_osname == "Linux") or ("CYGWIN" in _osname) or (_osname.lower() == "unix"):
+        if args.format:
+            _sel = ",".join(dlv._select(args.format))
+            if not _sel:
+                logger.error("no stream matches format '%s'", args.format)
+                continue
+        elif (_osname == "Linux") or ("CYGWIN" in _osname) or (_osname.lower() == "unix"):
             # use SIGALRM for Linux
             print("Wait %s seconds to auto-download, or select ids (separate by ,), or 0 to skip: " % TIMEOUT,
                    end="")
@@ -126,17 +297,20 @@ def cli_main():
 
         # download
         if _sel:
-            dlv._download(idx=_sel, dl_bar=progress_bar)
+            dlv._download(idx=_sel, connections=args.connections,
+                          rate_limit=_rate_each, streams=args.streams)
         else:
-            dlv._download(dl_bar=progress_bar)
+            dlv._download(connections=args.connections,
+                          rate_limit=_rate_each, streams=args.streams)
+        if dlv.archived: continue
 
         # capation
         _captions = dlv._list_captions()
         if _captions == "": continue
         print("Available captions/subtitles: ", _captions)
-        dlv._captions()
+        dlv._captions(fmt=args.sub_format)
 
-    #TODO: *)save/load cache *)playlist *)rate-limit
+    _log_stats()
 
 
 if __name__ == '__main__':
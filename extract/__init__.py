@@ -6,4 +6,5 @@ Export the extractor package API
 from __future__ import unicode_literals
 
 from .youtube import YoutubeER
+from .streaminfo import StreamInfo, parse_format, select_streams, format_itags
 
@@ -3,37 +3,97 @@
 Base class for extractor
 """
 
+from ..utils import run_blocking
+from ..tracing import traced
+
+
+def _trace_vidu(self, *args, **kwargs):
+    """Span attributes of an extractor method"""
+    return {"vidu_id": getattr(self, 'params', {}).get('vidu_id')}
+
+
 class BaseExtractor(object):
     """Only defines the methods that an extractor shall implement"""
 
+    def expand_url(self, url):
+        """Return iterator of the video urls of url: a playlist/channel is expanded lazily
+           (page by page as it's consumed), any other url gives itself
+        """
+        return self._expand_url(url)
+
+
+    def video_id(self, url):
+        """Return video ID of url with no request, or None if url doesn't give it"""
+        return self._video_id(url)
+
+
+    @traced("fetch_info", attrs=lambda self, url: {"url": url})
     def fetch_info(self, url):
         """Fetch url info"""
         return self._fetch_info(url)
 
 
+    @traced("extract_info", attrs=_trace_vidu)
     def extract_info(self):
         """Extract video/stream info"""
         return self._extract_info()
 
 
+    @traced("sort_streams", attrs=_trace_vidu)
     def sort_streams(self):
         """Sort out best stream(s)"""
         return self._sort_streams()
 
 
-    def download_streams(self, idx=None, dl_bar=None):
-        """Download the best or 'idx' list if any. Call back dl_bar if any during progress"""
-        return self._download_streams(idx=idx, dl_bar=dl_bar)
+    @traced("download_streams", attrs=_trace_vidu)
+    def download_streams(self, idx=None, dl_bar=None, connections=None, rate_limit=None,
+                         streams=None):
+        """Download the best or 'idx' list if any. Call back dl_bar if any during progress
+           (every progress.interval secs, see ProgressMonitor).
+           Upto 'streams' of them at once, sharing upto 'connections' at once and rate_limit
+           (bytes/sec) if given of the video.
+           Return list of result dict per stream (itag, fn, bytes, secs, status, error)
+        """
+        return self._download_streams(idx=idx, dl_bar=dl_bar, connections=connections,
+                                      rate_limit=rate_limit, streams=streams)
 
 
+    @traced("list_captions", attrs=_trace_vidu)
     def list_captions(self):
         """List available captions"""
         return self._list_captions()
 
 
-    def download_captions(self):
-        """Download capations"""
-        return self._download_captions()
+    @traced("download_captions", attrs=_trace_vidu)
+    def download_captions(self, fmt="srt"):
+        """Download capations, as fmt ("srt" or "vtt") files"""
+        return self._download_captions(fmt=fmt)
+
+
+    # asyncio counterparts of the methods above. extractors and the transport are blocking,
+    # so these run them in the context's executor (run_blocking): many videos can be awaited
+    # on one event loop, but each one in progress holds a thread of it
+    async def fetch_info_async(self, url):
+        """Fetch url info (asyncio)"""
+        return await run_blocking(self.fetch_info, url)
+
+
+    async def extract_info_async(self):
+        """Extract video/stream info (asyncio)"""
+        return await run_blocking(self.extract_info)
+
+
+    async def download_streams_async(self, idx=None, dl_bar=None, connections=None, rate_limit=None,
+                                     streams=None):
+        """Download the best or 'idx' list if any (asyncio)"""
+        return await run_blocking(self.download_streams, idx=idx, dl_bar=dl_bar,
+                                  connections=connections, rate_limit=rate_limit,
+                                  streams=streams)
+
+
+    async def download_captions_async(self, fmt="srt"):
+        """Download capations (asyncio)"""
+        return await run_blocking(self.download_captions, fmt=fmt)
 
 
     #def _fetch_info(self, url):
@@ -48,7 +108,8 @@ class BaseExtractor(object):
     #    """Subclass implements to sort out best stream(s)"""
     #    print("ERROR: shouldn't be here!!!")
     #    pass
-    #def _download_streams(self, idx=None, dl_bar=None):
+    #def _download_streams(self, idx=None, dl_bar=None, connections=None, rate_limit=None,
+    #                      streams=None):
     #    """Subclass implements to download stream(s)"""
     #    print("ERROR: shouldn't be here!!!")
     #    pass
@@ -56,12 +117,22 @@ class BaseExtractor(object):
     #    """Subclass implements to list captions"""
     #    print("ERROR: shouldn't be here!!!")
     #    pass
-    #def _download_captions(self):
+    #def _download_captions(self, fmt="srt"):
     #    """Subclass implements to download captions"""
     #    print("ERROR: shouldn't be here!!!")
     #    pass
 
 
+    def _video_id(self, url):
+        """Subclass implements to get video ID of url. Default: None"""
+        return None
+
+
+    def _expand_url(self, url):
+        """Subclass implements to expand playlist/channel urls. Default: url itself"""
+        return iter([url])
+
+
     def _real_initialize(self):
         """Subclass implements initialization interface"""
         pass
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Youtube itag index: known attributes of stream formats by itag, to fill the ones a stream
+info doesn't give and to estimate sizes for ranking, with no request. The index (between
+the GENERATED marks) is compiled from doc/youtube_itag.txt by:
+    python -m ytb_ext.extract.itags [doc/youtube_itag.txt]
+"""
+
+import os, re, sys
+import ast
+from collections import namedtuple
+
+
+# numbers -1 and texts "" if not known (as StreamInfo). abr in kbps (audio part)
+ItagInfo = namedtuple("ItagInfo", "ext width height acodec abr vcodec fps note")
+_FIELDS = {"ext": "ext", "width": "width", "height": "height", "acodec": "acodec",
+           "abr": "abr", "vcodec": "vcodec", "fps": "fps", "format_note": "note"}
+_DEFAULT = ItagInfo("", -1, -1, "", -1, "", -1, "")
+
+# rough video bitrate (kbps) by height of h264, for size estimate when a stream gives none.
+# vp9/av01 get about 2/3 of it for the same quality
+_VBR_KBPS = ((144, 100), (240, 250), (360, 600), (480, 1100), (720, 2500), (1080, 4500),
+             (1440, 9000), (2160, 18000), (2880, 30000), (4320, 45000))
+_VBR_RATIO = {"vp8": 1.0, "vp9": 0.67, "av01": 0.67, "h263": 1.5, "mp4v": 1.2}
+
+
+# BEGIN GENERATED from doc/youtube_itag.txt (do not edit)
+ITAGS = {
+    5: ItagInfo(ext='flv', width=400, height=240, acodec='mp3', abr=64, vcodec='h263', fps=-1, note=''),
+    6: ItagInfo(ext='flv', width=450, height=270, acodec='mp3', abr=64, vcodec='h263', fps=-1, note=''),
+    13: ItagInfo(ext='3gp', width=-1, height=-1, acodec='aac', abr=-1, vcodec='mp4v', fps=-1, note=''),
+    17: ItagInfo(ext='3gp', width=176, height=144, acodec='aac', abr=24, vcodec='mp4v', fps=-1, note=''),
+    18: ItagInfo(ext='mp4', width=640, height=360, acodec='aac', abr=96, vcodec='h264', fps=-1, note=''),
+    22: ItagInfo(ext='mp4', width=1280, height=720, acodec='aac', abr=192, vcodec='h264', fps=-1, note=''),
+    34: ItagInfo(ext='flv', width=640, height=360, acodec='aac', abr=128, vcodec='h264', fps=-1, note=''),
+    35: ItagInfo(ext='flv', width=854, height=480, acodec='aac', abr=128, vcodec='h264', fps=-1, note=''),
+    36: ItagInfo(ext='3gp', width=320, height=-1, acodec='aac', abr=-1, vcodec='mp4v', fps=-1, note=''),
+    37: ItagInfo(ext='mp4', width=1920, height=1080, acodec='aac', abr=192, vcodec='h264', fps=-1, note=''),
+    38: ItagInfo(ext='mp4', width=4096, height=3072, acodec='aac', abr=192, vcodec='h264', fps=-1, note=''),
+    43: ItagInfo(ext='webm', width=640, height=360, acodec='vorbis', abr=128, vcodec='vp8', fps=-1, note=''),
+    44: ItagInfo(ext='webm', width=854, height=480, acodec='vorbis', abr=128, vcodec='vp8', fps=-1, note=''),
+    45: ItagInfo(ext='webm', width=1280, height=720, acodec='vorbis', abr=192, vcodec='vp8', fps=-1, note=''),
+    46: ItagInfo(ext='webm', width=1920, height=1080, acodec='vorbis', abr=192, vcodec='vp8', fps=-1, note=''),
+    59: ItagInfo(ext='mp4', width=854, height=480, acodec='aac', abr=128, vcodec='h264', fps=-1, note=''),
+    78: ItagInfo(ext='mp4', width=854, height=480, acodec='aac', abr=128, vcodec='h264', fps=-1, note=''),
+    82: ItagInfo(ext='mp4', width=-1, height=360, acodec='aac', abr=128, vcodec='h264', fps=-1, note='3D'),
+    83: ItagInfo(ext='mp4', width=-1, height=480, acodec='aac', abr=128, vcodec='h264', fps=-1, note='3D'),
+    84: ItagInfo(ext='mp4', width=-1, height=720, acodec='aac', abr=192, vcodec='h264', fps=-1, note='3D'),
+    85: ItagInfo(ext='mp4', width=-1, height=1080, acodec='aac', abr=192, vcodec='h264', fps=-1, note='3D'),
+    91: ItagInfo(ext='mp4', width=-1, height=144, acodec='aac', abr=48, vcodec='h264', fps=-1, note='HLS'),
+    92: ItagInfo(ext='mp4', width=-1, height=240, acodec='aac', abr=48, vcodec='h264', fps=-1, note='HLS'),
+    93: ItagInfo(ext='mp4', width=-1, height=360, acodec='aac', abr=128, vcodec='h264', fps=-1, note='HLS'),
+    94: ItagInfo(ext='mp4', width=-1, height=480, acodec='aac', abr=128, vcodec='h264', fps=-1, note='HLS'),
+    95: ItagInfo(ext='mp4', width=-1, height=720, acodec='aac', abr=256, vcodec='h264', fps=-1, note='HLS'),
+    96: ItagInfo(ext='mp4', width=-1, height=1080, acodec='aac', abr=256, vcodec='h264', fps=-1, note='HLS'),
+    100: ItagInfo(ext='webm', width=-1, height=360, acodec='vorbis', abr=128, vcodec='vp8', fps=-1, note='3D'),
+    101: ItagInfo(ext='webm', width=-1, height=480, acodec='vorbis', abr=192, vcodec='vp8', fps=-1, note='3D'),
+    102: ItagInfo(ext='webm', width=-1, height=720, acodec='vorbis', abr=192, vcodec='vp8', fps=-1, note='3D'),
+    132: ItagInfo(ext='mp4', width=-1, height=240, acodec='aac', abr=48, vcodec='h264', fps=-1, note='HLS'),
+    133: ItagInfo(ext='mp4', width=-1, height=240, acodec='', abr=-1, vcodec='h264', fps=-1, note='DASH video'),
+    134: ItagInfo(ext='mp4', width=-1, height=360, acodec='', abr=-1, vcodec='h264', fps=-1, note='DASH video'),
+    135: ItagInfo(ext='mp4', width=-1, height=480, acodec='', abr=-1, vcodec='h264', fps=-1, note='DASH video'),
+    136: ItagInfo(ext='mp4', width=-1, height=720, acodec='', abr=-1, vcodec='h264', fps=-1, note='DASH video'),
+    137: ItagInfo(ext='mp4', width=-1, height=1080, acodec='', abr=-1, vcodec='h264', fps=-1, note='DASH video'),
+    138: ItagInfo(ext='mp4', width=-1, height=-1, acodec='', abr=-1, vcodec='h264', fps=-1, note='DASH video'),
+    139: ItagInfo(ext='m4a', width=-1, height=-1, acodec='aac', abr=48, vcodec='', fps=-1, note='DASH audio'),
+    140: ItagInfo(ext='m4a', width=-1, height=-1, acodec='aac', abr=128, vcodec='', fps=-1, note='DASH audio'),
+    141: ItagInfo(ext='m4a', width=-1, height=-1, acodec='aac', abr=256, vcodec='', fps=-1, note='DASH audio'),
+    151: ItagInfo(ext='mp4', width=-1, height=72, acodec='aac', abr=24, vcodec='h264', fps=-1, note='HLS'),
+    160: ItagInfo(ext='mp4', width=-1, height=144, acodec='', abr=-1, vcodec='h264', fps=-1, note='DASH video'),
+    167: ItagInfo(ext='webm', width=640, height=360, acodec='', abr=-1, vcodec='vp8', fps=-1, note='DASH video'),
+    168: ItagInfo(ext='webm', width=854, height=480, acodec='', abr=-1, vcodec='vp8', fps=-1, note='DASH video'),
+    169: ItagInfo(ext='webm', width=1280, height=720, acodec='', abr=-1, vcodec='vp8', fps=-1, note='DASH video'),
+    170: ItagInfo(ext='webm', width=1920, height=1080, acodec='', abr=-1, vcodec='vp8', fps=-1, note='DASH video'),
+    171: ItagInfo(ext='webm', width=-1, height=-1, acodec='vorbis', abr=128, vcodec='', fps=-1, note='DASH audio'),
+    172: ItagInfo(ext='webm', width=-1, height=-1, acodec='vorbis', abr=256, vcodec='', fps=-1, note='DASH audio'),
+    212: ItagInfo(ext='mp4', width=-1, height=480, acodec='', abr=-1, vcodec='h264', fps=-1, note='DASH video'),
+    218: ItagInfo(ext='webm', width=854, height=480, acodec='', abr=-1, vcodec='vp8', fps=-1, note='DASH video'),
+    219: ItagInfo(ext='webm', width=854, height=480, acodec='', abr=-1, vcodec='vp8', fps=-1, note='DASH video'),
+    242: ItagInfo(ext='webm', width=-1, height=240, acodec='', abr=-1, vcodec='vp9', fps=-1, note='DASH video'),
+    243: ItagInfo(ext='webm', width=-1, height=360, acodec='', abr=-1, vcodec='vp9', fps=-1, note='DASH video'),
+    244: ItagInfo(ext='webm', width=-1, height=480, acodec='', abr=-1, vcodec='vp9', fps=-1, note='DASH video'),
+    245: ItagInfo(ext='webm', width=-1, height=480, acodec='', abr=-1, vcodec='vp9', fps=-1, note='DASH video'),
+    246: ItagInfo(ext='webm', width=-1, height=480, acodec='', abr=-1, vcodec='vp9', fps=-1, note='DASH video'),
+    247: ItagInfo(ext='webm', width=-1, height=720, acodec='', abr=-1, vcodec='vp9', fps=-1, note='DASH video'),
+    248: ItagInfo(ext='webm', width=-1, height=1080, acodec='', abr=-1, vcodec='vp9', fps=-1, note='DASH video'),
+    249: ItagInfo(ext='webm', width=-1, height=-1, acodec='opus', abr=50, vcodec='', fps=-1, note='DASH audio'),
+    250: ItagInfo(ext='webm', width=-1, height=-1, acodec='opus', abr=70, vcodec='', fps=-1, note='DASH audio'),
+    251: ItagInfo(ext='webm', width=-1, height=-1, acodec='opus', abr=160, vcodec='', fps=-1, note='DASH audio'),
+    256: ItagInfo(ext='m4a', width=-1, height=-1, acodec='aac', abr=-1, vcodec='', fps=-1, note='DASH audio'),
+    258: ItagInfo(ext='m4a', width=-1, height=-1, acodec='aac', abr=-1, vcodec='', fps=-1, note='DASH audio'),
+    264: ItagInfo(ext='mp4', width=-1, height=1440, acodec='', abr=-1, vcodec='h264', fps=-1, note='DASH video'),
+    266: ItagInfo(ext='mp4', width=-1, height=2160, acodec='', abr=-1, vcodec='h264', fps=-1, note='DASH video'),
+    271: ItagInfo(ext='webm', width=-1, height=1440, acodec='', abr=-1, vcodec='vp9', fps=-1, note='DASH video'),
+    272: ItagInfo(ext='webm', width=-1, height=2160, acodec='', abr=-1, vcodec='vp9', fps=-1, note='DASH video'),
+    278: ItagInfo(ext='webm', width=-1, height=144, acodec='', abr=-1, vcodec='vp9', fps=-1, note='DASH video'),
+    298: ItagInfo(ext='mp4', width=-1, height=720, acodec='', abr=-1, vcodec='h264', fps=60, note='DASH video'),
+    299: ItagInfo(ext='mp4', width=-1, height=1080, acodec='', abr=-1, vcodec='h264', fps=60, note='DASH video'),
+    302: ItagInfo(ext='webm', width=-1, height=720, acodec='', abr=-1, vcodec='vp9', fps=60, note='DASH video'),
+    303: ItagInfo(ext='webm', width=-1, height=1080, acodec='', abr=-1, vcodec='vp9', fps=60, note='DASH video'),
+    308: ItagInfo(ext='webm', width=-1, height=1440, acodec='', abr=-1, vcodec='vp9', fps=60, note='DASH video'),
+    313: ItagInfo(ext='webm', width=-1, height=2160, acodec='', abr=-1, vcodec='vp9', fps=-1, note='DASH video'),
+    315: ItagInfo(ext='webm', width=-1, height=2160, acodec='', abr=-1, vcodec='vp9', fps=60, note='DASH video'),
+    325: ItagInfo(ext='m4a', width=-1, height=-1, acodec='dtse', abr=-1, vcodec='', fps=-1, note='DASH audio'),
+    328: ItagInfo(ext='m4a', width=-1, height=-1, acodec='ec-3', abr=-1, vcodec='', fps=-1, note='DASH audio'),
+    330: ItagInfo(ext='webm', width=-1, height=144, acodec='', abr=-1, vcodec='???', fps=60, note='hdr'),
+    331: ItagInfo(ext='webm', width=-1, height=240, acodec='', abr=-1, vcodec='???', fps=60, note='hdr'),
+    332: ItagInfo(ext='webm', width=-1, height=360, acodec='', abr=-1, vcodec='???', fps=60, note='hdr'),
+    333: ItagInfo(ext='webm', width=-1, height=480, acodec='', abr=-1, vcodec='???', fps=60, note='hdr'),
+    334: ItagInfo(ext='webm', width=-1, height=720, acodec='', abr=-1, vcodec='???', fps=60, note='hdr'),
+    335: ItagInfo(ext='webm', width=-1, height=1080, acodec='', abr=-1, vcodec='???', fps=60, note='hdr'),
+    336: ItagInfo(ext='webm', width=-1, height=1440, acodec='', abr=-1, vcodec='???', fps=60, note='hdr'),
+    337: ItagInfo(ext='webm', width=-1, height=2160, acodec='', abr=-1, vcodec='???', fps=60, note='hdr'),
+    394: ItagInfo(ext='mp4', width=-1, height=144, acodec='', abr=-1, vcodec='av01.0.05M.08', fps=-1, note=''),
+    395: ItagInfo(ext='mp4', width=-1, height=240, acodec='', abr=-1, vcodec='av01.0.05M.08', fps=-1, note=''),
+    396: ItagInfo(ext='mp4', width=-1, height=360, acodec='', abr=-1, vcodec='av01.0.05M.08', fps=-1, note=''),
+    397: ItagInfo(ext='mp4', width=-1, height=480, acodec='', abr=-1, vcodec='av01.0.05M.08', fps=-1, note=''),
+    398: ItagInfo(ext='mp4', width=-1, height=720, acodec='', abr=-1, vcodec='av01.0.05M.08', fps=-1, note=''),
+    399: ItagInfo(ext='mp4', width=-1, height=1080, acodec='', abr=-1, vcodec='av01.0.05M.08', fps=-1, note=''),
+    400: ItagInfo(ext='mp4', width=-1, height=1440, acodec='', abr=-1, vcodec='av01.0.05M.08', fps=-1, note=''),
+    401: ItagInfo(ext='mp4', width=-1, height=2160, acodec='', abr=-1, vcodec='av01.0.05M.08', fps=-1, note=''),
+    402: ItagInfo(ext='mp4', width=-1, height=2880, acodec='', abr=-1, vcodec='av01.0.05M.08', fps=-1, note=''),
+}
+# END GENERATED
+
+
+def itag_info(itag=None):
+    """Return ItagInfo of itag (int or str), or None if not in the index"""
+    try:
+        return ITAGS.get(int(itag))
+    except (TypeError, ValueError):
+        return None
+
+
+def est_bitrate(info=None, height=-1, vcodec=""):
+    """Return estimated bitrate (bps) of a stream of info (ItagInfo), height and vcodec if it
+       has video, or 0 if unknown. Rough: for ranking only
+    """
+    _abr = max(info.abr, 0) * 1000 if info else 0
+    _vcodec = vcodec or (info.vcodec if info else "")
+    if height <= 0 and info: height = info.height
+    if height <= 0 or not _vcodec: return _abr
+    _kbps = _VBR_KBPS[-1][1]
+    for _h, _rate in _VBR_KBPS:
+        if height <= _h: _kbps = _rate ; break
+    _ratio = _VBR_RATIO.get(_vcodec.partition(".")[0].lower(), 1.0)
+    return _abr + int(_kbps * _ratio * 1000)
+
+
+def _parse_table(text=None):
+    """Parse itag table text (lines as "'5': {'ext': 'flv', ...},") into {itag: ItagInfo}"""
+    _index = {}
+    for _line in text.splitlines():
+        mobj = re.match(r"\s*'(\d+)'\s*:\s*({.*?})\s*,?\s*(?:#.*)?$", _line)
+        if not mobj: continue
+        _dct = ast.literal_eval(mobj.group(2))
+        _vals = {_FIELDS[k]: v for k,v in _dct.items() if k in _FIELDS and v != "none"}
+        _index[int(mobj.group(1))] = _DEFAULT._replace(**_vals)
+    return _index
+
+
+def _generate(src=None):
+    """Compile the itag table of src into the GENERATED part of this module"""
+    src = src or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "doc", "youtube_itag.txt")
+    with open(src, encoding="utf-8") as fp: _index = _parse_table(fp.read())
+    _lines = ["# BEGIN GENERATED from doc/youtube_itag.txt (do not edit)", "ITAGS = {"]
+    for k in sorted(_index):
+        _lines.append("    %d: %r," % (k, _index[k]))
+    _lines += ["}", "# END GENERATED"]
+    _fn = os.path.abspath(__file__)
+    with open(_fn, encoding="utf-8") as fp: _src = fp.read()
+    _src = re.sub(r"# BEGIN GENERATED.*?# END GENERATED", lambda m: "\n".join(_lines), _src,
+                  count=1, flags=re.S)
+    with open(_fn, "w", encoding="utf-8") as fp: fp.write(_src)
+    print("%d itags written to %s" % (len(_index), _fn))
+
+
+if __name__ == "__main__":
+    _generate(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Stream info record of extractors, and format selection of them
+"""
+
+import re
+import operator
+
+
+def _int(val=None, default=-1):
+    """Int of val (int, or str of digits), or default if not given or not a number"""
+    if val is None or val == "": return default
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        return default
+
+
+class StreamInfo(object):
+    """Useful set of info of a stream, parsed once (numbers as int, -1 if unknown; texts as
+       str, "" if unknown). __slots__ keeps it small for many videos at once
+    """
+    # field: default. ints are converted from str (ex. json 'contentLength') on set
+    _INTS = {
+        "itag" :            -1,     # -'itag'
+        "file_sz" :         -1,     # size in byte -'contentLength' (or HEAD when selected)
+        "est_sz" :          -1,     # estimated size -'averageBitrate'*'approxDurationMs' (ranking)
+        "last_modify" :     -1,     # in epoch us - 'lastModified'
+        "width" :           -1,     # -'width' or from itag table
+        "height" :          -1,     # -'height' or from itag table
+        "dura_ms" :         -1,     # duration in ms -'approxDurationMs'
+        "abr" :             -1,     # -'averageBitrate'
+        "asr" :             -1,     # (audio) ex.44100,48000 -'audioSampleRate'
+    }
+    _STRS = {
+        "url" :             "",     # quote url from stream info -'url' or decrypted from cipher
+        "mimetype" :        "",     # ex. video/mp4; codecs=\"avc1.42001E, mp4a.40.2\" -'mimeType'
+        "mime" :            "",     # ex. video/mp4, video/webm, audio/mp4, audio/webm -'mime' in url
+        "quality" :         "",     # (muxed video) tiny,small,medium -'quality'
+        "aquality" :        "",     # -'audioQuality'
+        "label" :           "",     # ex.240p -'qualityLabel'
+        "acodec" :          "",     # part of mimetype
+        "vcodec" :          "",     # part of mimetype
+        "type" :            "",     # '+'=video&audio, 'V'=video only, 'A'=audio only
+        "ext" :             "",     # ex. mp4, webm etc. part of mime
+        "order" :           "",     # final recommended stream(s) to download: "1", "2"
+    }
+    # cipher: dict from 'signatureCipher'/'cipher' query: "url", & 1) "sp","s" for encrypted,
+    # 2) "sig" gives signature for unencryped. {} if not ciphered
+    __slots__ = tuple(_INTS) + tuple(_STRS) + ("cipher",)
+
+    def __init__(self, **fields):
+        for k,v in self._INTS.items(): object.__setattr__(self, k, v)
+        for k,v in self._STRS.items(): object.__setattr__(self, k, v)
+        self.cipher = {}
+        for k,v in fields.items(): setattr(self, k, v)
+
+    def __setattr__(self, name, val):
+        if name in self._INTS: val = _int(val)
+        elif name in self._STRS: val = "" if val is None else str(val)
+        object.__setattr__(self, name, val)
+
+    def __repr__(self):
+        return "StreamInfo(itag=%d, type=%r, ext=%r, %dx%d, file_sz=%d)" % (
+               self.itag, self.type, self.ext, self.width, self.height, self.file_sz)
+
+    @property
+    def size(self):
+        """Size in byte, or its estimate if not known yet (0 if neither)"""
+        return max(self.file_sz if self.file_sz > 0 else self.est_sz, 0)
+
+    @property
+    def is_dash(self):
+        """True if either video or audio only (dash)"""
+        return self.type in ("V", "A")
+
+    def to_dict(self):
+        """Return the fields in a json-able dict"""
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, dct=None):
+        """Return StreamInfo of the fields in dct (unknown keys ignored)"""
+        return cls(**{k: v for k,v in (dct or {}).items() if k in cls.__slots__})
+
+
+_PTRN_FORMAT = re.compile(r'^(\w+)((?:\[[^\]]+\])*)$')
+_PTRN_FILTER = re.compile(r'\[\s*(\w+)\s*(<=|>=|!=|=|<|>)\s*([^\]]*?)\s*\]')
+_OPS = {"<=": operator.le, ">=": operator.ge, "!=": operator.ne, "=": operator.eq,
+        "<": operator.lt, ">": operator.gt}
+_KINDS = {"video": "V", "audio": "A", "mux": "+"}
+
+
+def parse_format(expr=None):
+    """Parse format expression expr into a list of alternatives, each a list of (name,
+       filters). Raise ValueError if it's not valid. expr has alternatives separated by '/'
+       tried in turn, each of streams joined by '+'. A stream is an itag, or 'best' (the
+       recommended ones), or best|worst + video|audio|mux, optionally followed by filters
+       [field op value] of StreamInfo fields. Ex. 'bestvideo[height<=720]+bestaudio/best'
+    """
+    _alts = []
+    for _alt in (expr or "best").split("/"):
+        _parts = []
+        for _part in _alt.split("+"):
+            mobj = _PTRN_FORMAT.match(_part.strip())
+            _name = mobj.group(1) if mobj else ""
+            if not mobj or not (_name.isdigit() or _name == "best" or
+                                re.match(r'^(best|worst)(video|audio|mux)$', _name)):
+                raise ValueError("invalid format '%s'" % _part.strip())
+            _filters = []
+            for k, op, v in _PTRN_FILTER.findall(mobj.group(2)):
+                if k in StreamInfo._INTS:
+                    try:
+                        v = int(v)
+                    except ValueError:
+                        raise ValueError("invalid number '%s' of %s in format" % (v, k))
+                elif k not in StreamInfo._STRS or op not in ("=", "!="):
+                    raise ValueError("invalid filter '%s%s' in format" % (k, op))
+                _filters.append((k, _OPS[op], v))
+            _parts.append((_name, _filters))
+        _alts.append(_parts)
+    return _alts
+
+
+def format_itags(expr=None):
+    """Return the itags (str) format expression expr (str or parsed by parse_format) asks
+       for if it names them all, with no alternatives nor filters (ex. '137+140'). None if
+       they are told only from the streams (ex. 'best')
+    """
+    _alts = parse_format(expr) if not isinstance(expr, list) else expr
+    if len(_alts) != 1 or not all(n.isdigit() and not f for n, f in _alts[0]): return None
+    return [n for n, _ in _alts[0]]
+
+
+def _select_one(streams=None, name=None, filters=None):
+    """Return list of the streams chosen by name and filters (parse_format), [] if none"""
+    _cands = [i for i in streams if all(op(getattr(i, k), v) for k, op, v in filters)]
+    if name.isdigit(): return [i for i in _cands if i.itag == int(name)]
+    if name == "best": return [i for i in _cands if i.order == "1"]
+    _kind = name[4:] if name.startswith("best") else name[5:]
+    _cands = [i for i in _cands if i.type == _KINDS[_kind]]
+    if not _cands: return []
+    # video/mux by height then size, audio by bitrate then size
+    _key = (lambda i: (i.abr, i.size)) if _kind == "audio" else (lambda i: (i.height, i.size))
+    return [(max if name.startswith("best") else min)(_cands, key=_key)]
+
+
+def select_streams(streams=None, expr=None):
+    """Return the streams chosen by format expression expr (str or parsed by parse_format)
+       from streams: the first alternative of which each part matches. [] if none does
+    """
+    _alts = parse_format(expr) if not isinstance(expr, list) else expr
+    for _alt in _alts:
+        _sel = []
+        for _name, _filters in _alt:
+            _got = _select_one(streams or [], _name, _filters)
+            if not _got: _sel = [] ; break
+            _sel += [i for i in _got if i not in _sel]
+        if _sel: return _sel
+    return []
@@ -4,38 +4,104 @@ Youtube extractor
 """
 
 import re, sys, os
+import json
 from collections import OrderedDict as ordereddict
 import urllib.parse as parse
 import xml.etree.ElementTree as et
 import html
 import time
+import io
+import concurrent.futures
+import contextvars
+import http.client
 
 from .base_extractor import BaseExtractor
 from ..utils import (
     logger,
     log_rsp,
+    cache_path,
+    atomic_write,
     save_dct,
     read_dct,
     http_get,
     http_stream,
-    slow_down,
     sanity_url,
     json_load,
+    json_extract,
     str_decode,
     re_search,
+    PatternSet,
     float_to_srt_time,
+    std_http_headers,
+    TokenBucket,
+    ConnectionBudget,
 )
 from ..jsinterp import (
     parse_js,
-    decrypt_sig,
+    compile_decipher,
 )
+from ..tracing import span
+from .streaminfo import StreamInfo
+from .itags import itag_info, est_bitrate
 
 # constant and variable
 _PATTERN_VIDU_ID = r"(?:v=|\/)([0-9A-Za-z_-]{11}).*"
-_TMPLT_WATCH_URL = "https://www.youtube.com/watch?v={}"             # may skip 'www'
-_TMPLT_EMBED_URL = "https://www.youtube.com/embed/{}"
+_BASE_URL        = "https://www.youtube.com"                        # may skip 'www'
+_TMPLT_WATCH_URL = "{base}/watch?v={id}"
+_TMPLT_EMBED_URL = "{base}/embed/{id}"
 _TMPLT_EURL      = "https://youtube.googleapis.com/v/{}"
-_TMPLT_VIDU_INFO_URL = "https://www.youtube.com/get_video_info?"    # may skip 'www'
+_TMPLT_VIDU_INFO_URL = "{base}/get_video_info?"
+_TMPLT_PLAYLIST_URL = "{base}/playlist?list={id}"
+_TMPLT_CHANNEL_URL = "{base}/{path}/videos"
+_TMPLT_BROWSE_URL = "{base}/youtubei/v1/browse?key={key}"
+# playlist page, or channel (/channel/<id>, /c/<name>, /user/<name>, /@<handle>) uploads
+_PATTERN_PLAYLIST = r"/playlist\?(?:.*&)?list=([0-9A-Za-z_-]+)"
+_PATTERN_CHANNEL = r"^(?:https?://)?[^/]+/((?:channel|c|user)/[^/?#&]+|@[^/?#&]+)"
+# renderers of a video entry in playlist/channel pages and their continuations
+_LIST_RENDERERS = ("playlistVideoRenderer", "gridVideoRenderer", "videoRenderer")
+_JS_CACHE_VERSION = 2           # schema of cached js decipher. bump when its format changes
+_JS_CACHE_SIZE    = 16          # number of js player ids kept in cache (LRU)
+_JS_DECIPHER = {}               # compiled decipher per js player id (for this process)
+_INFO_CACHE_VERSION = 2         # schema of cached video info. bump when its format changes
+_INFO_CACHE_TTL   = 4*3600      # max secs to serve cached video info (stream urls expire ~6h)
+_INFO_CACHE_MARGIN = 600        # secs before stream urls 'expire' to stop serving them
+_HTTP_CHUNK_SIZE  = 10485760    # youtube throttles chunks >~10M for dash (initial/max size)
+_HTTP_CONNECTIONS = 4           # chunks fetched at once for dash streams
+_CAPTION_CONNECTIONS = 8        # caption tracks fetched at once
+_STREAMS_AT_ONCE  = 2           # streams of a video downloaded at once (ex. video+audio)
+
+# patterns tried in turn to find the js decipher func. key is 'sig'. In priority order, specific
+# to general: not adaptive, as the generic split("") ones also match helpers, and this is
+# scanned about once per player (decipher cached per player id)
+_PTRNS_DECIPHER = PatternSet([
+    r'\b[cs]\s*&&\s*[adf]\.set\([^,]+\s*,\s*encodeURIComponent\s*\(\s*(?P<sig>[a-zA-Z0-9$]+)\(' ,                # noqa: E501
+    r'\b[a-zA-Z0-9]+\s*&&\s*[a-zA-Z0-9]+\.set\([^,]+\s*,\s*encodeURIComponent\s*\(\s*(?P<sig>[a-zA-Z0-9$]+)\(' , # noqa: E501
+    r'(?:\b|[^a-zA-Z0-9$])(?P<sig>[a-zA-Z0-9$]{2})\s*=\s*function\(\s*a\s*\)\s*{\s*a\s*=\s*a\.split\(\s*""\s*\)' , # new # noqa: E501
+    r'\b(?P<sig>[a-zA-Z0-9$]{2})\s*=\s*function\(\s*a\s*\)\s*{\s*a\s*=\s*a\.split\(\s*""\s*\)' , # \b & {2}      # noqa: E501
+    r'(?P<sig>[a-zA-Z0-9$]+)\s*=\s*function\(\s*a\s*\)\s*{\s*a\s*=\s*a\.split\(\s*""\s*\)' ,     # old format
+    # Obsolete patterns
+    r'(["\'])signature\1\s*,\s*(?P<sig>[a-zA-Z0-9$]+)\(' ,
+    r'\.sig\|\|(?P<sig>[a-zA-Z0-9$]+)\(' ,
+    r'yt\.akamaized\.net/\)\s*\|\|\s*.*?\s*[cs]\s*&&\s*[adf]\.set\([^,]+\s*,\s*(?:encodeURIComponent\s*\()?\s*(?P<sig>[a-zA-Z0-9$]+)\(' , # noqa: E501
+    r'\b[cs]\s*&&\s*[adf]\.set\([^,]+\s*,\s*(?P<sig>[a-zA-Z0-9$]+)\(' ,                         # noqa: E501
+    r'\b[a-zA-Z0-9]+\s*&&\s*[a-zA-Z0-9]+\.set\([^,]+\s*,\s*(?P<sig>[a-zA-Z0-9$]+)\(' ,          # noqa: E501
+    r'\bc\s*&&\s*a\.set\([^,]+\s*,\s*\([^)]*\)\s*\(\s*(?P<sig>[a-zA-Z0-9$]+)\(' ,               # noqa: E501
+    r'\bc\s*&&\s*[a-zA-Z0-9]+\.set\([^,]+\s*,\s*\([^)]*\)\s*\(\s*(?P<sig>[a-zA-Z0-9$]+)\(' ,    # noqa: E501
+    ], name="decipher")
+# patterns to find where the page data (json) starts in playlist/channel html
+_PTRNS_INITIAL_DATA = PatternSet([
+    r'\bvar\s+ytInitialData\s*=\s*(?={)',
+    r'window\["ytInitialData"\]\s*=\s*(?={)',
+    ], adaptive=True, name="initial_data")
+# patterns to find where player config (json) starts in embed html (age restricted) and
+# in watch html. the json object itself is decoded by json_extract()
+_PTRNS_PLAYER_CONFIG = PatternSet([
+    r";yt\.setConfig\(\{'PLAYER_CONFIG':\s*(?={)",
+    r"\byt\.setConfig\(\{.*?'PLAYER_CONFIG':\s*(?={)",
+    ], adaptive=True, name="player_config")
+_PTRNS_YTPLAYER_CONFIG = PatternSet([
+    r';ytplayer\.config\s*=\s*(?={)',
+    ], name="ytplayer_config")
 
 # video information template
 _VIDU_INFO_TMPLT = {
@@ -50,45 +116,111 @@ _VIDU_INFO_TMPLT = {
     "vidu_info" :       None,       # video info got via get_video_info link
     "js_url" :          None,       # js url for the video
     "js_rsp" :          None,       # html contect of js_url
-    "js_cache" :        {},         # cached js player decipher
+    "js_cache" :        {},         # cached js player decipher (opcodes)
     "js_playerid" :     None,       # js player id for this vidu
     "title" :           None,
     "description" :     None,
-    "streams" :         [],         # list of stream dict (below)
+    "streams" :         [],         # list of StreamInfo
     "captions" :        [],         # list of captions/subtitles
     "chapters" :        [],         # list of chapters
+    "from_cache" :      False,      # info (below) served from cache, no fetch nor extract
 }
+_INFO_CACHE_KEYS = ["vidu_id", "age_limit", "js_playerid", "title", "description",
+                    "streams", "captions", "chapters"]
 
-# stream data template (useful set of info)
-_STREAM_TMPLT = {
-    "itag" :            "-1",       # -'itag'
-    "url" :             "-1",       # quote url from stream info -'url' or decrypted from cipher
-    "cipher" :          "-1",       # cipher dict: "url", & ... -'signatureCipher'/'cipher'
-                                    # 1) "sp","s" for encrypted, 2) "sig" gives signature for unencryped
-    "file_sz" :         "-1",       # size in byte -'contentLength'
-    "last_modify" :     "-1",       # in epoch us - 'lastModified'
-    "width" :           "-1",       # -'width' or from itag table
-    "height" :          "-1",       # -'height' or from itag table
-    "dura_ms" :         "-1",       # duration in ms -'approxDurationMs'
-    "mimetype" :        "-1",       # ex. video/mp4; codecs=\"avc1.42001E, mp4a.40.2\" -'mimeType'
-    "mime" :            "-1",       # ex. video/mp4, video/webm, audio/mp4, audio/webm -'mime' in url
-    "abr" :             "-1",       # -'averageBitrate'
-    "quality" :         "-1",       # (muxed video) tiny,small,medium -'quality'
-    "aquality" :        "-1",       # -'audioQuality'
-    "asr" :             "-1",       # (audio) ex.44100,48000 -'audioSampleRate'
-    "label" :           "-1",       # ex.240p -'qualityLabel'
-    "acodec" :          "-1",       # part of mimetype
-    "vcodec" :          "-1",       # part of mimetype
-    "type" :            "-1",       # '+'=video&audio, 'V'=video only, 'A'=audio only
-    "ext" :             "-1",       # ex. mp4, webm etc. part of mime
-    "order" :           "  ",       # final recommended stream(s) to download
-}
+# stream info: StreamInfo (streaminfo.py)
 # otherfields: bitrate,fps
 
 
+def _fill_from_itag(stream=None, dura_ms=-1):
+    """Fill attributes stream doesn't give from the itag index, and estimate its size (for
+       ranking) if not given, with video dura_ms if stream has none. Return True if itag known
+    """
+    _info = itag_info(stream.itag)
+    if _info:
+        if stream.width <= 0: stream.width = _info.width
+        if stream.height <= 0: stream.height = _info.height
+        if not stream.ext: stream.ext = _info.ext
+        if not stream.type:                 # no (or unknown) mimetype: as the index says
+            stream.vcodec = _info.vcodec ; stream.acodec = _info.acodec
+            stream.type = ("+" if _info.acodec else "V") if _info.vcodec else "A"
+        if stream.abr <= 0 and stream.type == "A" and _info.abr > 0: stream.abr = _info.abr*1000
+    if stream.dura_ms <= 0: stream.dura_ms = dura_ms
+    if stream.file_sz <= 0 and stream.est_sz <= 0 and stream.dura_ms > 0:
+        _bps = stream.abr if stream.abr > 0 else est_bitrate(_info, stream.height,
+                                                               stream.vcodec)
+        if _bps > 0: stream.est_sz = _bps * stream.dura_ms // 8000
+    return _info is not None
+
+
+def _list_items(data=None):
+    """Return (video ids, continuation token or None) of a page of playlist/channel data
+       (ytInitialData or an innertube browse response), in page order
+    """
+    _ids = [] ; _token = None
+    _stack = [data]
+    while _stack:                           # walk the json depth first, in document order
+        _obj = _stack.pop()
+        if isinstance(_obj, dict):
+            for k in _LIST_RENDERERS:
+                if 'videoId' in _obj.get(k, ()): _ids.append(_obj[k]['videoId'])
+            _cont = (_obj.get('continuationItemRenderer', {}).get('continuationEndpoint', {})
+                     .get('continuationCommand', {}).get('token')
+                     or _obj.get('nextContinuationData', {}).get('continuation'))   # old
+            if _cont and not _token: _token = _cont
+            _stack.extend(reversed(list(_obj.values())))
+        elif isinstance(_obj, list):
+            _stack.extend(reversed(_obj))
+    return list(ordereddict.fromkeys(_ids)), _token
+
+
+def _write_cues(data=None, fp=None, fmt="srt"):
+    """Convert timedtext xml data (<transcript><text start="4.22" dur="4.93">..</text>..) into
+       srt or vtt cues written to fp as they're parsed (pull parser, a cue at a time, no
+       tree kept). Return number of cues
+    """
+    # ex: <text start="4.22" dur="4.93">we&amp;#39re ...</text> ==>
+    #     1\n00:00:04,220 --> 00:00:09,150\nwe're ...\n   (vtt: 00:00:04.220 and no number)
+    _vtt = (fmt == "vtt")
+    if _vtt: fp.write("WEBVTT\n\n")
+    _parser = et.XMLPullParser(events=("start", "end"))
+    _root = None
+    _cue = None                             # last cue, written once the next one is known
+    _seq = 0
+    def _write(cue):
+        _start, _end, _txt = cue
+        _start = float_to_srt_time(_start) ; _end = float_to_srt_time(_end)
+        if _vtt:
+            fp.write("%s --> %s\n%s\n\n" % (_start.replace(",", "."), _end.replace(",", "."), _txt))
+        else:
+            fp.write("%s%d\n%s --> %s\n%s\n" % ("\n" if _seq > 1 else "", _seq, _start, _end, _txt))
+    for i in range(0, len(data or ""), 65536):
+        _parser.feed(data[i:i+65536])
+        for _event, _elem in _parser.read_events():
+            if _event == "start":
+                if _root is None: _root = _elem
+                continue
+            if _elem is _root or _elem.tag != "text": continue
+            _start = float(_elem.attrib['start'])
+            # vtt time overlaps in neighboring, so put start of next as end of last
+            if _cue:
+                if _start < _cue[1]: _cue[1] = _start
+                _write(_cue)
+            _txt = html.unescape(_elem.text or "")     # unescape HTML entities
+            _cue = [_start, _start + float(_elem.attrib['dur']), _txt]
+            _seq += 1
+            _root.clear()                   # drop the cues done
+    _parser.close()
+    if _cue: _write(_cue)
+    return _seq
+
+
 class YoutubeER(BaseExtractor):
     """Extractor for Youtube video"""
-    def __init__(self):
+    base_url = _BASE_URL        # site of watch/embed/js pages (ex. a local server for bench)
+
+    def __init__(self, info_ttl=None):
+        """info_ttl: max secs to serve video info from cache (default _INFO_CACHE_TTL, 0=off)"""
         self.params = dict(_VIDU_INFO_TMPLT)
         # flush the list and dict (if it uses append/update later on)
         self.params['streams'] = []
@@ -96,7 +228,130 @@ class YoutubeER(BaseExtractor):
         
         self.er_id = __class__.__name__[:-2] # remove ER suffix
         # load cached js info if any
-        self.params['js_cache'] = read_dct(fn="%s_jscache.txt" % self.er_id)
+        self.js_cache_fn = cache_path("%s_jscache.json" % self.er_id)
+        self.params['js_cache'] = read_dct(fn=self.js_cache_fn, version=_JS_CACHE_VERSION)
+        self.info_ttl = _INFO_CACHE_TTL if info_ttl is None else info_ttl
+
+
+    def _info_cache_fn(self, vidu_id):
+        """Path of cached video info of vidu_id"""
+        return cache_path(os.path.join("%s_info" % self.er_id, "%s.json" % vidu_id))
+
+
+    def _load_info_cache(self, vidu_id):
+        """Load video info of vidu_id into params if cached and still fresh. Return True if so"""
+        if not self.info_ttl: return False
+        try:
+            with open(self._info_cache_fn(vidu_id), "rb") as fp: _dct = json_load(fp.read().decode('utf-8'))
+        except OSError:
+            return False
+        if not _dct or _dct.get('version') != _INFO_CACHE_VERSION: return False
+        if _dct.get('expire', 0) <= time.time():
+            logger.debug("%s: cached info expired", vidu_id)
+            return False
+        for k in _INFO_CACHE_KEYS: self.params[k] = _dct[k]
+        self.params['streams'] = [StreamInfo.from_dict(i) for i in _dct['streams']]
+        self.params['from_cache'] = True
+        logger.info("%s: video info from cache (expires in %ds)", vidu_id, _dct['expire']-time.time())
+        return True
+
+
+    def _save_info_cache(self):
+        """Cache the extracted video info until the first stream url expires (or info_ttl)"""
+        if not self.info_ttl or not self.params['streams']: return
+        _expire = time.time() + self.info_ttl
+        for i in self.params['streams']:
+            _mobj = re.search(r'[?&]expire=(\d+)', i.url)
+            if _mobj: _expire = min(_expire, int(_mobj.group(1)) - _INFO_CACHE_MARGIN)
+        if _expire <= time.time(): return
+        _dct = {k: self.params[k] for k in _INFO_CACHE_KEYS}
+        _dct['streams'] = [i.to_dict() for i in self.params['streams']]
+        _dct.update({"version": _INFO_CACHE_VERSION, "expire": int(_expire)})
+        try:                # optional: the info is extracted anyway
+            atomic_write(self._info_cache_fn(self.params['vidu_id']), json.dumps(_dct).encode('utf-8'))
+        except OSError as e:
+            logger.warning("%s: video info not cached (%s)", self.params['vidu_id'], e)
+
+
+    def _video_id(self, url):
+        """Implement parent method to get video ID of url (as _fetch_info), with no request"""
+        mobj = re.search(_PATTERN_VIDU_ID, url or "")
+        return mobj.group(1) if mobj else None
+
+
+    def _expand_url(self, url):
+        """Implement parent method to expand a playlist/channel url into its video urls"""
+        mobj = re_search(_PATTERN_PLAYLIST, url)
+        if mobj:
+            return self._iter_list(mobj.group(1),
+                                   _TMPLT_PLAYLIST_URL.format(base=self.base_url, id=mobj.group(1)))
+        mobj = re_search(_PATTERN_CHANNEL, url)
+        if mobj:
+            return self._iter_list(re.sub(r'[^0-9A-Za-z_@-]', "_", mobj.group(1)),
+                                   _TMPLT_CHANNEL_URL.format(base=self.base_url, path=mobj.group(1)))
+        return iter([url])
+
+
+    def _iter_list(self, list_id, url):
+        """Yield watch urls of the videos of playlist/channel list_id at url, a page at a time.
+           The next page is fetched (in background) while the videos of this one are
+           consumed. Only these two pages are held however long the list is
+        """
+        _ctx = contextvars.copy_context()   # trace attrs etc of the caller for the fetches
+        _pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="list")
+        _page = _pool.submit(_ctx.run, self._list_page, list_id, 1, url)
+        _no = 1 ; _count = 0
+        try:
+            while _page is not None:
+                _ids, _cfg = _page.result()
+                # prefetch the next page, then hand out the videos of this one
+                _page = _pool.submit(_ctx.run, self._list_page, list_id, _no+1, None, _cfg) \
+                        if _cfg else None
+                _count += len(_ids)
+                logger.info("%s: page %d, %d videos (%d so far)", list_id, _no, len(_ids), _count)
+                for i in _ids: yield _TMPLT_WATCH_URL.format(base=self.base_url, id=i)
+                _no += 1
+        finally:
+            if _page is not None: _page.cancel()
+            _pool.shutdown(wait=False)
+
+
+    def _list_page(self, list_id, page_no, url=None, cfg=None):
+        """Fetch a page of playlist/channel list_id: the html at url (1st page, which gives
+           the innertube key and context), or else the continuation in cfg by innertube browse.
+           Return (video ids, cfg of the next page or None if the last), ([], None) if failed
+        """
+        try:
+            with span("list_page", list_id=list_id, page=page_no):
+                if url:
+                    logger.info("%s: downloading list page", list_id)
+                    data, rsp, charset = http_get(url=url, fn="%s__list.gz" % list_id)
+                    _data = json_extract(_PTRNS_INITIAL_DATA, data) \
+                            if isinstance(data, str) else None
+                    if isinstance(data, str):
+                        mobj = re_search(r'"INNERTUBE_API_KEY"\s*:\s*"([^"]+)"', data)
+                        _ver = re_search(r'"INNERTUBE_CLIENT_VERSION"\s*:\s*"([^"]+)"', data)
+                        _context = json_extract(r'"INNERTUBE_CONTEXT"\s*:\s*(?={)', data) or \
+                            {"client": {"clientName": "WEB",
+                                        "clientVersion": _ver.group(1) if _ver else "2.20201021"}}
+                        cfg = {"key": mobj.group(1) if mobj else None, "context": _context}
+                else:
+                    _body = json.dumps({"context": cfg['context'], "continuation": cfg['token']})
+                    data, rsp, charset = http_get(
+                        url=_TMPLT_BROWSE_URL.format(base=self.base_url, key=cfg['key']),
+                        headers=dict(std_http_headers, **{"Content-Type": "application/json"}),
+                        fn="%s__list%d.gz" % (list_id, page_no), data=_body.encode('utf-8'))
+                    _data = json_load(data) if isinstance(data, str) else None
+        except (OSError, http.client.HTTPException) as e:     # URLError, timeout etc
+            logger.error("%s: page %d failed (%s)", list_id, page_no, e)
+            return [], None
+        if not _data:
+            logger.error("%s: no list in page %d (%s)", list_id, page_no,
+                         data if not isinstance(data, str) else "unknown format")
+            return [], None
+        _ids, _token = _list_items(_data)
+        if not _token or not cfg.get('key'): return _ids, None
+        return _ids, dict(cfg, token=_token)
 
 
     def _fetch_info(self, url):
@@ -113,9 +368,10 @@ class YoutubeER(BaseExtractor):
             self.params['vidu_id'] = vidu_id
             logger.debug("video ID = %s" % vidu_id)
         # normalized url and other possible forms of url
-        self.params['watch_url'] = _TMPLT_WATCH_URL.format(vidu_id)
-        self.params['embed_url'] = _TMPLT_EMBED_URL.format(vidu_id)
+        self.params['watch_url'] = _TMPLT_WATCH_URL.format(base=self.base_url, id=vidu_id)
+        self.params['embed_url'] = _TMPLT_EMBED_URL.format(base=self.base_url, id=vidu_id)
         self.params['eurl']      = _TMPLT_EURL.format(vidu_id)
+        if self._load_info_cache(vidu_id): return   # fresh info cached. no need to fetch
 
         # additional in youtube url query:
         #   has_verified=1  will pass age-restriction
@@ -155,29 +411,14 @@ class YoutubeER(BaseExtractor):
                             ) # order really matter?
             # get video info, and logging it if logging level set
             logger.info("%s: downloading video info", vidu_id)
-            vdata, vrsp, charset = http_get(url=_TMPLT_VIDU_INFO_URL, qs=qs,
+            vdata, vrsp, charset = http_get(url=_TMPLT_VIDU_INFO_URL.format(base=self.base_url), qs=qs,
                                             fn="%s__viduinfo.gz" % vidu_id)
             self.params['vidu_info'] = vdata
 
 
     def _decipher_js(self):
         """Convert js decipher func to py func, assuming js stored in params['js_rsp']"""
-        _patterns = [
-            r'\b[cs]\s*&&\s*[adf]\.set\([^,]+\s*,\s*encodeURIComponent\s*\(\s*(?P<sig>[a-zA-Z0-9$]+)\(' ,                # noqa: E501
-            r'\b[a-zA-Z0-9]+\s*&&\s*[a-zA-Z0-9]+\.set\([^,]+\s*,\s*encodeURIComponent\s*\(\s*(?P<sig>[a-zA-Z0-9$]+)\(' , # noqa: E501
-            r'(?:\b|[^a-zA-Z0-9$])(?P<sig>[a-zA-Z0-9$]{2})\s*=\s*function\(\s*a\s*\)\s*{\s*a\s*=\s*a\.split\(\s*""\s*\)' , # new # noqa: E501
-            r'\b(?P<sig>[a-zA-Z0-9$]{2})\s*=\s*function\(\s*a\s*\)\s*{\s*a\s*=\s*a\.split\(\s*""\s*\)' , # \b & {2}      # noqa: E501
-            r'(?P<sig>[a-zA-Z0-9$]+)\s*=\s*function\(\s*a\s*\)\s*{\s*a\s*=\s*a\.split\(\s*""\s*\)' ,     # old format
-            # Obsolete patterns
-            r'(["\'])signature\1\s*,\s*(?P<sig>[a-zA-Z0-9$]+)\(' ,
-            r'\.sig\|\|(?P<sig>[a-zA-Z0-9$]+)\(' ,
-            r'yt\.akamaized\.net/\)\s*\|\|\s*.*?\s*[cs]\s*&&\s*[adf]\.set\([^,]+\s*,\s*(?:encodeURIComponent\s*\()?\s*(?P<sig>[a-zA-* Z0-9$]+)\(' , # noqa: E501
-            r'\b[cs]\s*&&\s*[adf]\.set\([^,]+\s*,\s*(?P<sig>[a-zA-Z0-9$]+)\(' ,                         # noqa: E501
-            r'\b[a-zA-Z0-9]+\s*&&\s*[a-zA-Z0-9]+\.set\([^,]+\s*,\s*(?P<sig>[a-zA-Z0-9$]+)\(' ,          # noqa: E501
-            r'\bc\s*&&\s*a\.set\([^,]+\s*,\s*\([^)]*\)\s*\(\s*(?P<sig>[a-zA-Z0-9$]+)\(' ,               # noqa: E501
-            r'\bc\s*&&\s*[a-zA-Z0-9]+\.set\([^,]+\s*,\s*\([^)]*\)\s*\(\s*(?P<sig>[a-zA-Z0-9$]+)\(' ,    # noqa: E501
-            ]
-        _py_decipher = parse_js(_patterns, key="sig", jscode=self.params['js_rsp'])
+        _py_decipher = parse_js(_PTRNS_DECIPHER, key="sig", jscode=self.params['js_rsp'])
         return _py_decipher
         # NOTE: js callstack:
         #   1) ...,q=Bw(f.url,f.sp,f.s,d);...
@@ -185,22 +426,35 @@ class YoutubeER(BaseExtractor):
         #   3) bv=function.....
 
 
+    def _get_decipher(self, js_playerid=None):
+        """Return the compiled decipher of js_playerid, compiling its cached opcodes once"""
+        if not js_playerid: return None
+        if js_playerid not in _JS_DECIPHER:
+            _ops = self.params['js_cache'].get(js_playerid)
+            if not _ops: return None
+            _JS_DECIPHER[js_playerid] = compile_decipher(_ops)
+        return _JS_DECIPHER[js_playerid]
+
+
     def _extract_info(self):
         """Implement parent method to extract video/stream info"""
         # video info are in watch html, but is in get_video_info html if restricted (1:yt)
         # or, can use two versions of get_video_info anyway for non-/restricted     (2:py)
         vidu_id = self.params['vidu_id']
+        if self.params['from_cache']: return        # done already
 
         def _fetch_js(plcfg=None):
             """Fetch base js given in plcfg['assets']['js'] from watch or embed html, and return the js player id"""
             # extract js path and get js player id etc. Ex."js": "/s/player/c718385a/player_ias.vflset/en_US/base.js"
             _jspath = plcfg.get('assets',{}).get('js')
-            self.params['js_url'] = "https://www.youtube.com"+_jspath
+            self.params['js_url'] = self.base_url+_jspath
             _patterns = [
                 r'/(?P<id>[a-zA-Z0-9_-]{8,})/player_ias\.vflset(?:/[a-zA-Z]{2,3}_[a-zA-Z]{2,3})?/base\.(?P<ext>[a-z]+)$',
                 r'\b(?P<id>vfl[a-zA-Z0-9_-]+)\b.*?\.(?P<ext>[a-z]+)$',
                 ]
+            _touch = False
             if not self.params['js_playerid']:  # this just done once per vidu
+                _touch = True
                 mobj = re_search(_patterns, _jspath)
                 if not mobj:
                     logger.error("%s: couldn't find js player id in %s", vidu_id, _jspath)
@@ -212,7 +466,11 @@ class YoutubeER(BaseExtractor):
 
             # this func is called when a url needs signature since the decipher func is in js
             # so check if decipher is in cache, and if not, fetch base js, and logging it if logging level requires
-            if _js_playerid in self.params['js_cache']: return _js_playerid
+            if _js_playerid in self.params['js_cache']:
+                if _touch:                      # mark as recently used (once per vidu)
+                    save_dct(fn=self.js_cache_fn, dct={_js_playerid: self.params['js_cache'][_js_playerid]},
+                             version=_JS_CACHE_VERSION, max_entries=_JS_CACHE_SIZE)
+                return _js_playerid
             logger.info("%s: downloading player js", vidu_id)
             jdata, jrsp, charset = http_get(url=self.params['js_url'], fn="%s__js.gz" % vidu_id)
             self.params['js_rsp'] = jdata
@@ -221,7 +479,8 @@ class YoutubeER(BaseExtractor):
             _py_decipher = self._decipher_js()
             if _py_decipher:
                 self.params['js_cache'][_js_playerid] = _py_decipher
-                save_dct(fn="%s_jscache.txt" % self.er_id, dct=self.params['js_cache']) 
+                save_dct(fn=self.js_cache_fn, dct={_js_playerid: _py_decipher},
+                         version=_JS_CACHE_VERSION, max_entries=_JS_CACHE_SIZE)
             return _js_playerid
 
 
@@ -242,13 +501,7 @@ class YoutubeER(BaseExtractor):
         #        ../microformat                         # (additional info)
 
         if self.params['age_limit']:
-            _patterns = [ r";yt\.setConfig\(\{'PLAYER_CONFIG':\s*({.+?})(,'EXPERIMENT_FLAGS'|;)",  # noqa: E501
-                          r"\byt\.setConfig\(\{.*'PLAYER_CONFIG':\s*({.+?})\}\)",
-                          r";yt\.setConfig\(\{'PLAYER_CONFIG':\s*({.+?})\}\)",
-                        ]
-            mobj = re_search(_patterns, self.params['embed_rsp'], logging=False)
-            plcfg = mobj.group(1) if mobj else None
-            plcfg = json_load(plcfg)
+            plcfg = json_extract(_PTRNS_PLAYER_CONFIG, self.params['embed_rsp'])
             # player config in embed html only has useful js url. its embedded_player_response unuseful yet 
             if not plcfg:
                 logger.error("%s: not found yt.setConfig", vidu_id)
@@ -264,13 +517,8 @@ class YoutubeER(BaseExtractor):
             log_rsp(vidu_id+"__plrsp.gz", jsdict=True, data=player_response)
 
         else:
-            _patterns = [ r';ytplayer\.config\s*=\s*({.+?});ytplayer',
-                          r';ytplayer\.config\s*=\s*({.+?});',
-                        ]
-            mobj = re_search(_patterns, self.params['watch_rsp'], logging=False)
-            plcfg = mobj.group(1) if mobj else None
             # may need decode the \U part of it: plcfg=str_decode(plcfg, uppercase_escape)
-            plcfg = json_load(plcfg)
+            plcfg = json_extract(_PTRNS_YTPLAYER_CONFIG, self.params['watch_rsp'])
             video_info = {}
             player_response = None
             if plcfg:
@@ -303,33 +551,48 @@ class YoutubeER(BaseExtractor):
         if not _streaming_data:
             logger.error("%s: %s", vidu_id, player_response.get('playabilityStatus',{}).get('status'))
             return
-        streaming_fmts = _streaming_data.get('formats', [])
-        streaming_fmts.extend(_streaming_data.get('adaptiveFormats', []))
+        # (new list. player_response may still be serialized by the log_rsp writer)
+        streaming_fmts = _streaming_data.get('formats', []) + _streaming_data.get('adaptiveFormats', [])
         #logger.debug(json.dumps(streaming_fmts, indent=4))  # DEBUG PURPOSE ONLY
 
+        # cipher is a query string (&-delimt) (values'll be a list). it has: url, s,sp, or sig
+        _ciphers = [parse.parse_qs(fmt.get('cipher') or fmt.get('signatureCipher') or "")  # old&new name
+                    if not fmt.get('url') else {} for fmt in streaming_fmts]
+        # decrypt all encrypted sig 's' in one batch (needs the decipher func in js)
+        _sigs = [c['s'][0] for c in _ciphers if 's' in c and 'sig' not in c]
+        _sig_map = {}
+        if _sigs:
+            # call func that fetches js and stores decipher func in cache
+            _js_playerid = _fetch_js(plcfg)         # js is given in player cfg from watch or embed
+            _decipher = self._get_decipher(_js_playerid)
+            if _decipher:
+                _sig_map = dict(zip(_sigs, _decipher.decrypt_many(_sigs)))
+            else:
+                logger.error("%s: no js decipher for %d encrypted streams", vidu_id, len(_sigs))
+
         # SHOULD have 'streaming_fmts[]', and extract stream info
-        for fmt in streaming_fmts:
-            # get some fields if it has
-            _dct = { "itag" :    fmt.get('itag'),               # int
-                     "file_sz" : fmt.get('contentLength'),      # str
-                     "last_modify" : fmt.get('lastModified'),   # str (in epoch u(micro)s)
-                     "width" :   fmt.get('width'),              # int
-                     "height" :  fmt.get('height'),             # int
-                     "dura_ms" : fmt.get('approxDurationMs'),   # str
-                     "mimetype": fmt.get('mimeType'),           # str
-                     "abr" :     fmt.get('averageBitrate'),     # int
-                     "quality" : fmt.get('quality'),            # str
-                     "aquality": fmt.get('audioQuality'),       # str
-                     "asr" :     fmt.get('audioSampleRate'),    # str
-                     "label" :   fmt.get('qualityLabel'),       # str
-                   }
+        _dura_ms = 1000 * int(player_response.get('videoDetails',{}).get('lengthSeconds') or 0) or -1
+        for fmt, _cipher in zip(streaming_fmts, _ciphers):
+            # get some fields if it has. numbers given as str are parsed to int here, once
+            _stream = StreamInfo(
+                     itag =     fmt.get('itag'),                # int
+                     file_sz =  fmt.get('contentLength'),       # str
+                     last_modify = fmt.get('lastModified'),     # str (in epoch u(micro)s)
+                     width =    fmt.get('width'),               # int
+                     height =   fmt.get('height'),              # int
+                     dura_ms =  fmt.get('approxDurationMs'),    # str
+                     mimetype = fmt.get('mimeType'),            # str
+                     abr =      fmt.get('averageBitrate'),      # int
+                     quality =  fmt.get('quality'),             # str
+                     aquality = fmt.get('audioQuality'),        # str
+                     asr =      fmt.get('audioSampleRate'),     # str
+                     label =    fmt.get('qualityLabel'),        # str
+                   )
             # find stream url, otherwise in signatureCipher or cipher 
             _url = fmt.get('url')
             if not _url:
-                _cipher = fmt.get('cipher') or fmt.get('signatureCipher')    # old&new name
                 if not _cipher: continue            # if no info found, skip...
-                _cipher = parse.parse_qs(_cipher)   # cipher is a query string (&-delimt) (values'll be a list)
-                _dct['cipher'] = _cipher            # save, it has: url, s,sp, or sig
+                _stream.cipher = _cipher               # save, it has: url, s,sp, or sig
                 _url = sanity_url(_cipher.get('url', [''])[0])
                 if not _url: continue               # if url neither in cipher, skip...
 
@@ -337,14 +600,12 @@ class YoutubeER(BaseExtractor):
                 if 'sig' in _cipher:
                     _url += "&signature=" + _cipher['sig'][0]
                 elif 's' in _cipher:
-                    # call func that fetches js and stores decipher func in cache
-                    _js_playerid = _fetch_js(plcfg) # js is given in player cfg from watch or embed
-                    _sig = decrypt_sig(_cipher['s'][0], self.params['js_cache'][_js_playerid])
+                    _sig = _sig_map.get(_cipher['s'][0])
+                    if not _sig: continue           # not decrypted, skip...
                     # 'sp' gives the query name to use for sig. fallback to "signature" if no 'sp'
                     _sp = _cipher['sp'][0] if 'sp' in _cipher else "signature"
                     _url += "&%s=%s" % (_sp, _sig)
-            else:
-                _dct['cipher'] = {}                 # regular url. no sig needed.
+            # else: regular url (cipher {}). no sig needed.
 
             # some fields may be given in url or overriden by url
             _temp = parse.unquote(_url)             # unescape %xx to char default utf-8 & '.' if unknown
@@ -356,32 +617,23 @@ class YoutubeER(BaseExtractor):
 
             # data in url overrides previous value
             # other url info: mimeType or type, size (wxh/wXh), quality, quality_label, bitrate, fps
-            if ('itag' in _url_dct) and (int(_dct['itag']) != int(_url_dct['itag'][0])):
-                logger.warning("%s: itag not inconsistent (url=%s) and (stream=%s)",
-                                vidu_id, _url_dct['itag'][0], _dct['itag'])
-                _dct['itag'] = _url_dct['itag'][0]
-            if 'mime' in _url_dct: _dct['mime'] = _url_dct['mime'][0]
-            if ('clen' in _url_dct) and (_dct['file_sz'] != _url_dct['clen'][0]):
-                logger.warning("%s: itag=%s, content len inconsistent (url=%s) and (stream=%s)",
-                                vidu_id, str(_dct['itag']), _url_dct['clen'][0], _dct['file_sz'])
-                _dct['file_sz'] = _url_dct['clen'][0]
+            if ('itag' in _url_dct) and (_stream.itag != int(_url_dct['itag'][0])):
+                logger.warning("%s: itag not inconsistent (url=%s) and (stream=%d)",
+                                vidu_id, _url_dct['itag'][0], _stream.itag)
+                _stream.itag = _url_dct['itag'][0]
+            if 'mime' in _url_dct: _stream.mime = _url_dct['mime'][0]
+            if ('clen' in _url_dct) and (_stream.file_sz != int(_url_dct['clen'][0])):
+                logger.warning("%s: itag=%d, content len inconsistent (url=%s) and (stream=%d)",
+                                vidu_id, _stream.itag, _url_dct['clen'][0], _stream.file_sz)
+                _stream.file_sz = _url_dct['clen'][0]
             # final touch on url
             if 'ratebypass' not in _url_dct:
                 _url += "&ratebypass=yes"
             # url completed
-            _dct['url'] = _url
-            # final touch on file size (have to httphead for some streams)
-            if not _dct['file_sz']:                 # no stream size yet
-                _tempdata, _temp, _ = http_get(url=_url, method="HEAD")
-                if _temp:
-                    _dct['file_sz'] = _temp.getheader('Content-Length')
-                else:
-                    #logger.error("%s: itag=%s, HTTP %s error to head url=%s",
-                    #              vidu_id, str(_dct['itag']), _tempdata, _url)
-                    pass
+            _stream.url = _url
 
             # extrac vcodec & acodec from mimetype
-            _mime, _codecs = _dct['mimetype'].split(";")
+            _mime, _, _codecs = _stream.mimetype.partition(";")
             _type, _, _ext = _mime.partition("/")
             _ptrn_codecs = r'(?P<key>[a-zA-Z_-]+)=(?P<quote>["\']?)(?P<val>.+?)(?P=quote)(?:;|$)'
             mobj = re.search(_ptrn_codecs, _codecs)
@@ -390,35 +642,35 @@ class YoutubeER(BaseExtractor):
             else:
                 _codecs = ["--", "--"]
             _mime = _mime.strip() ; _type = _type.strip() ; _codecs = [ i.strip() for i in _codecs]
-            if _dct['mime'] and _mime != _dct['mime']:
-                logger.warning("%s: itag=%s, mime inconsistent (url=%s) and (stream=%s)",
-                                vidu_id, str(_dct['itag']), _dct['mime'][0], _mime)
-            _dct['ext'] = _ext.strip()
+            if _stream.mime and _mime and _mime != _stream.mime:
+                logger.warning("%s: itag=%d, mime inconsistent (url=%s) and (stream=%s)",
+                                vidu_id, _stream.itag, _stream.mime, _mime)
+            _stream.ext = _ext.strip()
             if   _type == "video":
                 if   len(_codecs) == 2:
-                    _dct['type'] = "+"
-                    _dct['vcodec'], _dct['acodec'] = _codecs
+                    _stream.type = "+"
+                    _stream.vcodec, _stream.acodec = _codecs
                 elif len(_codecs) == 1:
-                    _dct['type'] = "V"
-                    _dct['vcodec'] = _codecs[0] ; _dct['acodec'] = ""
+                    _stream.type = "V"
+                    _stream.vcodec = _codecs[0]
                 else:
-                    logger.warning("%s: itag=%s, unknow codecs '%s'",
-                                    vidu_id, str(_dct['itag']), _codecs) 
+                    logger.warning("%s: itag=%d, unknow codecs '%s'", vidu_id, _stream.itag, _codecs)
             elif _type == "audio":
-                _dct['type'] = "A" ; _dct['acodec'] = _codecs[0] ; _dct['vcodec'] = ""
-            else:
-                logger.error("%s: itag=%s, unknow mime type %s", vidu_id, str(_dct['itag']), _mime)
-
-            # update & save stream info
-            _sitag = str(_dct['itag'])
-            if not _sitag:
+                _stream.type = "A" ; _stream.acodec = _codecs[0]
+            elif _type:
+                logger.error("%s: itag=%d, unknow mime type %s", vidu_id, _stream.itag, _mime)
+
+            # fill what's not given from the itag index. final touch on file size: if not
+            # given, estimate it for ranking. the real size is got by http HEAD later, only
+            # for the stream(s) selected (_resolve_sizes)
+            if not _fill_from_itag(_stream, _dura_ms) and not _stream.type:
+                logger.error("%s: itag=%d, unknow type (no mime type)", vidu_id, _stream.itag)
+
+            # save stream info
+            if _stream.itag < 0:
                 logger.warning("%s: itag not found for a stream", vidu_id)
                 #continue
-            _stream_info = dict(_STREAM_TMPLT)                  # start with template
-
-            for k,v in _dct.items():
-                if v is not None: _stream_info.update({k:v})    # update with extracted info
-            self.params['streams'] += [_stream_info]
+            self.params['streams'] += [_stream]
 
         # captions
         # old info: https://video.google.com/timedtext?hl=en&type=list&v=<id>&disable_polymer=true
@@ -432,7 +684,8 @@ class YoutubeER(BaseExtractor):
                            vidu_id, len(self.params['streams']), len(streaming_fmts))
 
         # chapters (from description or from json etc)
-        self.params['chapters'] = self._extract_chapters()            
+        self.params['chapters'] = self._extract_chapters()
+        self._save_info_cache()
 
 
     def _extract_chapters(self):
@@ -472,6 +725,28 @@ class YoutubeER(BaseExtractor):
         return _res
 
 
+    @staticmethod
+    def _stream_size(stream):
+        """Return size of stream in byte, or its estimate if not known yet (0 if neither)"""
+        return stream.size
+
+
+    def _resolve_sizes(self, streams=None):
+        """Get the real size of streams not known yet, by http HEAD of them at once"""
+        _todo = [i for i in streams or [] if i.file_sz <= 0]
+        if not _todo: return
+        def _head(stream):
+            with span("head", vidu_id=self.params['vidu_id'], itag=str(stream.itag)):
+                _tempdata, _temp, _ = http_get(url=stream.url, method="HEAD")
+            if _temp and _temp.getheader('Content-Length'):
+                stream.file_sz = _temp.getheader('Content-Length')
+            else:
+                logger.warning("%s: itag=%d, HTTP %s error to head url",
+                               self.params['vidu_id'], stream.itag, _tempdata)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(_todo), 8)) as _pool:
+            list(_pool.map(_head, _todo))
+
+
     def _sort_streams(self):
         """Implement parent method to weigh and sort out best stream(s)"""
         # weighed dict:
@@ -481,89 +756,131 @@ class YoutubeER(BaseExtractor):
         if len(self.params['streams']) == 0: return ""
         _weigh = {}
         for i in self.params['streams']:
-            _idx = i['itag'] ; _weigh[_idx] = 0
-            if i['type'] != "A":  _weigh[_idx] += i['height']
-            if i['ext'] == "mp4": _weigh[_idx] += 30
-        _sz = [(i['file_sz'], i['itag']) for i in self.params['streams']] 
-        _sz.sort(key=lambda o:int(o[0]))            # sort size from low to high
+            _idx = i.itag ; _weigh[_idx] = 0
+            if i.type != "A":  _weigh[_idx] += max(i.height, 0)
+            if i.ext == "mp4": _weigh[_idx] += 30
+        _sz = [(self._stream_size(i), i.itag) for i in self.params['streams']]
+        _sz.sort(key=lambda o:o[0])                 # sort size from low to high
         for i in range(len(_sz)): _weigh[_sz[i][1]] += (i*10)
 
         # sort out best mux, video, audio if any
         _topmux = None; _topaud = None; _topvid = None;
         _lenmux = 0;    _lenaud = 0;    _lenvid = 0;
         for i in self.params['streams']:
-            _idx = i['itag']
-            if i['type'] == "+" and (_topmux is None or _weigh[_idx] > _weigh[_topmux]):
-                _topmux = _idx ; _lenmux = int(i['file_sz'])
-            if i['type'] == "V" and (_topvid is None or _weigh[_idx] > _weigh[_topvid]):
-                _topvid = _idx ; _lenvid = int(i['file_sz'])
-            if i['type'] == "A" and (_topaud is None or _weigh[_idx] > _weigh[_topaud]):
-                _topaud = _idx ; _lenaud = int(i['file_sz'])
+            _idx = i.itag
+            if i.type == "+" and (_topmux is None or _weigh[_idx] > _weigh[_topmux]):
+                _topmux = _idx ; _lenmux = self._stream_size(i)
+            if i.type == "V" and (_topvid is None or _weigh[_idx] > _weigh[_topvid]):
+                _topvid = _idx ; _lenvid = self._stream_size(i)
+            if i.type == "A" and (_topaud is None or _weigh[_idx] > _weigh[_topaud]):
+                _topaud = _idx ; _lenaud = self._stream_size(i)
 
         # pretty format key info
         _hdr = ["", "itag","AV","filesize","ext","resolution","quality","video","audio"]
         _fmtstr = "{:<3.3}{:<5.5}{:<3.3}{:<10.10}{:<6.6}{:<12.12}{:<8.8}{:<16.16}{:<16.16}"
         _ret = _fmtstr.format(*_hdr)+"\n"
         for i in self.params['streams']:
-            _idx = i['itag']
-            _h = str(i['height']); _w = str(i['width'])
-            if _h != "-1" or _w != "-1": _reso = _w+"x"+_h
+            _idx = i.itag
+            if i.height > 0 and i.width > 0: _reso = "%dx%d" % (i.width, i.height)
+            elif i.height > 0: _reso = "%dp" % i.height     # width not given nor in itag index
             else: _reso = ""
             if _idx == _topmux:
-                if int(_lenmux*1.0012) >= (_lenvid + _lenaud): i['order'] = "1"
-                else: i['order'] = "2"
+                if int(_lenmux*1.0012) >= (_lenvid + _lenaud): i.order = "1"
+                else: i.order = "2"
             if (_idx == _topvid) or (_idx == _topaud):
-                if int(_lenmux*1.0012) >= (_lenvid + _lenaud): i['order'] = "2"
-                else: i['order'] = "1"
-            _fmt = [ i['order'], str(i['itag']), i['type'], i['file_sz'], i['ext'],
-                     _reso, i['quality'], i['vcodec'], i['acodec']     # str(_weigh[_idx])
+                if int(_lenmux*1.0012) >= (_lenvid + _lenaud): i.order = "2"
+                else: i.order = "1"
+            if i.file_sz > 0: _size = str(i.file_sz)
+            elif i.est_sz > 0: _size = "~"+str(i.est_sz)     # estimated
+            else: _size = "-1"
+            _fmt = [ i.order, str(i.itag), i.type, _size, i.ext,
+                     _reso, i.quality, i.vcodec, i.acodec     # str(_weigh[_idx])
                    ]
             _ret += _fmtstr.format(*_fmt)+"\n"
 
         return _ret
 
 
-    def _download_streams(self, idx=None, dl_bar=None):
-        """Implement parent method to download the best or 'idx' list, and call back dl_bar if any"""
-        for i in self.params['streams']:
-            _itag = i['itag']
-            if idx and str(_itag) not in idx: continue
-            if not idx and i['order'] != "1": continue
-
-            if not i['vcodec'] or not i['acodec']:  # dash stream (either video or audio)
-                # Youtube throttles chunks >~10M for dash. Useful when server accepts range
-                _http_chunk_size = 10485760         # youtube throttles chunks >~10M
-            else: _http_chunk_size = None           # otherwise, don't need to chunk
-
-            _fn_pref = self.params['title'] if self.params['title'] else self.params['vidu_id']
-            if   i['type'] == "+":
-                _fn = "%s.%s" % (_fn_pref, i['ext'])
-            elif i['type'] == "V":
-                _fn = "%s__video-%s.%s" % (_fn_pref, str(_itag), i['ext'])
-            elif i['type'] == "A":
-                _fn = "%s__audio-%s.%s" % (_fn_pref, str(_itag), i['ext'])
-            else:
-                _fn = _fn_pref + "_unknowntype"
-
-            # download
-            _tot_bytes = int(i['file_sz'])
-            _vidu_id = self.params['vidu_id']
-            if _tot_bytes > 0:
-                if os.path.isfile(_fn):                     # check if file exists and is the same
-                    _tmp_time = int(os.path.getmtime(_fn))    # in whole sec
-                    _tmp_size = os.path.getsize(_fn)
-                    if (_tot_bytes > 0 and _tmp_size == _tot_bytes and int(i['last_modify']) > 0
-                        and _tmp_time == int(int(i['last_modify'])/1000000)):
-                        logger.info("%s: file '%s' already downloaded", _vidu_id, _fn)
-                        continue
-                logger.info("%s: downloading (%d bytes) to file: %s", _vidu_id, _tot_bytes, _fn)
-                _res = http_stream(url=i['url'], fn=_fn, tot_bytes=_tot_bytes,
-                                   http_chunk_size=_http_chunk_size, dl_bar=dl_bar)
-                if _res:    # error returns
-                    logger.error("%s: HTTP %s. URL wrong or expired", _vidu_id, _res.code)
-                elif int(i['last_modify']) > 0 :
-                    # set file (access time, last modified time)
-                    os.utime(_fn, (time.time(), int(i['last_modify'])/1000000))
+    def _download_streams(self, idx=None, dl_bar=None, connections=None, rate_limit=None,
+                          streams=None):
+        """Implement parent method to download the best or 'idx' list, and call back dl_bar if any.
+           Upto 'streams' (default _STREAMS_AT_ONCE) of them are downloaded at once (ex. video and
+           audio of a dash pair), sharing the budgets of the video: dash streams are fetched in
+           chunks over 'connections' (default _HTTP_CONNECTIONS) at once in all, the ones freed
+           by a stream going to the others, all under rate_limit (bytes/sec) if given, besides
+           the global limit.
+           Return a result dict per stream: itag, fn, bytes, secs, status ("done", "exists" or
+           "error") and error (None if not failed)
+        """
+        if connections is None: connections = _HTTP_CONNECTIONS
+        _streams = [i for i in self.params['streams']
+                    if (str(i.itag) in idx if idx else i.order == "1")]
+        if not _streams: return []
+        self._resolve_sizes(_streams)               # HEAD for size, just the selected ones
+        _at_once = max(1, min(len(_streams), streams or _STREAMS_AT_ONCE))
+        _conns = ConnectionBudget(connections)                      # one for all of the video
+        _limit = TokenBucket(rate_limit) if rate_limit else None    # one for all of the video
+        _ctxs = [contextvars.copy_context() for _ in _streams]      # trace attrs of the caller
+        with concurrent.futures.ThreadPoolExecutor(max_workers=_at_once,
+                                                   thread_name_prefix="stream") as _pool:
+            _futs = [_pool.submit(c.run, self._download_stream, i, dl_bar, _conns, _limit)
+                     for c, i in zip(_ctxs, _streams)]
+            return [f.result() for f in _futs]     # in order of the streams
+
+
+    def _download_stream(self, stream, dl_bar=None, connections=None, rate_limit=None):
+        """Download a stream to its file (see _download_streams). Return the result dict"""
+        _itag = stream.itag
+
+        if stream.is_dash:                          # dash stream (either video or audio)
+            # Youtube throttles chunks >~10M for dash. Useful when server accepts range.
+            # Chunks are sized to the throughput from there, not to go beyond it
+            _http_chunk_size = _HTTP_CHUNK_SIZE
+        else: _http_chunk_size = None               # otherwise, don't need to chunk
+
+        _fn_pref = self.params['title'] if self.params['title'] else self.params['vidu_id']
+        if   stream.type == "+":
+            _fn = "%s.%s" % (_fn_pref, stream.ext)
+        elif stream.type == "V":
+            _fn = "%s__video-%d.%s" % (_fn_pref, _itag, stream.ext)
+        elif stream.type == "A":
+            _fn = "%s__audio-%d.%s" % (_fn_pref, _itag, stream.ext)
+        else:
+            _fn = _fn_pref + "_unknowntype"
+
+        # download
+        _tot_bytes = stream.file_sz
+        _vidu_id = self.params['vidu_id']
+        _result = {"itag": _itag, "fn": _fn, "bytes": max(_tot_bytes, 0), "secs": 0.0,
+                   "status": "error", "error": None}
+        if _tot_bytes <= 0:
+            _result['error'] = "size unknown"
+            return _result
+        if os.path.isfile(_fn):                     # check if file exists and is the same
+            _tmp_time = int(os.path.getmtime(_fn))    # in whole sec
+            _tmp_size = os.path.getsize(_fn)
+            if (_tmp_size == _tot_bytes and stream.last_modify > 0
+                and _tmp_time == stream.last_modify//1000000):
+                logger.info("%s: file '%s' already downloaded", _vidu_id, _fn)
+                _result['status'] = "exists"
+                return _result
+        logger.info("%s: downloading (%d bytes) to file: %s", _vidu_id, _tot_bytes, _fn)
+        _begin = time.time()
+        with span("download_stream", vidu_id=_vidu_id, itag=str(_itag)):
+            _res = http_stream(url=stream.url, fn=_fn, tot_bytes=_tot_bytes,
+                               http_chunk_size=_http_chunk_size, dl_bar=dl_bar,
+                               connections=connections, last_modify=stream.last_modify,
+                               rate_limit=rate_limit, chunk_max=_http_chunk_size)
+        _result['secs'] = round(time.time() - _begin, 3)
+        if _res:    # error returns
+            logger.error("%s: HTTP %s. URL wrong or expired", _vidu_id, getattr(_res, 'code', _res))
+            _result['error'] = "HTTP %s" % getattr(_res, 'code', _res)
+            return _result
+        _result['status'] = "done"
+        if stream.last_modify > 0 :
+            # set file (access time, last modified time)
+            os.utime(_fn, (time.time(), stream.last_modify/1000000))
+        return _result
 
 
     def _list_captions(self):
@@ -577,43 +894,37 @@ class YoutubeER(BaseExtractor):
 
     def _vtt_to_srt(self, data):
         """Convert vtt format caption/subtitle to srt format"""
-        # ex: <transcript><text start="4.22" dur="4.93">we&amp;#39re ...</test> ==>
-        #     1\n00:00:04,220 --> 00:00:09.150\nwe're ...\n
-        root = et.fromstring(data)
-        _tmp = []
-        _end = 0.0
-        # vtt time overlaps in neighboring, so put start of next as end of last
-        for i, obj in enumerate(root):
-            _start = float(obj.attrib['start'])
-            if _start < _end: _tmp[i-1][2] = _start
-            _dur   = float(obj.attrib['dur'])
-            _txt   = obj.text or ""                 # "  "->" ", "\n"->" " needed???
-            _txt   = html.unescape(_txt)            # unescape HTML entities
-            _end   = _start + _dur
-            _seq   = i + 1      # enum is 0-base -> srt is 1-base
-            _tmp.append([_seq, _start, _end, _txt])
-        _ret = []
-        for _seq, _start, _end, _txt in _tmp:
-            _ret.append("{seq}\n{start} --> {end}\n{txt}\n".format(
-                        seq=_seq, txt=_txt,
-                        start=float_to_srt_time(_start),
-                        end=float_to_srt_time(_end))
-                       )
-        return "\n".join(_ret).strip()
+        _fp = io.StringIO()
+        _write_cues(data, _fp, "srt")
+        return _fp.getvalue()
 
 
-    def _download_captions(self):
-        """Implement parent method to download captions"""
+    def _download_captions(self, fmt="srt"):
+        """Implement parent method to download captions, converted to fmt ("srt" or "vtt").
+           Tracks are fetched at once (upto _CAPTION_CONNECTIONS) over the shared transport
+        """
         _vidu_id = self.params['vidu_id']
-        logger.info("%s: downloading %d captions", _vidu_id, len(self.params['captions']))
+        _captions = self.params['captions']
+        logger.info("%s: downloading %d captions", _vidu_id, len(_captions))
         _fn_pref = self.params['title'] if self.params['title'] else _vidu_id
-        for i in self.params['captions']:
-            _lang_code = i['languageCode']
-            _kind = i.get('kind',"sub")             # kind is optional field
-            data, rsp, _ = http_get(i['baseUrl'],
-                                    fn="%s__%s-%s.gz" % (_vidu_id, _lang_code, _kind))
-            _fn = "%s.%s-%s.srt" % (_fn_pref, _lang_code, _kind)
-            with open(_fn, "w") as _fp:
-                _fp.write(self._vtt_to_srt(data))
+        def _caption(track):
+            _lang_code = track['languageCode']
+            _kind = track.get('kind',"sub")         # kind is optional field
+            with span("caption", vidu_id=_vidu_id, lang=_lang_code, kind=_kind):
+                data, rsp, _ = http_get(track['baseUrl'],
+                                        fn="%s__%s-%s.gz" % (_vidu_id, _lang_code, _kind))
+                if not isinstance(data, str):
+                    logger.error("%s: caption %s-%s, HTTP %s", _vidu_id, _lang_code, _kind,
+                                 getattr(data, 'code', data))
+                    return
+                _fn = "%s.%s-%s.%s" % (_fn_pref, _lang_code, _kind, fmt)
+                with span("caption.convert"), open(_fn, "w", encoding="utf-8") as _fp:
+                    _write_cues(data, _fp, fmt)
+        if not _captions: return
+        _ctxs = [contextvars.copy_context() for _ in _captions]    # trace attrs of the caller
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(len(_captions), _CAPTION_CONNECTIONS)) as _pool:
+            for _f in [_pool.submit(c.run, _caption, i) for c, i in zip(_ctxs, _captions)]:
+                _f.result()
 
 
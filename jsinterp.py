@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """
 Provide js decipher functions. Supports the logic of splice, swap, reverse sofar.
-then use it to exec it to decipher a string to decrypted signature.
+then compile it into a py callable to decipher a string to decrypted signature.
 """
 
 import re
@@ -10,6 +10,7 @@ from .utils import (
     logger,
     re_search,
 )
+from .tracing import traced
 
 
 # --------------------------
@@ -25,35 +26,72 @@ from .utils import (
 # --------------------------
 
 
-def _split(sig=None):
-    """Split string 'sig' into list. Ex: a=a.split("") => _split(a)"""
-    return sig if not sig else list(sig)
-def _swap0(a=None, b=None):
-    """Swap two elements of list 'a'. Sofar always involve [0]"""
+# Decipher steps are kept as a flat list of opcodes [<op>, <arg>] (json-able so they can be
+# cached per js player id), and compiled once into a Decipher callable that runs them on a
+# single list of chars. <arg> is the int 2nd arg of the js call, or None if not given.
+#   split      a=a.split("")         (a list is made once before the steps)
+#   swap0      a,b: swap a[0] and a[b%len]
+#   reverse    a: a.reverse()
+#   splice0rm  a,b: a.splice(0,b)    (remove 'b' elements from [0])
+#   join       return a.join("")     (the list is joined once after the steps)
+
+def _op_swap0(a, b):
+    """Swap two elements of list 'a' in place. Sofar always involve [0]"""
     # Ex: av.qo(a,23) ==> qo:function(a,b){var c=a[0];a[0]=a[b%a.length];a[b%a.length]=c}
-    if not a or not b: return a
-    else: c = a[0] ; a[0] = a[b%len(a)] ; a[b%len(a)] = c; return a
-def _reverse(a=None, b=None):
-    """Reverse list 'a'. 'b' never used but is taken here as js seems giving more args then needed"""
+    if a and b: b %= len(a) ; a[0], a[b] = a[b], a[0]
+def _op_reverse(a, b):
+    """Reverse list 'a' in place. 'b' never used but is taken here as js seems giving more args then needed"""
     # Ex: av.Ii(a,18) ==> Ii:function(a){a.reverse()}
-    return a if not a else a[::-1]
-def _splice0rm(a=None, b=None):
-    """Remove or add elements of list 'a'. Sofar always remove from [0] of 'b' elements"""
+    a.reverse()
+def _op_splice0rm(a, b):
+    """Remove elements of list 'a' in place. Sofar always remove from [0] of 'b' elements"""
     # Ex: av.m7(a,1)  ==> m7:function(a,b){a.splice(0,b)}
-    return a if not a or not b else a[b:]
-def _join(arr=None):
-    """Join list 'arr' back to string. Ex: return a.join("") => _join(a)"""
-    return arr if not arr else "".join(arr)
+    if b: del a[:b]
+
+_OPCODES = {
+    "split" :       None,           # no-op once compiled
+    "join" :        None,           # no-op once compiled
+    "swap0" :       _op_swap0,
+    "reverse" :     _op_reverse,
+    "splice0rm" :   _op_splice0rm,
+}
+
+
+class Decipher(object):
+    """A decipher program compiled from its opcode list. Call it with a sig, or call
+       decrypt_many() with a list of sigs
+    """
+    __slots__ = ('ops', '_steps')
+
+    def __init__(self, ops=None):
+        self.ops = [list(i) for i in ops or []]
+        self._steps = []
+        for _op, _arg in self.ops:
+            if _op not in _OPCODES:
+                raise ValueError("unknown decipher opcode '%s'" % _op)
+            if _OPCODES[_op]: self._steps.append((_OPCODES[_op], _arg))
+        self._steps = tuple(self._steps)
+
+    def __call__(self, sig=None):
+        if not sig: return sig
+        a = list(sig)
+        for _func, _arg in self._steps: _func(a, _arg)
+        return "".join(a)
+
+    @traced("decrypt_many", attrs=lambda self, sigs=None: {"sigs": len(sigs or [])})
+    def decrypt_many(self, sigs=None):
+        """Decrypt a list of signatures, in order"""
+        return [self(i) for i in sigs or []]
 
 
 def _map_objfunc(objfunc=None, funcname=None):
-    """Map the given js object function code to a py function. Sofar support splice0rm,swap0,reverse"""
+    """Map the given js object function code to an opcode. Sofar support splice0rm,swap0,reverse"""
     if not objfunc or not funcname: return
     _mapping = [
         (r'\b%s:function\((\w+),(\w+)\){var\s+(\w+)=\1\[0\];\1\[0\]=\1(\[\2%%\1\.length\]);\1\4=\3}' % funcname,
-            "_swap0"),
-        (r'\b%s:function\((\w+)\){\1\.reverse\(\)}' % funcname, "_reverse"),
-        (r'\b%s:function\((\w+),(\w+)\){\1\.splice\(0,\2\)}' % funcname, "_splice0rm"),
+            "swap0"),
+        (r'\b%s:function\((\w+)\){\1\.reverse\(\)}' % funcname, "reverse"),
+        (r'\b%s:function\((\w+),(\w+)\){\1\.splice\(0,\2\)}' % funcname, "splice0rm"),
     ]
     for _pattern, _pyfunc in _mapping:
         if re.search(_pattern, objfunc): return _pyfunc
@@ -63,7 +101,7 @@ def _map_objfunc(objfunc=None, funcname=None):
  
 
 def _obj_js(obj=None, jscode=None):
-    """extract a js object, then map its functions into py funcions"""
+    """extract a js object, then map its functions into opcodes"""
     if not obj or not jscode: return None
 
     # extract funcs from the js transform object
@@ -93,8 +131,9 @@ def _obj_js(obj=None, jscode=None):
     return _ret
 
 
+@traced("parse_js")
 def parse_js(patterns, key=None, jscode=None):
-    """find and transfrom js decipher func into logics of py mapped func"""
+    """find and transfrom js decipher func into a list of opcodes (see Decipher)"""
     if not jscode or not key: return None
 
     # get decipher func name matching one of the patterns (key is the matching group idx)
@@ -111,41 +150,41 @@ def parse_js(patterns, key=None, jscode=None):
     args = mobj.group("args")                       # so far, args is a single var
     body = mobj.group("body").split(";")            # split js expressions delimited by ';'
 
-    # transform decipher steps into a list of py mapped func. Supports: split,join,<#>.<func>()
-    # NOTE: readable str is stored in cache. use eval() to convert str to expr when calling
-    _ret = []       # store in order. each step is: "<func>(<args>)". sig is '@S@" in args
+    # transform decipher steps into a list of opcodes. Supports: split,join,<#>.<func>()
+    # NOTE: opcodes are stored in cache as is. compile_decipher() turns them into a callable
+    _ret = []       # store in order. each step is: [<op>, <arg>]
     _done_dct = {}  # dict of transformed object functions (sofar all from the same object)
     for i in range(len(body)):
 
-        # a=a.split("") -> _split(a)
+        # a=a.split("") -> ["split",None]
         _ptrn_split = r'(\w+)=\1\.split\(\s*""\s*\)'
         mobj = re.search(_ptrn_split, body[i])
         if mobj:
-            _temp = "_split(@S@)"
-            logger.debug("transform '%s' -> '%s'", mobj.group(0), _temp)
+            _temp = ["split", None]
+            logger.debug("transform '%s' -> %s", mobj.group(0), _temp)
             _ret += [_temp] ; continue
 
-        # return a.join("") -> _join(a)
+        # return a.join("") -> ["join",None]
         _ptrn_join = r'return\s*(\w+)\.join\(\s*""\s*\)'
         mobj = re.search(_ptrn_join, body[i])
         if mobj:
-            _temp = "_join(@S@)"
-            logger.debug("transform '%s' -> '%s'", mobj.group(0), _temp)
+            _temp = ["join", None]
+            logger.debug("transform '%s' -> %s", mobj.group(0), _temp)
             _ret += [_temp] ; continue
 
-        # obj function: DE.xx(a,b) -> _<*>(@S@,b) with *=_done_dct['DE.xx']
+        # obj function: DE.xx(a,b) -> [<*>,b] with *=_done_dct['DE.xx']
         _ptrn_objfunc = r'(\w+)\.(\w+)\s*\(\s*(\S*?)\s*\)'  # sofar 2nd arg is \d+ if any
         mobj = re.search(_ptrn_objfunc, body[i])
         if mobj:
             _js_func = mobj.group(1)+"."+mobj.group(2)
             _js_args = mobj.group(3).split(",")     # sofar 1st arg is always the sig
-            _js_args[0] = "@S@"                     # and 2nd arg is always \d+ if any
+            _js_arg = int(_js_args[1]) if len(_js_args) > 1 and _js_args[1].isdigit() else None
             if _js_func not in _done_dct:
                 # extract obj, map all its' funcs to py func, and add them into _done_dct
                 _done_dct.update(_obj_js(obj=mobj.group(1), jscode=jscode))
                 if _js_func not in _done_dct: continue  # error case. not mapped. skip
-            _temp = "%s(%s)" % (_done_dct[_js_func], ",".join(_js_args))
-            logger.debug("transform '%s' -> '%s'", mobj.group(0), _temp)
+            _temp = [_done_dct[_js_func], _js_arg]
+            logger.debug("transform '%s' -> %s", mobj.group(0), _temp)
             _ret += [_temp] ; continue
 
         # error on fall-through logic (unsupported yet)
@@ -153,14 +192,22 @@ def parse_js(patterns, key=None, jscode=None):
     return _ret
 
 
+def compile_decipher(ops=None):
+    """Compile a list of opcodes from parse_js() into a Decipher callable"""
+    if not ops: return None
+    return Decipher(ops)
+
+
+@traced("decrypt_sig")
 def decrypt_sig(sig=None, decipher=None):
-    """Decrpt a encrypted signature with given list of transformas"""
+    """Decrpt a encrypted signature with given Decipher or list of opcodes"""
     if not sig or not decipher: return sig
-
-    # readable str is stored in decipher cache, and eval() to turn it into py expr
-    for expr in decipher:
-        expr = expr.replace("@S@","sig")   # @S@ must be replaced with the sig variable name below
-        sig = eval(expr)
-    return sig
+    if not isinstance(decipher, Decipher): decipher = Decipher(decipher)
+    return decipher(sig)
 
 
+def decrypt_many(sigs=None, decipher=None):
+    """Decrpt a list of encrypted signatures with given Decipher or list of opcodes"""
+    if not sigs or not decipher: return list(sigs or [])
+    if not isinstance(decipher, Decipher): decipher = Decipher(decipher)
+    return decipher.decrypt_many(sigs)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Tracing spans of the program phases (fetch, extract, js, http, streams, captions), saved
+into a trace file in Chrome trace-event json (chrome://tracing, Perfetto) or json-lines.
+Off by default, then span() returns a shared no-op and traced funcs run as they are.
+"""
+
+import os
+import json
+import time
+import atexit
+import socket
+import functools
+import threading
+import contextvars
+
+
+_tracer = None                  # active Tracer (None=tracing off)
+_INHERIT = ("vidu_id", "itag")  # attributes passed down to nested spans
+_ctx_attrs = contextvars.ContextVar("trace_attrs", default={})
+
+
+class _NoSpan(object):
+    """Span when tracing is off. Does nothing"""
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *args): return False
+    def set(self, **attrs): pass
+
+_NOSPAN = _NoSpan()
+
+
+class Span(object):
+    """Timed phase of the program with attributes. Use it as a context manager. vidu_id and
+       itag of the enclosing span (same thread, or copied context) are added to its attributes
+    """
+    __slots__ = ('name', 'attrs', 'begin', '_token')
+
+    def __init__(self, name=None, attrs=None):
+        self.name = name
+        self.attrs = attrs or {}
+
+    def __enter__(self):
+        _parent = _ctx_attrs.get()
+        for k in _INHERIT:
+            if k in _parent and k not in self.attrs: self.attrs[k] = _parent[k]
+        self._token = _ctx_attrs.set({k: self.attrs[k] for k in _INHERIT if k in self.attrs})
+        self.begin = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _end = time.time()
+        _ctx_attrs.reset(self._token)
+        if exc_type is not None: self.attrs['error'] = "%s: %s" % (exc_type.__name__, exc)
+        _t = _tracer
+        if _t is not None: _t.emit(self.name, self.begin, _end, self.attrs)
+        return False
+
+    def set(self, **attrs):
+        """Add attributes (ex. results) to the span"""
+        self.attrs.update(attrs)
+
+
+class Tracer(object):
+    """Collect spans into fn: "chrome" format keeps them to write a trace-event json at
+       close(), "jsonl" writes a json line per span as it ends
+    """
+    def __init__(self, fn=None, fmt="chrome"):
+        if fmt not in ("chrome", "jsonl"): raise ValueError("unknown trace format '%s'" % fmt)
+        self.fn = fn
+        self.fmt = fmt
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.t0 = time.time()
+        self.threads = {}           # tid -> thread name
+        self.events = []
+        self.fp = open(fn, "w", encoding="utf-8") if fmt == "jsonl" else None
+
+    def emit(self, name=None, begin=0.0, end=0.0, attrs=None):
+        _tid = threading.get_ident()
+        if self.fmt == "jsonl":
+            _line = json.dumps({"name": name, "start": round(begin, 6), "dur": round(end-begin, 6),
+                                "thread": threading.current_thread().name, "attrs": attrs or {}},
+                               default=str)
+            with self.lock: self.fp.write(_line + "\n")
+            return
+        _event = {"name": name, "cat": name.partition(".")[0], "ph": "X", "pid": self.pid,
+                  "tid": _tid, "ts": round((begin-self.t0)*1e6, 1),
+                  "dur": round((end-begin)*1e6, 1), "args": attrs or {}}
+        with self.lock:
+            if _tid not in self.threads: self.threads[_tid] = threading.current_thread().name
+            self.events.append(_event)
+
+    def close(self):
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close() ; self.fp = None
+                return
+            _meta = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": k,
+                      "args": {"name": v}} for k,v in self.threads.items()]
+            with open(self.fn, "w", encoding="utf-8") as fp:
+                json.dump({"traceEvents": _meta + self.events, "displayTimeUnit": "ms"}, fp,
+                          default=str)
+
+
+def set_trace(fn=None, fmt=None):
+    """Trace spans into file fn (format "chrome", or "jsonl" which is default for *.jsonl).
+       None to stop tracing and save the file
+    """
+    global _tracer
+    _old, _tracer = _tracer, None
+    if _old is not None: _old.close()
+    if fn:
+        _tracer = Tracer(fn, fmt or ("jsonl" if fn.endswith(".jsonl") else "chrome"))
+
+atexit.register(set_trace)
+
+
+def tracing():
+    """Return True if tracing is on"""
+    return _tracer is not None
+
+
+def span(name=None, **attrs):
+    """Return a Span of name with attrs to use in 'with', or a no-op if tracing is off"""
+    if _tracer is None: return _NOSPAN
+    return Span(name, attrs)
+
+
+def traced(name=None, attrs=None):
+    """Decorator running func in a span of name (default func name). attrs, if given, is
+       called with the args of func to give the span attributes
+    """
+    def _decorator(func):
+        _name = name or func.__name__
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            if _tracer is None: return func(*args, **kwargs)
+            with Span(_name, attrs(*args, **kwargs) if attrs else {}):
+                return func(*args, **kwargs)
+        return _wrapper
+    return _decorator
+
+
+def create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """socket.create_connection() in spans of its name lookup (http.dns) and tcp connect
+       (http.tcp). Set as _create_connection of http.client connections when tracing
+    """
+    _host, _port = address[:2]
+    with span("http.dns", host=_host):
+        _infos = socket.getaddrinfo(_host, _port, 0, socket.SOCK_STREAM)
+    _err = OSError("getaddrinfo returns an empty list")
+    for _info in _infos:
+        try:
+            with span("http.tcp", addr=_info[4][0]):
+                return socket.create_connection(_info[4][:2], timeout, source_address)
+        except OSError as e:
+            _err = e
+    raise _err
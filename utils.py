@@ -12,9 +12,33 @@ import urllib.parse as parse        # urlencode,etc for parsing url
 from urllib.error import HTTPError
 import json
 import codecs
-import math
 import time
 import os
+import contextlib
+import queue
+import atexit
+import threading
+import concurrent.futures
+import asyncio
+import functools
+import contextvars
+import http.client
+import ssl
+import select
+import io
+import collections
+import email.parser
+from .tracing import (
+    span,
+    traced,
+    tracing,
+    create_connection as _traced_create_connection,
+)
+try:
+    import fcntl                    # posix file lock
+except ImportError:
+    fcntl = None
+    import msvcrt                   # windows file lock
 
 # --------------------------
 # Set up program's logger
@@ -48,18 +72,78 @@ def get_logginglevel():
 # file processing: log,cache
 # --------------------------
 
+# debug capture of responses (log_rsp) is compressed and written by a background thread.
+# policy when its queue is full: "block" the caller, or "drop" the capture
+_log_rsp_cfg = {"compresslevel": 6, "queue_size": 32, "policy": "block"}
+_log_rsp_queue = None           # created with its writer thread on first use
+_log_rsp_lock = threading.Lock()
+log_rsp_stats = {"queued": 0, "written": 0, "dropped": 0}
+
+
+def set_log_rsp(compresslevel=None, queue_size=None, policy=None):
+    """Set compress level (0~9), queue size and full-queue policy ("block"|"drop") of log_rsp"""
+    if compresslevel is not None: _log_rsp_cfg['compresslevel'] = compresslevel
+    if queue_size is not None:    _log_rsp_cfg['queue_size'] = queue_size
+    if policy is not None:
+        if policy not in ("block", "drop"): raise ValueError("unknown policy '%s'" % policy)
+        _log_rsp_cfg['policy'] = policy
+
+
+def _log_rsp_writer(q):
+    """Background writer: gzip each queued (fn, data, jsdict) to file, part by part"""
+    while True:
+        fn, data, jsdict = q.get()
+        try:
+            # compresslevel 0~9. default:9(most&slowest); 0=no-compress.
+            with gzip.open(fn, mode="wb", compresslevel=_log_rsp_cfg['compresslevel']) as gz, \
+                 io.TextIOWrapper(gz, encoding='utf-8', errors='replace') as fp:
+                if jsdict:
+                    _parts = json.JSONEncoder(sort_keys=True, indent=2).iterencode(data)
+                else:
+                    _parts = data if isinstance(data, (list, tuple)) else [data]
+                for _part in _parts:
+                    if isinstance(_part, bytes): fp.flush() ; gz.write(_part)
+                    else: fp.write(_part)
+            log_rsp_stats['written'] += 1
+            logger.debug("Saved response to %s", fn)
+        except Exception as e:
+            logger.warning("Failed to save response to %s: %s", fn, e)
+        finally:
+            q.task_done()
+
+
 def log_rsp(fn=None, data=None, jsdict=False):
-    """Log response or json dict to file or gzip if logging_html is on"""
+    """Log response or json dict to gzip file if logging_html is on. data can be bytes, str
+       or a list of them (written in turn). Compressing and writing are done in background
+    """
+    global _log_rsp_queue
     if not (fn and data and logging_html): return
-    if jsdict: data=json.dumps(data, sort_keys=True, indent=2).encode('utf-8')
-    # compresslevel 0~9. default:9(most&slowest); 0=no-compress. 
-    with gzip.open(fn, mode="wb", compresslevel=8) as fp:
-        fp.write(data)
-    logger.debug("Saved response to %s", fn)
+    with _log_rsp_lock:
+        if _log_rsp_queue is None:
+            _log_rsp_queue = queue.Queue(maxsize=_log_rsp_cfg['queue_size'])
+            threading.Thread(target=_log_rsp_writer, args=(_log_rsp_queue,),
+                             name="log_rsp", daemon=True).start()
+    if _log_rsp_cfg['policy'] == "drop":
+        try:
+            _log_rsp_queue.put_nowait((fn, data, jsdict))
+        except queue.Full:
+            log_rsp_stats['dropped'] += 1
+            logger.warning("Dropped response capture %s (queue full)", fn)
+            return
+    else:
+        _log_rsp_queue.put((fn, data, jsdict))
+    log_rsp_stats['queued'] += 1
+
+
+def flush_log_rsp():
+    """Wait for all queued response captures to be written"""
+    if _log_rsp_queue is not None: _log_rsp_queue.join()
+
+atexit.register(flush_log_rsp)
 
 
 def read_log(fn=None):
-    """(DEBUG ONLY) Read response from a (gzip) file assuming utf-8"""
+    """Read response from a (gzip) file assuming utf-8 (debug, and replay of captures)"""
     if not fn: return
     with open(fn, "rb") as fp:  data = fp.read()
     # check and decompress if gzip by checking gzip header, or try anyway
@@ -71,22 +155,148 @@ def read_log(fn=None):
     return data.decode('utf-8')
 
 
-def save_dct(fn=None, dct=None):
-    """Save a dct to file"""
-    if not fn: return
-    # ??? to implement...
+def cache_path(fn=None):
+    """Return path of fn under the program's cache dir (dirs created if missing).
+       Dir is $YTB_EXT_CACHE_DIR, or $XDG_CACHE_HOME/ytb_ext, or ~/.cache/ytb_ext
+    """
+    _dir = os.environ.get('YTB_EXT_CACHE_DIR')
+    if not _dir:
+        _dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                            os.path.join(os.path.expanduser("~"), ".cache"), "ytb_ext")
+    _path = os.path.join(_dir, fn) if fn else _dir
+    os.makedirs(os.path.dirname(_path) if fn else _dir, exist_ok=True)
+    return _path
+
+
+@contextlib.contextmanager
+def file_lock(fn=None):
+    """Hold an exclusive inter-process lock on 'fn.lock' (flock, or msvcrt on Windows)"""
+    with open(fn+".lock", "a+b") as fp:
+        if fcntl:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        else:
+            fp.seek(0,0)
+            while True:     # LK_LOCK gives up after 10 tries (~10s). keep trying
+                try:    msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1); break
+                except OSError: continue
+        try:
+            yield fp
+        finally:
+            if fcntl: fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+            else:     fp.seek(0,0); msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_write(fn=None, data=b"", sync=True):
+    """Write data to a temp file in the same dir then rename over fn, so that
+       readers never see a half-written file. sync=False skips fsync (cheap, but only
+       safe against a crash of the process, not of the system)
+    """
+    _tmp = "%s.%d.%d.tmp" % (fn, os.getpid(), threading.get_ident())
+    with open(_tmp, "wb") as fp:
+        fp.write(data)
+        fp.flush()
+        if sync: os.fsync(fp.fileno())
+    os.replace(_tmp, fn)        # atomic on both posix and windows (py3.3+)
+
+
+_DCT_MAX_ENTRIES = 16           # default number of keys kept in a dct file (LRU)
+
+
+def _load_dct(fn=None, version=0):
+    """Load raw {key: {"atime":<epoch>, "data":<val>}} entries of a dct file"""
+    try:
+        with open(fn, "rb") as fp: _raw = json.loads(fp.read().decode('utf-8'))
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Ignored unreadable cache %s: %s", fn, e)
+        return {}
+    if not isinstance(_raw, dict) or _raw.get('version') != version:
+        logger.info("Ignored cache %s of schema version %s (want %s)",
+                    fn, _raw.get('version') if isinstance(_raw, dict) else None, version)
+        return {}
+    return _raw.get('entries', {})
+
+
+def save_dct(fn=None, dct=None, version=0, max_entries=_DCT_MAX_ENTRIES):
+    """Merge the keys of dct into the versioned json file fn, stamping them as most
+       recently used and evicting the least recently used keys beyond max_entries.
+       Safe for concurrent processes (file lock + atomic replace).
+    """
+    if not fn or not dct: return
+    _now = time.time()
+    with file_lock(fn):
+        _entries = _load_dct(fn, version)
+        for k,v in dct.items():
+            _entries[k] = {"atime": _now, "data": v}
+        if max_entries and len(_entries) > max_entries:
+            _keep = sorted(_entries, key=lambda k: _entries[k]['atime'], reverse=True)
+            _entries = {k: _entries[k] for k in _keep[:max_entries]}
+        _data = json.dumps({"version": version, "entries": _entries}, sort_keys=True)
+        atomic_write(fn, _data.encode('utf-8'))
     logger.info("Saved data into %s", fn)
 
 
-def read_dct(fn=None):
-    """Save a dct to file"""
+def read_dct(fn=None, version=0):
+    """Read the versioned json file fn into a dict. Empty if missing or stale schema"""
     if not fn: return
-    _dct = {}
-    # ??? to implement...
+    _dct = {k: v['data'] for k,v in _load_dct(fn, version).items()}
     logger.info("Read %s into dictionay", fn)
     return _dct
 
 
+class DownloadArchive(object):
+    """Append-only log of completed downloads, a line "<extractor> <vidu_id> <itag>" per
+       stream, indexed in memory by (extractor, vidu_id) to tell done videos with no I/O
+    """
+    def __init__(self, fn=None):
+        self.fn = fn
+        self.lock = threading.Lock()
+        self.index = {}             # (extractor, vidu_id) -> set of itags (str)
+        try:
+            with open(fn, encoding="utf-8") as fp:
+                for _line in fp:
+                    _fields = _line.split()
+                    if len(_fields) == 3:   # skip a line cut short by a crash
+                        self.index.setdefault((_fields[0], _fields[1]), set()).add(_fields[2])
+        except FileNotFoundError:
+            pass
+        logger.info("Download archive %s: %d videos", fn, len(self.index))
+
+    def has(self, extractor=None, vidu_id=None, itags=None):
+        """Return True if vidu_id was downloaded: all of itags if given, or else any"""
+        _done = self.index.get((extractor, vidu_id))
+        if not _done: return False
+        return not itags or all(str(i) in _done for i in itags)
+
+    def add(self, extractor=None, vidu_id=None, itags=None):
+        """Record the downloaded itags of vidu_id (appended to the log at once), but the ones
+           recorded already
+        """
+        with self.lock:
+            _done = self.index.setdefault((extractor, vidu_id), set())
+            _new = [str(i) for i in itags or [] if str(i) not in _done]
+            if not _new: return
+            with file_lock(self.fn), open(self.fn, "a", encoding="utf-8") as fp:
+                fp.write("".join("%s %s %s\n" % (extractor, vidu_id, i) for i in _new))
+            _done.update(_new)
+
+
+_archive = {"obj": None}        # DownloadArchive in use (None=no archive)
+
+
+def set_archive(fn=None):
+    """Skip videos recorded in the download archive fn, and record the ones downloaded.
+       None to turn it off
+    """
+    _archive['obj'] = DownloadArchive(fn) if fn else None
+
+
+def download_archive():
+    """Return the DownloadArchive in use, or None"""
+    return _archive['obj']
+
+
 # --------------------------
 # HTTP request/response handling
 # --------------------------
@@ -138,18 +348,245 @@ std_http_headers = {
 }
 
 
-def http_get(url=None, headers=std_http_headers, qs=None, fn=None, method=None):
-    """Send HTTP get or method(ex.HEAD), then decode response using its encoding charset.
-       Logging the response and header/info into fn if logging level allows. 
+class _PooledResponse(object):
+    """Response of HTTPPool. Acts like urlopen's, and gives its connection back to the
+       pool once the body is fully read (or discards it if closed before that)
+    """
+    def __init__(self, pool=None, key=None, conn=None, rsp=None, url=None, method=None):
+        self._pool = pool ; self._key = key ; self._conn = conn ; self._rsp = rsp
+        self.url = url
+        self.status = rsp.status
+        self.reason = rsp.reason
+        self.headers = rsp.msg
+        if method == "HEAD" or rsp.status in (204, 304): rsp.read()     # no body
+        self._check_done()
+
+    code = property(lambda self: self.status)
+
+    def _check_done(self):
+        if self._conn is not None and self._rsp.isclosed():
+            self._pool._put(self._key, self._conn)
+            self._conn = None
+
+    def read(self, amt=None):
+        data = self._rsp.read(amt)
+        self._check_done()
+        return data
+
+    def readinto(self, b):
+        n = self._rsp.readinto(b)
+        self._check_done()
+        return n
+
+    def getheader(self, name, default=None): return self._rsp.getheader(name, default)
+    def getheaders(self): return self._rsp.getheaders()
+    def info(self):       return self.headers
+    def geturl(self):     return self.url
+    def getcode(self):    return self.status
+
+    def close(self):
+        if self._conn is not None:          # body not fully read. can't reuse the conn
+            self._conn.close()
+            self._conn = None
+        self._rsp.close()
+
+    def __enter__(self): return self
+    def __exit__(self, *args): self.close()
+
+
+class HTTPPool(object):
+    """Pool of persistent (keep-alive) HTTP/1.1 connections per scheme://host:port, shared
+       by http_get, http_stream and their callers. Keeps upto max_idle idle connections per
+       host (max_total overall) and drops those idle for longer than idle_timeout secs.
+       Falls back to urlopen when a proxy is set for the scheme.
+    """
+    _REDIRECTS = (301, 302, 303, 307, 308)
+
+    def __init__(self, max_idle=8, max_total=32, idle_timeout=30.0, timeout=120):
+        self.max_idle = max_idle
+        self.max_total = max_total
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.proxies = request.getproxies()
+        self.lock = threading.Lock()
+        self.idle = {}              # key -> list of (conn, last use epoch)
+        self.stats = {"new": 0, "reused": 0}
+
+    def _new(self, key):
+        _scheme, _host, _port = key
+        self.stats['new'] += 1
+        if _scheme == "https":
+            return http.client.HTTPSConnection(_host, _port, timeout=self.timeout,
+                                               context=ssl.create_default_context())
+        return http.client.HTTPConnection(_host, _port, timeout=self.timeout)
+
+    def _get(self, key):
+        """Return (conn, reused) of an idle conn of key still alive, or a new one"""
+        _now = time.time()
+        with self.lock:
+            _conns = self.idle.get(key, [])
+            while _conns:
+                conn, _used = _conns.pop()      # most recently used first
+                if _now - _used > self.idle_timeout or not self._alive(conn):
+                    conn.close() ; continue
+                self.stats['reused'] += 1
+                return conn, True
+        return self._new(key), False
+
+    @staticmethod
+    def _alive(conn):
+        """An idle conn is dead if its socket is gone or readable (EOF or junk from server)"""
+        if conn.sock is None: return False
+        try:
+            return not select.select([conn.sock], [], [], 0)[0]
+        except (OSError, ValueError):
+            return False
+
+    def _put(self, key, conn):
+        if conn.sock is None: return            # server asked to close it
+        _now = time.time()
+        with self.lock:
+            # evict idle-expired ones, then keep within per-host and total bounds
+            for _k in list(self.idle):
+                _keep = [(c,t) for c,t in self.idle[_k] if _now - t <= self.idle_timeout]
+                for c,t in self.idle[_k]:
+                    if _now - t > self.idle_timeout: c.close()
+                self.idle[_k] = _keep
+            _conns = self.idle.setdefault(key, [])
+            if len(_conns) >= self.max_idle or \
+               sum(len(i) for i in self.idle.values()) >= self.max_total:
+                conn.close() ; return
+            _conns.append((conn, _now))
+
+    def close(self):
+        """Close all idle connections"""
+        with self.lock:
+            for _conns in self.idle.values():
+                for conn, _ in _conns: conn.close()
+            self.idle = {}
+
+    def request(self, url=None, headers=None, method=None, data=None, timeout=None):
+        """Send a request and return its response (after redirects). Raise HTTPError
+           for HTTP status >= 400 as urlopen does
+        """
+        method = method or ("POST" if data is not None else "GET")
+        for _ in range(10):                     # upto 10 redirects
+            _parts = parse.urlsplit(url)
+            _scheme = _parts.scheme.lower()
+            if _scheme in self.proxies or _scheme not in ("http", "https"):
+                req = request.Request(url, headers=headers or {}, method=method, data=data)
+                return request.urlopen(req, timeout=timeout or self.timeout)
+            key = (_scheme, _parts.hostname, _parts.port or (443 if _scheme == "https" else 80))
+            _path = parse.urlunsplit(("", "", _parts.path or "/", _parts.query, ""))
+            for _try in range(2):               # a reused conn may be closed by server
+                conn, _reused = self._get(key) if _try == 0 else (self._new(key), False)
+                if timeout:
+                    conn.timeout = timeout
+                    if conn.sock: conn.sock.settimeout(timeout)
+                try:
+                    if conn.sock is None and tracing():     # split dns/tcp/tls from ttfb
+                        conn._create_connection = _traced_create_connection
+                        with span("http.connect", host=key[1], port=key[2]): conn.connect()
+                    with span("http.ttfb", method=method, host=key[1], reused=_reused):
+                        conn.request(method, _path, body=data, headers=headers or {})
+                        rsp = conn.getresponse()
+                    break
+                except (http.client.RemoteDisconnected, ConnectionError, BrokenPipeError) as e:
+                    conn.close()
+                    if not _reused: raise
+                    logger.debug("Retry on a new connection to %s: %s", key[1], e)
+            rsp = _PooledResponse(self, key, conn, rsp, url, method)
+            if rsp.status in self._REDIRECTS and rsp.getheader('Location'):
+                rsp.read() ; rsp.close()
+                url = parse.urljoin(url, rsp.getheader('Location'))
+                if rsp.status == 303 and method != "HEAD": method = "GET" ; data = None
+                continue
+            if rsp.status >= 400:
+                _body = rsp.read() ; rsp.close()
+                raise HTTPError(url, rsp.status, rsp.reason, rsp.headers, io.BytesIO(_body))
+            return rsp
+        raise HTTPError(url, rsp.status, "too many redirects", rsp.headers, None)
+
+
+http_pool = HTTPPool()          # shared by all requests of the program
+
+
+def http_open(url=None, headers=std_http_headers, method=None, data=None, timeout=120):
+    """Open url via the shared keep-alive pool. Return response obj or raise HTTPError"""
+    return http_pool.request(url, headers=headers, method=method, data=data, timeout=timeout)
+
+
+# captures of http_get (log_rsp with -vvvv) replayed in place of the network, by their fn
+_replay = {"dir": None}
+
+
+def set_replay(dirname=None):
+    """Serve http_get from the captures in dirname (as saved by logging html) instead of the
+       network, picked by the capture fn given to http_get. None to turn it off
+    """
+    _replay['dir'] = dirname
+    if dirname: logger.info("Replaying http responses from %s", dirname)
+
+
+class _ReplayResponse(object):
+    """Response read back from a capture of http_get, which is:
+       <url>\nretcode:<status>\n======\n<headers>\n======\n<body>
+    """
+    def __init__(self, text=""):
+        self.url, _, _rest = text.partition("\nretcode:")
+        _status, _, _rest = _rest.partition("\n======\n")
+        _hdrs, _, self.body = _rest.partition("\n======\n")
+        self.status = int(_status.strip() or 200)
+        self.reason = ""
+        self.headers = email.parser.Parser(_class=http.client.HTTPMessage).parsestr(_hdrs)
+
+    code = property(lambda self: self.status)
+
+    def getheader(self, name, default=None): return self.headers.get(name, default)
+    def getheaders(self): return list(self.headers.items())
+    def info(self):       return self.headers
+    def geturl(self):     return self.url
+    def getcode(self):    return self.status
+    def read(self, amt=None): return b""        # body is given decoded by http_get
+    def close(self): pass
+    def __enter__(self): return self
+    def __exit__(self, *args): pass
+
+
+def _replay_get(url=None, fn=None, method=None):
+    """http_get from the capture fn in the replay dir. HTTPError 404 if not captured"""
+    _fn = os.path.join(_replay['dir'], fn) if fn else None
+    if not _fn or not os.path.isfile(_fn):
+        logger.warning("No capture %s to replay %s %s", fn, method or "GET", url)
+        return (HTTPError(url, 404, "Not in replay captures", None, None), "", "utf-8")
+    rsp = _ReplayResponse(read_log(_fn))
+    if rsp.status >= 400:
+        return (HTTPError(url, rsp.status, "Replayed error", rsp.headers, None), "", "utf-8")
+    if method == "HEAD": return ("", rsp, "")
+    return (rsp.body, rsp, "utf-8")
+
+
+def _trace_http(url=None, headers=None, qs=None, fn=None, method=None, *args, **kwargs):
+    """Span attributes of an http request (url without query, not to log signatures)"""
+    return {"method": method or "GET", "url": (url or "").partition("?")[0], "fn": fn}
+
+
+@traced("http_get", attrs=_trace_http)
+def http_get(url=None, headers=std_http_headers, qs=None, fn=None, method=None, data=None):
+    """Send HTTP get or method(ex.HEAD), or POST data (bytes) if given, then decode response
+       using its encoding charset.
+       Logging the response and header/info into fn if logging level allows, or, if replay
+       is set (set_replay), get them back from fn instead.
        Return tuple of (content, response obj, charset).
     """
     if qs is not None:
         # adding more querys onto url
         url += parse.urlencode(qs)
+    if data is not None and not method: method = "POST"
+    if _replay['dir']: return _replay_get(url, fn, method)
 
-    req = request.Request(url, headers=headers, method=method)
-    # urlopen always returns an obj (http.client.HTTPResonse if http/s) as a context
-    # manager that supports:
+    # http_open always returns an obj (_PooledResponse, or urlopen's http.client.HTTPResonse)
+    # as a context manager that supports:
     #  - geturl()   retrieved url (can determine if a redirect was followed)
     #  - info()     meta of the page such as headers (ref: http://jkorpela.fi/http.html)
     #  - getcode()|status  HTTP status code of the response
@@ -157,7 +594,7 @@ def http_get(url=None, headers=std_http_headers, qs=None, fn=None, method=None):
     #  - getheaders()   list of tuple (header,value)
     # add 120s timer (default is forever) that works for http/s,ftp
     try:
-        rsp = request.urlopen(req, timeout=120)
+        rsp = http_open(url, headers=headers, method=method, data=data, timeout=120)
     except HTTPError as e:
         #ex: urllib.error.HTTPError: HTTP Error 403: Forbidden, 404: Not Found
         return (e, "", "utf-8")
@@ -169,20 +606,45 @@ def http_get(url=None, headers=std_http_headers, qs=None, fn=None, method=None):
         # and catch "except OSError" in case "Not a gzipped file".
         # alternative: py3.5+: data[:3].hex()=='1f8b08' (GZIP_MAGIC_NUMBER="1f8b08")
         # or py2/py3: base64.b16encode(data[:3]).decode("ascii").lower() to check gzip
-        data = rsp.read()
-        if rsp.getheader('Content-Encoding', "") == "gzip":
-            data = gzip.decompress(data)
+        with span("http.body"):
+            data = rsp.read()
+            if rsp.getheader('Content-Encoding', "") == "gzip":
+                data = gzip.decompress(data)
 
-        # get or choose best encoding of the http response
-        charset = http_charset(rsp.getheader('Content-Type', default=""), data[:1024])
-        data = data.decode(charset)
+            # get or choose best encoding of the http response
+            charset = http_charset(rsp.getheader('Content-Type', default=""), data[:1024])
+            data = data.decode(charset)
 
-        # logging the response and header/info
-        log_rsp(fn, (rsp.geturl()+"\nretcode:"+str(rsp.status)+"\n======\n"+
-                     str(rsp.info())+"\n======\n"+data).encode('utf-8'))
+        # logging the response and header/info (as parts, not to build one big string)
+        if logging_html:
+            log_rsp(fn, [rsp.geturl(), "\nretcode:", str(rsp.status), "\n======\n",
+                         str(rsp.info()), "\n======\n", data])
         return (data, rsp, charset) # return tuple: response body, obj, charset
 
 
+# executor for run_blocking() of the current asyncio context (None=loop's default)
+async_executor = contextvars.ContextVar("async_executor", default=None)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking func(*args,**kwargs) in the context's executor and await it.
+       The transport (HTTPPool, range workers) is blocking: each call awaited holds a
+       thread of the executor until done, so awaits at once are bounded by its threads
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(async_executor.get(),
+                                      functools.partial(func, *args, **kwargs))
+
+
+async def http_get_async(url=None, headers=std_http_headers, qs=None, fn=None, method=None,
+                         data=None):
+    """asyncio counterpart of http_get. Its blocking pooled transport takes a thread of the
+       context's executor while awaited (see run_blocking)
+    """
+    return await run_blocking(http_get, url=url, headers=headers, qs=qs, fn=fn, method=method,
+                              data=data)
+
+
 def http_charset(rsptype=None, rsp1024=None):
     """Get or guess best encoding of an HTTP response"""
     # either in rsp header, (optional next check <script src=... charset=),
@@ -200,13 +662,160 @@ def http_charset(rsptype=None, rsp1024=None):
     return charset
 
 
+class Transfer(object):
+    """Progress state of one stream transfer. Each writer (a range worker) counts its bytes
+       in its own slot of 'parts', so the hot path takes no lock; readers sum them up.
+    """
+    __slots__ = ('fn', 'tot_bytes', 'begin', 'parts', 'dl_bar', 'done', 'error',
+                 'rate', '_last', '_lock')
+
+    def __init__(self, fn=None, tot_bytes=0, dl_bar=None):
+        self.fn = fn
+        self.tot_bytes = tot_bytes
+        self.begin = time.time()
+        self.parts = []
+        self.dl_bar = dl_bar        # old-style callback dl_bar(cur_bytes, tot_bytes, begin)
+        self.done = False
+        self.error = None
+        self.rate = 0.0             # bytes/sec (ewma of samples)
+        self._last = (self.begin, 0)
+        self._lock = threading.Lock()   # for slot() only: writers start at once
+
+    def slot(self, n=0):
+        """Add a counter (starting at n bytes) for a writer. Return its index in parts"""
+        with self._lock:
+            self.parts.append(n)
+            return len(self.parts) - 1
+
+    @property
+    def cur_bytes(self): return sum(self.parts)
+
+    def snapshot(self, now=None):
+        _cur = self.cur_bytes
+        _eta = (self.tot_bytes - _cur) / self.rate if self.rate and not self.done else None
+        return {"fn": self.fn, "cur_bytes": _cur, "tot_bytes": self.tot_bytes,
+                "begin": self.begin, "elapsed": (now or time.time()) - self.begin,
+                "rate": self.rate, "eta": _eta, "done": self.done, "error": self.error}
+
+
+class ProgressMonitor(object):
+    """Sample the progress of all active transfers every 'interval' secs on its own thread,
+       and hand each sample (list of Transfer.snapshot(), finished ones included once) to
+       the callbacks added, and to the events() iterators. A transfer's own dl_bar is called
+       at the same pace, and once more when it finishes. Writers of transfers only bump
+       their counters (see Transfer), so progress output costs nothing on the hot path.
+    """
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.lock = threading.RLock()
+        self.active = []
+        self.callbacks = []
+        self.queues = []            # of events() iterators
+        self.thread = None
+
+    def add(self, fn=None, tot_bytes=0, dl_bar=None):
+        """Register a new transfer. Return its Transfer obj for the writers to count into"""
+        xfer = Transfer(fn, tot_bytes, dl_bar)
+        with self.lock:
+            self.active.append(xfer)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._sampler, name="progress",
+                                               daemon=True)
+                self.thread.start()
+        return xfer
+
+    def finish(self, xfer=None, error=None):
+        """Mark xfer done (with error if any), and report it right away"""
+        xfer.done = True
+        xfer.error = error or None
+        self.sample()
+
+    def add_callback(self, callback=None):
+        """Call callback(<list of snapshot>) per sample (on the sampler thread)"""
+        with self.lock: self.callbacks.append(callback)
+
+    def remove_callback(self, callback=None):
+        with self.lock:
+            if callback in self.callbacks: self.callbacks.remove(callback)
+
+    def events(self, until_idle=True):
+        """Iterate over samples (the latest one if the consumer falls behind). Stop once no
+           transfer is active after some have been, if until_idle
+        """
+        _q = queue.Queue(maxsize=1)
+        with self.lock: self.queues.append(_q)
+        try:
+            while True:
+                _snap = _q.get()
+                yield _snap
+                if until_idle and all(i['done'] for i in _snap): return
+        finally:
+            with self.lock: self.queues.remove(_q)
+
+    def sample(self):
+        """Take a sample of the transfers now and report it. Callbacks (and dl_bar) are
+           called out of the lock, and one failing is logged, not raised to the caller (a
+           writer finishing, or the sampler)
+        """
+        _now = time.time()
+        _calls = []
+        with self.lock:
+            _xfers = list(self.active)
+            self.active = [i for i in self.active if not i.done]
+            _snap = []
+            for xfer in _xfers:
+                _t, _b = xfer._last
+                _cur = xfer.cur_bytes
+                if _now - _t > 0.01:
+                    _rate = (_cur - _b) / (_now - _t)
+                    xfer.rate = _rate if not xfer.rate else xfer.rate + 0.3*(_rate - xfer.rate)
+                    xfer._last = (_now, _cur)
+                _snap.append(xfer.snapshot(_now))
+                if xfer.dl_bar: _calls.append((xfer.dl_bar, (_cur, xfer.tot_bytes, xfer.begin)))
+            if not _snap: return
+            _calls += [(_cb, (_snap,)) for _cb in self.callbacks]
+            for _q in self.queues:
+                try: _q.get_nowait()    # replace the sample not taken yet
+                except queue.Empty: pass
+                _q.put_nowait(_snap)
+        for _cb, _args in _calls:
+            try:
+                _cb(*_args)
+            except Exception as e:      # a bad callback shall not fail a transfer
+                logger.error("progress callback failed: %s", e)
+
+    def _sampler(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:     # idle. next add() starts a new one
+                    self.thread = None
+                    return
+            self.sample()
+
+
+progress = ProgressMonitor()    # shared by all transfers of the program
+
+
+@traced("http_stream", attrs=lambda url=None, headers=None, qs=None, fn=None, tot_bytes=None,
+        *args, **kwargs: {"fn": fn, "bytes": tot_bytes})
 def http_stream(url=None, headers=std_http_headers, qs=None, fn=None,
-                tot_bytes=None, dl_bar=None, http_chunk_size=None, block_size=1*1024):
+                tot_bytes=None, dl_bar=None, http_chunk_size=None, block_size=1*1024,
+                connections=1, retries=3, last_modify=None, rate_limit=None, chunk_max=None):
     """Send HTTP get and streaming large data into blocks. Return no-empty if not ok.
-       Call back dl_bar if any to show progress status.
+       Progress is reported by 'progress' (ProgressMonitor), which calls back dl_bar if any
+       at its pace (not per block) to show progress status. If the server accepts range, get
+       chunks starting at http_chunk_size (then sized to the throughput, upto chunk_max,
+       see ChunkController) over upto 'connections' at once (int, or a ConnectionBudget
+       shared with other transfers), and keep track of them
+       in a manifest so that an interrupted download resumes with just the missing ranges
+       (see _http_stream_ranges). last_modify of the stream, if given, is checked on resume.
+       Transfer rate is kept under the global set_rate_limit() and this 'rate_limit' if any
+       (bytes/sec, or a TokenBucket shared with other transfers).
     """
     if not url or not fn or not tot_bytes or not block_size: return ""
-    # DO NOT accept GZIP if streaming (most-like bytedata)
+    # DO NOT accept GZIP if streaming (most-like bytedata). (copy, not to touch caller's)
+    headers = dict(headers)
     headers.pop('Accept-Encoding', None)
     if qs is not None:
         # adding more querys onto url
@@ -220,124 +829,511 @@ def http_stream(url=None, headers=std_http_headers, qs=None, fn=None,
         _tmpflag = _tmprsp.getheader('Accept-Ranges', default=None) # Accept-Ranges: bytes
         if _tmpflag: isRange = True
         #print(_tmprsp.info())  # DEBUG ONLY
-
-    class _StreamContext(dict):
-        __getattr__ = dict.get
-        __setattr__ = dict.__setitem__
-        __delattr__ = dict.__delitem__
-    ctx = _StreamContext()
     # download starts (DO NOT use yield generator, >30times slow)
+    limiters = _limiters(rate_limit)
+    budget = (connections if isinstance(connections, ConnectionBudget)
+              else ConnectionBudget(connections or 1))
+    xfer = progress.add(fn, tot_bytes, dl_bar)
+    _res = ""
+    try:
+        if isRange:
+            ctl = ChunkController(http_chunk_size, chunk_max=chunk_max, block_size=block_size)
+            _stream_stats_add(fn, ctl)
+            _res = _http_stream_ranges(url, headers=headers, fn=fn, tot_bytes=tot_bytes,
+                                       xfer=xfer, ctl=ctl, budget=budget,
+                                       retries=retries, last_modify=last_modify,
+                                       limiters=limiters)
+            if not isinstance(_res, ValueError): return _res
+            logger.error("%s. Restart without range", _res)
+            xfer.parts = []         # start over
+        ctl = ChunkController(block_size=block_size)
+        _stream_stats_add(fn, ctl)
+        with budget:                # one connection of it for the whole request
+            _res = _http_stream_whole(url, headers=headers, fn=fn, tot_bytes=tot_bytes,
+                                      xfer=xfer, ctl=ctl, limiters=limiters)
+        return _res
+    except BaseException as e:
+        _res = e
+        raise
+    finally:
+        progress.finish(xfer, _res)
 
-    with open(fn+".partial", "ab") as fp:
-        # check file
-        if isRange: cur_bytes = fp.tell()           # resume (caller check content not changed)
-        else:       fp.seek(0,0) ; cur_bytes = 0    # restart
-        ctx.begin = time.time()         # start time
-        while cur_bytes < tot_bytes:    # will be just one loop if not using range
-            # initialize ctx
-            ctx.range_lp = cur_bytes
-            # create request
-            req = request.Request(url, headers=headers)
-            if isRange:                 # add range in request
-                ctx.chunk_sz = random.randint(int(http_chunk_size * 0.95), http_chunk_size)
-                ctx.range_rp = min(ctx.range_lp+ctx.chunk_sz-1, tot_bytes-1)
-                ctx.chunk_sz = ctx.range_rp - ctx.range_lp + 1  # (correct size)
-                req.add_header('Range', "bytes=%d-%d" % (ctx.range_lp, ctx.range_rp))
-            else:
-                ctx.chunk_sz = None
-                ctx.range_rp = tot_bytes
-
-            # open stream url
-            try:
-                rsp = request.urlopen(req, timeout=120)
-            except HTTPError as e:
-                #ex: urllib.error.HTTPError: HTTP Error 403: Forbidden, 404: Not Found
-                fp.close()
-                return e
-            #print("request(%d):%d-%d, current:%d" % (ctx.chunk_sz, ctx.range_lp, ctx.range_rp, cur_bytes)) # DEBUG ONLY
-            # check Content-Range and Content-Lengh in range response
-            if isRange:
-                _rsp_range = rsp.getheader('Content-Range', default=None)
-                #print("Content-Range: ", _rsp_range)   # DEBUG ONLY
-                if _rsp_range:
-                    _ptrn_range = r'bytes\s*(\d+)-(\d+)?(?:/(\d+))?'
-                    # check if match request
-                    _mobj = re.search(_ptrn_range, _rsp_range)
-                    if _mobj:
-                        _lp_range = int(_mobj.group(1))
-                        _rp_range = int(_mobj.group(2)) if _mobj.group(2) else None
-                        _tot_size = int(_mobj.group(3)) if _mobj.group(3) else None
-                        if _lp_range != ctx.range_lp:
-                            logger.error("Unexpected range reply than requested (%d): '%s'",
-                                        ctx.range_lp, _rsp_range)
-                            fp.seek(0,0) ; cur_bytes = 0
-                            isRange = False
-                            continue
-                        if _rp_range and _rp_range != ctx.range_rp:
-                            logger.debug("Adjust range end (%d) to server reply: '%s'",
-                                         ctx.range_rp, _rsp_range)
-                            ctx.range_rp = _rp_range
-                        if _tot_size and _tot_size != tot_bytes:
-                            logger.warning("Got a different total size: '%s'", _rsp_range)
-                _rsp_length = rsp.getheader('Content-Length', default=None)
-                if _rsp_length and (int(_rsp_length) != ctx.chunk_sz):
-                    logger.warning("Adjusted range length %d to server reply %d",
-                                    ctx.chunk_sz, int(_rsp_length))
-                    ctx.chunk_sz = int(_rsp_length)
-
-            # loop started to get data
-            before = time.time()                # loop start (measure RTT to find best buffer size)
-            buf_sz = block_size
-            while True:
-                data = rsp.read(buf_sz)
-                _len = len(data)
-                if _len == 0:
-                    if cur_bytes < ctx.range_rp:
-                        logger.warning("http stream ends prematured, %d of %d bytes",
-                                        cur_bytes, ctx.range_rp)
+
+class ChunkController(object):
+    """Size the range requests and reads of a stream by its measured throughput, and detect
+       when the server throttles it. Shared by the workers of the stream.
+       - chunk: takes ~chunk_secs at the rate of a connection, in [chunk_min,chunk_max]
+         (chunk_max defaults to 4 times the initial chunk). Grows while the time to first
+         byte dominates a chunk.
+       - read buffer: ~buf_secs of data, in [block_size,4MB].
+       - throttle: the rate of a window of reads drops under throttle_ratio of the peak.
+         The range in flight is cut (rest refetched in a new request) and chunk_max set
+         to half the bytes it got, upto max_cuts times. Then the rate is taken as it is.
+       Decisions are kept for stats() (see stream_stats()).
+    """
+    WINDOW = 0.5                # secs of reads measured at once
+    _BUF_MAX = 4194304          # Do not surpass 4MB
+    _EWMA = 0.3                 # weight of a new sample
+
+    def __init__(self, chunk_size=None, chunk_min=262144, chunk_max=None, block_size=1*1024,
+                 chunk_secs=4.0, buf_secs=0.05, throttle_ratio=0.25, max_cuts=8):
+        self.lock = threading.Lock()
+        self.chunk_size = chunk_size                # None: no range (single request)
+        self.chunk_min = min(chunk_min, chunk_size or chunk_min)
+        self.chunk_max = max(chunk_max or 4*(chunk_size or 0), chunk_size or 0)
+        self.block_size = block_size
+        self.buf_size = max(block_size, 65536)
+        self.chunk_secs = chunk_secs
+        self.buf_secs = buf_secs
+        self.throttle_ratio = throttle_ratio
+        self.max_cuts = max_cuts
+        self.rate = None        # bytes/sec of a connection (ewma)
+        self.peak = 0.0
+        self.ttfb = None        # secs (ewma)
+        self.throttled = False
+        self.counts = {"chunks": 0, "windows": 0, "throttles": 0, "cuts": 0}
+        self.decisions = collections.deque(maxlen=32)    # (secs from begin, what, value)
+        self.begin = time.time()
+
+    def _decide(self, what, value):
+        self.decisions.append((round(time.time() - self.begin, 3), what, value))
+        logger.debug("stream %s: %s", what, value)
+
+    def _sample(self, rate):
+        """Take a new rate sample, and size read buffer by it (under lock)"""
+        self.rate = rate if self.rate is None else self.rate + self._EWMA*(rate - self.rate)
+        _buf = int(min(max(self.rate * self.buf_secs, self.block_size), self._BUF_MAX))
+        if not (self.buf_size/2 <= _buf <= self.buf_size*2):
+            self.buf_size = _buf
+            self._decide("buf_size", _buf)
+
+    def window(self, nbytes=0, secs=0.0, got=None):
+        """Record a window of reads, nbytes in secs. got is the bytes read so far of the range
+           in flight, if it could be cut. Return True if throttled and it shall be cut.
+        """
+        _rate = nbytes / max(secs, 1e-6)
+        with self.lock:
+            self.counts['windows'] += 1
+            self._sample(_rate)
+            if _rate >= self.throttle_ratio * self.peak:
+                self.peak = max(self.peak, _rate)
+                if self.throttled: self._decide("unthrottled", int(_rate))
+                self.throttled = False
+                return False
+            if not self.throttled:
+                self.throttled = True
+                self.counts['throttles'] += 1
+                self._decide("throttled", int(_rate))
+            if not self.chunk_size or got is None: return False
+            if self.counts['cuts'] >= self.max_cuts:
+                self.peak = _rate           # cutting doesn't help. take the rate as it is
+                return False
+            self.counts['cuts'] += 1
+            _max = max(self.chunk_min, min(self.chunk_max, int(got/2)))
+            if _max < self.chunk_max:       # server throttles requests beyond ~got bytes
+                self.chunk_max = _max
+                self._decide("chunk_max", _max)
+            return True
+
+    def chunk_done(self, nbytes=0, ttfb=0.0, secs=0.0):
+        """Record a range request of nbytes, with ttfb secs to first byte and secs of body,
+           and size the next chunks
+        """
+        with self.lock:
+            self.counts['chunks'] += 1
+            self.ttfb = ttfb if self.ttfb is None else self.ttfb + self._EWMA*(ttfb - self.ttfb)
+            if not nbytes: return
+            # too quick for a window, or windows gave no sample (ex. reads sleeping in a limiter)
+            if secs < self.WINDOW/5 or self.rate is None: self._sample(nbytes / max(secs, 1e-6))
+            if not self.chunk_size: return
+            _sz = self.rate * self.chunk_secs
+            if self.ttfb > 0.25 * max(secs, 1e-6): _sz = max(_sz, self.chunk_size*2)
+            # within limits, and by no more than x2 or /2 at a time
+            _sz = int(min(max(_sz, self.chunk_min, self.chunk_size/2),
+                          self.chunk_max, self.chunk_size*2))
+            if abs(_sz - self.chunk_size) > self.chunk_size * 0.1:
+                self.chunk_size = _sz
+                self._decide("chunk_size", _sz)
+
+    def stats(self):
+        with self.lock:
+            _ret = {"chunk_size": self.chunk_size, "chunk_max": self.chunk_max,
+                    "buf_size": self.buf_size, "rate": int(self.rate or 0),
+                    "peak": int(self.peak), "ttfb": round(self.ttfb or 0.0, 4),
+                    "throttled": self.throttled, "decisions": list(self.decisions)}
+            _ret.update(self.counts)
+        return _ret
+
+
+_stream_stats = collections.OrderedDict()   # fn -> ChunkController of recent streams
+_STREAM_STATS_MAX = 32
+
+
+def _stream_stats_add(fn, ctl):
+    _stream_stats.pop(fn, None)
+    _stream_stats[fn] = ctl
+    while len(_stream_stats) > _STREAM_STATS_MAX: _stream_stats.popitem(last=False)
+
+
+def stream_stats():
+    """Return throughput/chunking stats and decisions of recent streams as {fn: stats}"""
+    return {k: v.stats() for k,v in list(_stream_stats.items())}
+
+
+class _RecvBuffer(object):
+    """Receive buffer of one reader (a transfer, or a worker of it) reused for all its reads,
+       so the read loop allocates no bytes per read. Grows to the largest read asked (upto
+       ChunkController's 4MB, larger reads are sliced to it), never shrinks.
+    """
+    __slots__ = ('buf', 'view')
+
+    def __init__(self, size=65536):
+        self.buf = bytearray(min(size, ChunkController._BUF_MAX))
+        self.view = memoryview(self.buf)
+
+    def get(self, size):
+        """Return memoryview of the first 'size' bytes of the buffer (at most 4MB)"""
+        size = min(size, ChunkController._BUF_MAX)
+        if size > len(self.buf):
+            self.buf = bytearray(min(max(size, 2*len(self.buf)), ChunkController._BUF_MAX))
+            self.view = memoryview(self.buf)
+        return self.view[:size]
+
+
+def _read_body(rsp=None, fp=None, want=None, ctl=None, on_data=None, rbuf=None):
+    """Copy the body of rsp (upto 'want' bytes if given) to fp through rbuf (_RecvBuffer),
+       in reads sized by ctl, and call back on_data(<#bytes>) per read. Time in reads is
+       measured in windows for ctl. Return tuple (<#bytes copied>, True if ctl cut it for
+       being throttled)
+    """
+    if rbuf is None: rbuf = _RecvBuffer(ctl.buf_size)
+    _got = 0
+    _win_bytes, _win_secs = 0, 0.0
+    while want is None or _got < want:
+        _mv = rbuf.get(ctl.buf_size if want is None else min(ctl.buf_size, want - _got))
+        before = time.time()
+        _n = rsp.readinto(_mv)
+        _win_secs += time.time() - before   # reads only (not rate limiter sleeps)
+        if not _n: break
+        fp.write(_mv[:_n])                  # straight from the buffer (no copy)
+        _got += _n
+        _win_bytes += _n
+        if on_data: on_data(_n)
+        if _win_secs >= ctl.WINDOW:
+            _can_cut = want is not None and want - _got > ctl.chunk_min
+            _cut = ctl.window(_win_bytes, _win_secs, _got if _can_cut else None)
+            _win_bytes, _win_secs = 0, 0.0
+            if _cut: return (_got, True)
+    if _win_secs >= ctl.WINDOW/5: ctl.window(_win_bytes, _win_secs)
+    return (_got, False)
+
+
+@traced("http.stream_whole")
+def _http_stream_whole(url=None, headers=None, fn=None, tot_bytes=None, xfer=None,
+                       ctl=None, limiters=None):
+    """Get url in one request (no range) into fn+".partial" from start, then rename it to fn.
+       Reads are sized by ctl (ChunkController) and counted in xfer (Transfer).
+       Return no-empty if not ok.
+    """
+    try:
+        rsp = http_open(url, headers=headers, timeout=120)
+    except HTTPError as e:
+        #ex: urllib.error.HTTPError: HTTP Error 403: Forbidden, 404: Not Found
+        return e
+    _parts, _slot = xfer.parts, xfer.slot()
+
+    def _on_data(n):
+        _parts[_slot] += n              # count for progress
+        for _limiter in limiters or []: _limiter.consume(n)     # apply rate limit(s)
+
+    with rsp, open(fn+".partial", "wb") as fp:
+        cur_bytes, _ = _read_body(rsp, fp, ctl=ctl, on_data=_on_data)
+    if cur_bytes < tot_bytes:
+        logger.warning("http stream ends prematured, %d of %d bytes", cur_bytes, tot_bytes)
+
+    # rename file
+    os.replace(fn+".partial", fn)
+    return ""
+
+
+class _StreamManifest(object):
+    """Sidecar file (fn+".json") of a range download into fn. It records the byte ranges
+       of fn completed, and the size/last_modify of the stream they are of. A manifest of
+       another version of the stream (or of a file not in the expected size) is stale.
+    """
+    _VERSION = 1
+
+    def __init__(self, fn=None, tot_bytes=0, last_modify=None):
+        self.fn = fn+".json"
+        self.data_fn = fn
+        self.tot_bytes = tot_bytes
+        self.last_modify = str(last_modify) if last_modify else None
+        self.done = []              # sorted, merged list of [lp,rp] completed
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Load the manifest. Return False if missing or stale (then nothing is done)"""
+        self.done = []
+        try:
+            with open(self.fn, "rb") as fp: _dct = json.loads(fp.read().decode('utf-8'))
+        except (OSError, ValueError):
+            return False
+        if (not isinstance(_dct, dict) or _dct.get('version') != self._VERSION or
+            _dct.get('clen') != self.tot_bytes or _dct.get('last_modify') != self.last_modify or
+            not os.path.isfile(self.data_fn) or os.path.getsize(self.data_fn) != self.tot_bytes):
+            logger.warning("Ignored stale resume manifest %s", self.fn)
+            return False
+        self.done = [list(i) for i in _dct.get('done', [])]
+        return True
+
+    def save(self):
+        _dct = {"version": self._VERSION, "clen": self.tot_bytes,
+                "last_modify": self.last_modify, "done": self.done}
+        with span("disk.manifest"):
+            atomic_write(self.fn, json.dumps(_dct).encode('utf-8'), sync=False)
+
+    def add(self, lp, rp):
+        """Record [lp,rp] as completed (data already written) and save the manifest"""
+        with self.lock:
+            _new = []
+            for _l, _r in sorted(self.done + [[lp, rp]]):
+                if _new and _l <= _new[-1][1] + 1: _new[-1][1] = max(_new[-1][1], _r)
+                else: _new.append([_l, _r])
+            self.done = _new
+            self.save()
+
+    def missing(self):
+        """Return list of (lp,rp) not completed yet"""
+        _ret = [] ; _pos = 0
+        for _l, _r in self.done:
+            if _l > _pos: _ret.append((_pos, _l-1))
+            _pos = max(_pos, _r+1)
+        if _pos < self.tot_bytes: _ret.append((_pos, self.tot_bytes-1))
+        return _ret
+
+    def remove(self):
+        try: os.remove(self.fn)
+        except OSError: pass
+
+
+class _RangeQueue(object):
+    """Hand out byte ranges (lp,rp,tries) of the given gaps [(lp,rp),..] in chunks of the
+       current ctl.chunk_size to concurrent workers. A range that failed or came short is
+       put back to be fetched again first.
+    """
+    def __init__(self, gaps=None, ctl=None):
+        self.lock = threading.Lock()
+        self.gaps = [list(i) for i in reversed(gaps or [])]   # pop from the end
+        self.ctl = ctl
+        self.redo = []              # ranges to refetch
+
+    def next(self):
+        with self.lock:
+            if self.redo: return self.redo.pop()
+            if not self.gaps: return None
+            _lp, _end = self.gaps[-1]
+            # randomize chunk size (95%~100%) not to look like a bot
+            _chunk = self.ctl.chunk_size if self.ctl else None
+            _sz = random.randint(int(_chunk * 0.95), _chunk) if _chunk else _end - _lp + 1
+            _rp = min(_lp+_sz-1, _end)
+            if _rp == _end: self.gaps.pop()
+            else:           self.gaps[-1][0] = _rp + 1
+            return (_lp, _rp, 0)
+
+    def put_back(self, lp, rp, tries):
+        with self.lock: self.redo.append((lp, rp, tries))
+
+
+@traced("http.range", attrs=lambda url=None, headers=None, lp=0, rp=0, *args, **kwargs:
+        {"lp": lp, "rp": rp})
+def _http_range(url=None, headers=None, lp=0, rp=0, fp=None, ctl=None, on_data=None,
+                rbuf=None):
+    """Get bytes [lp,rp] of url and write them at the same offset of fp, received into rbuf
+       (_RecvBuffer of the caller). Call back on_data(<#bytes>) per block. Timing of it is
+       recorded in ctl (ChunkController).
+       Return tuple (<#bytes written from lp>, error), where #bytes may be less than asked
+       if the server cut the range, the stream ended early or failed, or ctl cut it for
+       being throttled. error is None, HTTPError, ValueError if the server didn't reply the
+       range asked, or other exception of the connection.
+    """
+    _headers = dict(headers or {})
+    _headers['Range'] = "bytes=%d-%d" % (lp, rp)
+    _got = 0
+    try:
+        before = time.time()
+        rsp = http_open(url, headers=_headers, timeout=120)
+        _ttfb = time.time() - before    # headers in (close enough to first byte)
+        with rsp:
+            _rsp_range = rsp.getheader('Content-Range', default=None)
+            _mobj = re.search(r'bytes\s*(\d+)-(\d+)?(?:/(\d+))?', _rsp_range or "")
+            if rsp.status != 206 or not _mobj or int(_mobj.group(1)) != lp:
+                return (0, ValueError("Unexpected range reply than requested (%d-%d): '%s'"
+                                      % (lp, rp, _rsp_range)))
+            if _mobj.group(2) and int(_mobj.group(2)) < rp:
+                logger.debug("Range end (%d) cut by server reply: '%s'", rp, _rsp_range)
+                rp = int(_mobj.group(2))
+            fp.seek(lp, 0)
+            before = time.time()
+            _got, _cut = _read_body(rsp, fp, want=rp-lp+1, ctl=ctl, on_data=on_data, rbuf=rbuf)
+            ctl.chunk_done(_got, _ttfb, time.time() - before)
+            if _cut: logger.debug("Range %d-%d throttled. cut at %d", lp, rp, lp+_got)
+    except (HTTPError, OSError, http.client.HTTPException) as e:
+        return (_got, e)
+    finally:
+        fp.flush()                      # written data reaches the file before it's recorded
+    return (_got, None)
+
+
+def _http_stream_ranges(url=None, headers=None, fn=None, tot_bytes=None, xfer=None,
+                        ctl=None, budget=None, retries=3, last_modify=None, limiters=None):
+    """Fetch chunks (sized by ctl) of a range-capable url with upto budget.size workers, each
+       range request holding a connection of budget (ConnectionBudget) while in flight, into a
+       preallocated fn+".partial" (positional writes), then rename it to fn. Completed
+       ranges are recorded in the manifest fn+".partial.json", so a later call resumes
+       with just the missing ones. Each chunk is retried upto 'retries' times.
+       Workers count their bytes in xfer (Transfer), and consume them from 'limiters'
+       (shared TokenBucket list).
+       Return no-empty if not ok (ValueError if the server doesn't do range right).
+    """
+    _partial = fn+".partial"
+    manifest = _StreamManifest(_partial, tot_bytes, last_modify)
+    if manifest.load():
+        logger.info("Resume %s, %d of %d bytes done", fn,
+                    sum(r-l+1 for l,r in manifest.done), tot_bytes)
+    else:
+        with open(_partial, "wb") as fp:
+            fp.truncate(tot_bytes)  # preallocate (sparse if fs supports)
+        manifest.save()
+    _gaps = manifest.missing()
+
+    ranges = _RangeQueue(_gaps, ctl)
+    lock = threading.Lock()
+    state = {"error": None}
+    xfer.slot(tot_bytes - sum(r-l+1 for l,r in _gaps))        # done before (resume)
+    xfer._last = (xfer.begin, xfer.cur_bytes)                   # not in the rate
+
+    def _worker():
+        _parts, _slot = xfer.parts, xfer.slot()
+
+        def _on_data(n):
+            _parts[_slot] += n                  # count for progress (own slot, no lock)
+            for _limiter in limiters or []: _limiter.consume(n)     # apply rate limit(s)
+
+        rbuf = _RecvBuffer(ctl.buf_size)        # own buffer, reused for all its ranges
+        with open(_partial, "r+b") as fp:       # own file obj for independent offset
+            while not state['error']:
+                rng = ranges.next()
+                if rng is None: break
+                _lp, _rp, _tries = rng
+                with budget:                    # shared with other transfers if any
+                    _got, _err = _http_range(url, headers=headers, lp=_lp, rp=_rp, fp=fp,
+                                             ctl=ctl, on_data=_on_data, rbuf=rbuf)
+                if _got: manifest.add(_lp, _lp+_got-1)
+                if _lp + _got > _rp: continue       # range done
+                # short or failed. redo the rest
+                if isinstance(_err, HTTPError) and _err.code in (403, 404, 410):
+                    _tries = retries                # url wrong or expired
+                if isinstance(_err, ValueError) and not _got:
+                    _tries = retries                # server doesn't do range right
+                if _tries >= retries:
+                    logger.error("Range %d-%d failed after %d tries: %s",
+                                 _lp+_got, _rp, _tries+1, _err)
+                    with lock: state['error'] = state['error'] or _err
                     break
-                fp.write(data)
-                cur_bytes += len(data)
-                # send to the download progress callback func
-                if dl_bar: dl_bar(cur_bytes, tot_bytes, ctx.begin)
-                # apply rate_limit. (to implement... so far rate_limit=None)
-                slow_down(ctx.begin, time.time(), cur_bytes, rate_limit=None)
-
-                # adjust buf_sz (like tcp win size. /2 or *2) (MAY NOT HELP MUCH)
-                _nmin = max(_len/2.0, 1.0)
-                _nmax = min(_len*2.0, 4194304)  # Do not surpass 4MB
-                after = time.time()
-                _elapsed = after - before
-                before = after                  # set new loop start time
-                if _elapsed < 0.001:            # =_len*1000 MB/s
-                    buf_sz = int(_nmax)         # network very fast (RTT<1ms)
-                elif _len/_elapsed > _nmax:
-                    buf_sz = int(_nmax)         # > _len MB/s (i.e. RTT<1s)
+                if _got and not _err:               # cut short (by server or throttled)
+                    logger.debug("Range %d-%d cut short. refetching", _lp+_got, _rp)
                 else:
-                    buf_sz = int(_nmin)
-                #print("buffer size: ",buf_sz)  # DEBUG ONLY
+                    logger.warning("Range %d-%d incomplete (%s). retrying", _lp+_got, _rp, _err or "no data")
+                ranges.put_back(_lp+_got, _rp, _tries+1 if not _got else _tries)
 
-            # one chunk done
-            if cur_bytes == ctx.range_lp:       # nothing downloaded in the chunk
-                break
-        # download done
-        pass
+    with concurrent.futures.ThreadPoolExecutor(max_workers=budget.size) as pool:
+        # (in a copy of this context, for the spans of workers to be of this stream)
+        _futs = [pool.submit(contextvars.copy_context().run, _worker) for _ in range(budget.size)]
+    for _fut in _futs: _fut.result()        # re-raise unexpected errors of workers
+    if state['error']:
+        if isinstance(state['error'], ValueError): manifest.remove()
+        return state['error']
+    if manifest.missing():
+        return ValueError("http stream incomplete, missing %s" % manifest.missing()[:3])
 
     # rename file
-    os.rename(fn+".partial", fn)
+    os.replace(_partial, fn)
+    manifest.remove()
     return ""
 
 
-def slow_down(start_epoch=None, now=None, received=0, rate_limit=None):
-    """Slow download speed if over the rate_limit"""
-    if (not rate_limit) or (received == 0) or (not start_epoch) or (not now):
-        return
-    _elapsed = now - start_epoch
-    if _elapsed <= 0.0: return
-    _speed = float(received) / _elapsed
-    if _speed > rate_limit:
-        _sleep_time = float(received) / rate_limit - _elapsed
-        if _sleep_time > 0: time.sleep(_sleep_time)
+async def http_stream_async(url=None, **kwargs):
+    """asyncio counterpart of http_stream. Takes the same keyword args. Runs in a thread of
+       the context's executor (see run_blocking), its range workers in threads of their own
+    """
+    return await run_blocking(http_stream, url=url, **kwargs)
+
+
+class TokenBucket(object):
+    """Token bucket limiting a rate in bytes/sec, shared by any number of threads.
+       consume(n) takes n tokens, and sleeps for the debt if the bucket goes below 0.
+       The bucket holds upto 'burst' bytes (default 1 sec of rate, at least 64KB).
+    """
+    def __init__(self, rate=None, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 65536))
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n=0):
+        with self.lock:
+            _now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (_now - self.stamp) * self.rate)
+            self.stamp = _now
+            self.tokens -= n
+            _wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if _wait > 0: time.sleep(_wait)         # sleep out of lock. others take own debt
+
+
+class ConnectionBudget(object):
+    """Connections at once shared by any number of transfers (ex. the streams of a video).
+       A request holds one while in flight ('with budget:'), so the ones a transfer frees
+       (done, or between its ranges) go to the others still running.
+    """
+    def __init__(self, size=1):
+        self.size = max(int(size), 1)
+        self._sem = threading.BoundedSemaphore(self.size)
+
+    def __enter__(self):
+        self._sem.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._sem.release()
+
+
+_rate_limiter = None            # global TokenBucket shared by all transfers (None=no limit)
+
+
+def set_rate_limit(rate=None, burst=None):
+    """Set global download rate limit in bytes/sec shared by all transfers (None=no limit)"""
+    global _rate_limiter
+    _rate_limiter = TokenBucket(rate, burst) if rate else None
+
+
+def parse_rate(rate=None):
+    """Convert rate like 500K, 2.5M, 1G (bytes) to int bytes. None if not given"""
+    if not rate: return None
+    mobj = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kKmMgG]?)[bB]?\s*$', str(rate))
+    if not mobj: raise ValueError("invalid rate '%s'" % rate)
+    return int(float(mobj.group(1)) * {"": 1, "k": 1024, "m": 1048576, "g": 1073741824}[
+               mobj.group(2).lower()])
+
+
+def _limiters(rate_limit=None):
+    """Return list of TokenBucket(s) a transfer shall consume from: global and own one.
+       rate_limit may be a TokenBucket to share with other transfers (ex. of the same video)
+    """
+    _ret = [_rate_limiter] if _rate_limiter else []
+    if isinstance(rate_limit, TokenBucket): _ret.append(rate_limit)
+    elif rate_limit: _ret.append(TokenBucket(rate_limit))
+    return _ret
 
 
 def sanity_url(url):
@@ -362,7 +1358,27 @@ def json_load(jstr):
         return None
     try:
         res = json.loads(jstr)
-    except JSONDecodeError as e:
+    except json.JSONDecodeError as e:
+        logger.error("%s at (%d,%d)", e.msg, e.lineno, e.colno)
+        return None
+    return res
+
+
+_json_decoder = json.JSONDecoder()
+
+
+def json_extract(patterns, string):
+    r"""Decode the json object that starts right after the match of patterns (ex. an
+       assignment 'x\s*=\s*') in string, in one pass with raw_decode. So neither a lazy
+       '{.+?}' regex over the object is needed, nor it breaks if '};' is in a string value.
+       Return python object or None
+    """
+    if not string: return None
+    mobj = re_search(patterns, string, logging=False)
+    if not mobj: return None
+    try:
+        res, _end = _json_decoder.raw_decode(string, mobj.end())
+    except json.JSONDecodeError as e:
         logger.error("%s at (%d,%d)", e.msg, e.lineno, e.colno)
         return None
     return res
@@ -383,21 +1399,71 @@ def str_decode(estr=None, part=None):   # needed??, js
 # Enhanced system utils
 # --------------------------
 
+class PatternSet(object):
+    """A list of alternative regex patterns compiled once, tried in turn by search().
+       Records per pattern the scans, hits and time spent. If adaptive, the patterns that
+       hit most are tried first (ties keep the given order). Named sets are listed in
+       pattern_stats().
+    """
+    def __init__(self, patterns=None, flags=0, adaptive=False, name=None):
+        if isinstance(patterns, str): patterns = [patterns]   # convert pattern to 1-elem list
+        self.patterns = list(patterns or [])
+        self.compiled = [re.compile(r''+p, flags) for p in self.patterns]
+        self.adaptive = adaptive
+        self.name = name
+        self.order = list(range(len(self.patterns)))     # idx of patterns in try order
+        self.scans = [0] * len(self.patterns)
+        self.hits  = [0] * len(self.patterns)
+        self.secs  = [0.0] * len(self.patterns)
+        self.lock = threading.Lock()
+        if name: _pattern_sets[name] = self
+
+    def search(self, string):
+        """Return tuple (MatchObj,idx) of the first pattern matched, or (None,-1)"""
+        m = None ; idx = -1
+        for i in self.order:            # list as bound now: reorder rebinds, never sorts in place
+            _t = time.perf_counter()
+            m = self.compiled[i].search(string)
+            _t = time.perf_counter() - _t
+            with self.lock:
+                self.scans[i] += 1 ; self.secs[i] += _t
+                if m: self.hits[i] += 1
+            if m: idx = i ; break
+        if m and self.adaptive and self.order[0] != idx:
+            with self.lock:
+                self.order = sorted(self.order, key=lambda k: -self.hits[k])    # stable sort
+        return (m, idx)
+
+    def stats(self):
+        """Return list of {pattern,hits,scans,secs} in current try order"""
+        with self.lock:
+            return [{"pattern": self.patterns[i], "hits": self.hits[i], "scans": self.scans[i],
+                     "secs": round(self.secs[i], 6)} for i in self.order]
+
+
+_pattern_sets = {}              # named PatternSet
+_re_cache = {}                  # (patterns,flags) -> PatternSet for plain patterns of re_search
+
+
+def pattern_stats():
+    """Return hit/time stats of named PatternSet(s) as {name: [stats of each pattern]}"""
+    return {k: v.stats() for k,v in _pattern_sets.items()}
+
+
 def re_search(patterns, string, ret_idx=False, flags=0, logging=True):
-    """Enhance re.search to support multi patterns, with optional search flags.
+    """Enhance re.search to support multi patterns (or a PatternSet), with optional search flags.
        return MatchObj or tuple (MatchObj,idx) if ret_idx is set for idx the pattern
     """
-    if type(patterns) == str:
-        patterns = [patterns]   # convert pattern to 1-elem list
-    found = False
-    for idx in range(len(patterns)):
-        p = patterns[idx]
-        r = re.compile(r''+p, flags)
-        m = r.search(string)
-        if m: found = True; break;
-    if not found: idx = -1
-    else:
-       logger.debug("pattern '%s' matched. results: %s", p, m.group(0) if logging else "...skipped...")
+    if not isinstance(patterns, PatternSet):
+        _key = (patterns if isinstance(patterns, str) else tuple(patterns), flags)
+        if _key not in _re_cache:
+            if len(_re_cache) >= 256: _re_cache.clear()
+            _re_cache[_key] = PatternSet(patterns, flags)
+        patterns = _re_cache[_key]
+    m, idx = patterns.search(string)
+    if m:
+       logger.debug("pattern '%s' matched. results: %s", patterns.patterns[idx],
+                    m.group(0) if logging else "...skipped...")
     if ret_idx: return (m, idx)
     else:       return m
 
@@ -407,10 +1473,10 @@ def re_search(patterns, string, ret_idx=False, flags=0, logging=True):
 # --------------------------
 
 def float_to_srt_time(flt):
-    """Convert 4.22 to 00:00:04.220"""
-    frac,inte = math.modf(flt)
-    insec = time.strftime("%H:%M:%S", time.gmtime(inte))    # use as epoch sec
-    inms  = "{:03.0f}".format(frac*1000)                    # pad/trunc to ms
-    return insec+","+inms
+    """Convert 4.22 to 00:00:04,220"""
+    _sec, _ms = divmod(int(round(flt*1000)), 1000)          # whole ms (no ',1000')
+    _min, _sec = divmod(_sec, 60)
+    _hr, _min = divmod(_min, 60)
+    return "%02d:%02d:%02d,%03d" % (_hr, _min, _sec, _ms)
 
 